@@ -0,0 +1,123 @@
+"""
+Бенчмарк цены логов на пути заказа (POST /orders, покупка по тарифу).
+
+  disabled — логи через очередь, трассировка заказов выключена (LOG_TRACE_SAMPLE=0);
+  queued   — трассируется каждый заказ, JSON и запись — в потоке QueueListener;
+  sync     — трассируется каждый заказ, JSON и запись прямо в потоке запроса
+             (как прежние print в create_order).
+
+Покупатели работают параллельно (--buyers потоков) через один TestClient; на SQLite
+без SKIP LOCKED часть параллельных заказов получает 400 (столбец conflicts),
+для чистых цифр там — --buyers 1.
+Логи пишутся в --log-file: /dev/null показывает цену форматирования, файл на
+медленном диске или pipe — цену блокирующей записи.
+
+    cd backend
+    DATABASE_URL=sqlite:////tmp/bench_logging.db python benchmarks/bench_logging.py --orders 300 --buyers 4
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+
+
+def seed(tickets: int):
+    import models, inventory
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        ev = models.Event(title="bench", start_datetime=datetime.utcnow() + timedelta(days=30))
+        db.add(ev)
+        db.flush()
+        tier = models.PriceTier(event_id=ev.id, name="Dancefloor", price=Decimal("10.00"), capacity=tickets)
+        db.add(tier)
+        db.flush()
+        db.bulk_insert_mappings(models.Ticket, [
+            {"event_id": ev.id, "tier_id": tier.id, "status": "available", "price": tier.price, "qr_code": str(uuid.uuid4())}
+            for _ in range(tickets)
+        ])
+        inventory.init_tier(db, tier.id, ev.id, tickets)
+        db.commit()
+        return tier.id
+    finally:
+        db.close()
+
+
+def buyer_headers(client, n: int):
+    import models
+    from database import SessionLocal
+
+    email = f"bench-{uuid.uuid4().hex[:8]}-{n}@bench.com"
+    token = client.post("/auth/register", json={"email": email, "password": "secret"}).json()["access_token"]
+    db = SessionLocal()
+    try:
+        db.query(models.User).filter_by(email=email).update({"wallet_balance": 10 ** 9})
+        db.commit()
+    finally:
+        db.close()
+    return {"Authorization": f"Bearer {token}"}
+
+
+def run(app, mode: str, orders: int, buyers: int, log_file):
+    import logs
+    from fastapi.testclient import TestClient
+
+    logs.shutdown()
+    logs.LOG_TRACE_SAMPLE = 0.0 if mode == "disabled" else 1.0
+    logs.configure(level="INFO", stream=log_file, queued=mode != "sync")
+    tier_id = seed(orders)
+    per_buyer = orders // buyers
+
+    # один клиент на все потоки; выход из него (lifespan) останавливает и слушателя логов
+    with TestClient(app) as client:
+        headers = [buyer_headers(client, n) for n in range(buyers)]
+
+        def buyer(n):
+            latencies, conflicts = [], 0
+            for _ in range(per_buyer):
+                started = time.perf_counter()
+                r = client.post("/orders", json={"items": [{"tier_id": tier_id}]}, headers=headers[n])
+                latencies.append(time.perf_counter() - started)
+                # без SKIP LOCKED (SQLite) параллельные покупатели иногда выбирают один билет
+                assert r.status_code in (200, 400), r.text
+                conflicts += r.status_code == 400
+            return latencies, conflicts
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=buyers) as pool:
+            results = list(pool.map(buyer, range(buyers)))
+        elapsed = time.perf_counter() - started
+    latencies = sorted(sum((r[0] for r in results), []))
+    conflicts = sum(r[1] for r in results)
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99) - 1], conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=300)
+    parser.add_argument("--buyers", type=int, default=4)
+    parser.add_argument("--log-file", default=os.devnull)
+    args = parser.parse_args()
+
+    import logging
+    from main import app
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    print(f"{args.orders} orders, {args.buyers} buyers, logs -> {args.log_file}")
+    print(f"{'mode':9s} {'orders/s':>9s} {'p50 ms':>8s} {'p99 ms':>8s} {'conflicts':>9s}")
+    with open(args.log_file, "a") as log_file:
+        for mode in ("disabled", "queued", "sync"):
+            rate, p50, p99, conflicts = run(app, mode, args.orders, args.buyers, log_file)
+            print(f"{mode:9s} {rate:9.1f} {p50 * 1000:8.2f} {p99 * 1000:8.2f} {conflicts:9d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Бенчмарк проверки паролей Argon2: пропускная способность логина на ядро
+и задержка event loop во время всплеска логинов.
+
+  inline — argon2.verify прямо в event loop (как раньше в обработчике);
+  pool   — passwords.verify_password через ProcessPoolExecutor.
+
+Параллельно работает "каталожный" тикер: он раз в 10 мс просыпается и меряет,
+насколько event loop опоздал его разбудить — это задержка соседних запросов.
+
+    cd backend
+    python benchmarks/bench_login.py --logins 200 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - started - 0.01)
+
+
+async def run(mode: str, logins: int, password_hash: str):
+    import passwords
+
+    stop, lags = asyncio.Event(), []
+    tick = asyncio.create_task(ticker(stop, lags))
+
+    async def login():
+        if mode == "inline":
+            ok, _ = passwords.verify_password_sync("secret", password_hash)
+            await asyncio.sleep(0)
+        else:
+            ok, _ = await passwords.verify_password("secret", password_hash)
+        assert ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    return logins / elapsed, max(lags, default=0.0), p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+    import passwords
+
+    password_hash = passwords.hash_password_sync("secret")
+    passwords.start()
+    # дожидаемся запуска процессов пула, чтобы не мерить spawn
+    asyncio.run(asyncio.wait_for(passwords.verify_password("secret", password_hash), 60))
+
+    print(f"{args.logins} logins, Argon2 t={passwords.ARGON2_TIME_COST} m={passwords.ARGON2_MEMORY_COST} p={passwords.ARGON2_PARALLELISM}")
+    print(f"{'mode':6s} {'workers':>7s} {'logins/s':>9s} {'per core':>9s} {'loop lag max':>13s} {'p99':>8s}")
+    for mode, cores in (("inline", 1), ("pool", args.workers)):
+        rate, lag_max, lag_p99 = asyncio.run(run(mode, args.logins, password_hash))
+        print(f"{mode:6s} {cores:7d} {rate:9.1f} {rate / cores:9.1f} {lag_max * 1000:11.1f}ms {lag_p99 * 1000:6.1f}ms")
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Бенчмарк создания билетов события: время и пиковый RSS для 1k, 10k и 100k билетов.
+
+Каждый замер идёт в отдельном процессе, чтобы пиковый RSS не наследовался
+от предыдущего. Режим "orm" — прежний путь (объект Ticket на билет),
+"bulk" — inventory.materialize_tickets (COPY на PostgreSQL, insert() пачками иначе).
+
+    cd backend
+    python benchmarks/bench_materialize.py --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(mode: str, size: int, seats: int):
+    import models, inventory
+    from database import SessionLocal, init_db
+
+    init_db()
+    db = SessionLocal()
+    try:
+        venue = models.Venue(name="bench")
+        db.add(venue)
+        db.flush()
+        db.bulk_insert_mappings(models.Seat, [
+            {"venue_id": venue.id, "row_label": f"R{i // 100:04d}", "seat_number": i % 100 + 1,
+             "seat_type": "standard", "base_price": 1000}
+            for i in range(seats)
+        ])
+        ev = models.Event(title="bench", venue_id=venue.id, start_datetime=datetime.utcnow() + timedelta(days=30))
+        db.add(ev)
+        db.flush()
+        tier = models.PriceTier(event_id=ev.id, name="Standard", price=1000, capacity=size)
+        db.add(tier)
+        db.commit()
+
+        started = time.perf_counter()
+        seat_ids = inventory.venue_seat_ids(db, venue.id)
+        if mode == "orm":
+            for i in range(size):
+                db.add(models.Ticket(
+                    event_id=ev.id, seat_id=seat_ids[i] if i < len(seat_ids) else None, tier_id=tier.id,
+                    user_id=None, status="available", price=tier.price, qr_code=str(uuid.uuid4())
+                ))
+        else:
+            inventory.materialize_tickets(db, ev.id, [(tier.id, tier.price, size)], seat_ids)
+        db.commit()
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"mode": mode, "tickets": size, "seconds": round(elapsed, 3), "peak_rss_mb": round(peak_kb / 1024, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--modes", nargs="+", default=["orm", "bulk"], choices=["orm", "bulk"])
+    parser.add_argument("--seats", type=int, default=20000, help="мест в зале; остальные билеты без места")
+    parser.add_argument("--one", nargs=2, metavar=("MODE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        measure(args.one[0], int(args.one[1]), args.seats)
+        return
+
+    print(f"{'mode':6s} {'tickets':>8s} {'seconds':>9s} {'peak RSS MB':>12s}")
+    for size in args.sizes:
+        for mode in args.modes:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--one", mode, str(size), "--seats", str(args.seats)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"{r['mode']:6s} {r['tickets']:8d} {r['seconds']:9.3f} {r['peak_rss_mb']:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Бенчмарк истории заказов пользователя с 5k позиций (GET /orders/me).
+
+  joinedload — прежний обработчик: три цепочки joinedload и все заказы сразу;
+  page       — crud.get_user_orders: первая страница (одна проекция);
+  walk       — crud.get_user_orders: все страницы по курсору.
+
+Для каждого режима — лучшее время из --repeat и число SQL-запросов.
+
+    cd backend
+    DATABASE_URL=sqlite:////tmp/bench_orders.db python benchmarks/bench_orders.py --orders 1000 --items 5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(db, orders: int, items: int):
+    import models
+
+    user = models.User(email=f"bench-{time.time_ns()}@test.com", password_hash="x", full_name="bench")
+    venue = models.Venue(name="bench")
+    db.add_all([user, venue])
+    db.flush()
+    ev = models.Event(title="bench", venue_id=venue.id, start_datetime=datetime.utcnow() + timedelta(days=30))
+    db.add(ev)
+    db.flush()
+    tier = models.PriceTier(event_id=ev.id, name="Standard", price=1000, capacity=orders * items)
+    db.add(tier)
+    db.flush()
+    seat_ids = []
+    for i in range(orders * items):
+        seat = models.Seat(venue_id=venue.id, row_label=f"R{i // 100}", seat_number=i % 100 + 1, seat_type="standard", base_price=1000)
+        db.add(seat)
+        seat_ids.append(seat)
+    db.flush()
+
+    started = datetime(2024, 1, 1)
+    for o in range(orders):
+        order = models.Order(user_id=user.id, total_amount=1000 * items, status="paid", created_at=started + timedelta(minutes=o))
+        db.add(order)
+        db.flush()
+        tickets = [models.Ticket(event_id=ev.id, tier_id=tier.id, seat_id=seat_ids[o * items + i].id, user_id=user.id,
+                                 status="sold", price=1000, qr_code=f"qr-{o}-{i}") for i in range(items)]
+        db.add_all(tickets)
+        db.flush()
+        db.add_all([models.OrderItem(order_id=order.id, ticket_id=t.id, price=1000) for t in tickets])
+    db.commit()
+    return user.id
+
+
+def old_handler(db, user_id: int):
+    import models
+    from sqlalchemy.orm import joinedload
+
+    orders = db.query(models.Order).options(
+        joinedload(models.Order.items).joinedload(models.OrderItem.ticket).joinedload(models.Ticket.event),
+        joinedload(models.Order.items).joinedload(models.OrderItem.ticket).joinedload(models.Ticket.tier),
+        joinedload(models.Order.items).joinedload(models.OrderItem.ticket).joinedload(models.Ticket.seat),
+    ).filter(models.Order.user_id == user_id).order_by(models.Order.created_at.desc()).all()
+    return [{"id": o.id, "items": [{"ticket_id": i.ticket.id, "tier": i.ticket.tier.name, "seat": i.ticket.seat.row_label,
+                                     "event": i.ticket.event.title} for i in o.items]} for o in orders]
+
+
+def run(db, engine, fn):
+    from sqlalchemy import event
+
+    stats = {"queries": 0}
+
+    def before(*args):
+        stats["queries"] += 1
+
+    event.listen(engine, "before_cursor_execute", before)
+    try:
+        db.expunge_all()
+        started = time.perf_counter()
+        result = fn()
+        stats["seconds"] = time.perf_counter() - started
+    finally:
+        event.remove(engine, "before_cursor_execute", before)
+    return result, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=5, help="позиций в заказе")
+    parser.add_argument("--page", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import crud, pagination
+    from database import SessionLocal, engine, init_db
+
+    init_db()
+    db = SessionLocal()
+    user_id = seed(db, args.orders, args.items)
+
+    def walk():
+        after, pages = None, []
+        while True:
+            orders, token = crud.get_user_orders(db, user_id, args.page, cursor=after)
+            pages.append(orders)
+            if not token:
+                return pages
+            after = pagination.decode_cursor(token, datetime, int)
+
+    modes = {
+        "joinedload": lambda: old_handler(db, user_id),
+        "page": lambda: crud.get_user_orders(db, user_id, args.page),
+        "walk": walk,
+    }
+    print(f"user with {args.orders} orders x {args.items} items = {args.orders * args.items} order items")
+    print(f"{'mode':10s} {'best ms':>9s} {'queries':>8s}")
+    for name, fn in modes.items():
+        best, queries = None, 0
+        for _ in range(args.repeat):
+            _, stats = run(db, engine, fn)
+            best = stats["seconds"] if best is None else min(best, stats["seconds"])
+            queries = stats["queries"]
+        print(f"{name:10s} {best * 1000:9.1f} {queries:8d}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
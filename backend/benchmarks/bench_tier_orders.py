@@ -0,0 +1,124 @@
+"""
+Бенчмарк покупки по тарифу: N параллельных покупателей на одном тарифе.
+
+Сравнивает старую схему (SELECT ... FOR UPDATE ORDER BY id LIMIT qty — все ждут
+одни и те же строки) со счётчиками inventory.py (SKIP LOCKED + tier_inventory).
+Осмысленные цифры получаются только на PostgreSQL: SQLite блокирует всю базу.
+
+    cd backend
+    python benchmarks/bench_tier_orders.py --buyers 200 --orders-per-buyer 5
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import sessionmaker
+
+import models, inventory
+from database import DATABASE_URL, init_db
+
+
+def seed(Session, tickets: int):
+    db = Session()
+    try:
+        user = models.User(email=f"bench-{uuid.uuid4().hex[:8]}@bench.local", password_hash="-", wallet_balance=0)
+        ev = models.Event(title="bench", start_datetime=datetime.utcnow() + timedelta(days=30))
+        db.add_all([user, ev])
+        db.flush()
+        tier = models.PriceTier(event_id=ev.id, name="Dancefloor", price=Decimal("1000.00"), capacity=tickets)
+        db.add(tier)
+        db.flush()
+        db.bulk_insert_mappings(models.Ticket, [
+            {"event_id": ev.id, "tier_id": tier.id, "status": "available", "price": tier.price, "qr_code": str(uuid.uuid4())}
+            for _ in range(tickets)
+        ])
+        inventory.init_tier(db, tier.id, ev.id, tickets)
+        db.commit()
+        return user.id, ev.id, tier.id
+    finally:
+        db.close()
+
+
+def buy_legacy(db, user_id, tier_id, qty):
+    tickets = (
+        db.query(models.Ticket)
+          .with_for_update()
+          .filter(models.Ticket.tier_id == tier_id, models.Ticket.status == "available")
+          .order_by(models.Ticket.id)
+          .limit(qty)
+          .all()
+    )
+    if len(tickets) < qty:
+        raise inventory.InventoryError("sold out")
+    return tickets
+
+
+def buy_counter(db, user_id, tier_id, qty):
+    return inventory.allocate_tiers(db, {tier_id: qty})
+
+
+def place_order(Session, strategy, user_id, tier_id, qty):
+    db = Session()
+    try:
+        tickets = strategy(db, user_id, tier_id, qty)
+        order = models.Order(user_id=user_id, total_amount=sum(t.price for t in tickets), status="paid")
+        db.add(order)
+        db.flush()
+        db.execute(
+            update(models.Ticket)
+            .where(models.Ticket.id.in_([t.id for t in tickets]))
+            .values(status="sold", user_id=user_id)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(insert(models.OrderItem), [{"order_id": order.id, "ticket_id": t.id, "price": t.price} for t in tickets])
+        if strategy is buy_counter:
+            inventory.reserve(db, inventory.count_by_tier(tickets))
+        db.commit()
+        return True
+    except inventory.InventoryError:
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def run(Session, name, strategy, buyers, orders_per_buyer, qty):
+    user_id, event_id, tier_id = seed(Session, buyers * orders_per_buyer * qty)
+
+    def buyer(_):
+        return sum(place_order(Session, strategy, user_id, tier_id, qty) for _ in range(orders_per_buyer))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=buyers) as pool:
+        ok = sum(pool.map(buyer, range(buyers)))
+    elapsed = time.perf_counter() - started
+    print(f"{name:8s} orders={ok:6d} time={elapsed:7.2f}s orders/sec={ok / elapsed:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buyers", type=int, default=200)
+    parser.add_argument("--orders-per-buyer", type=int, default=5)
+    parser.add_argument("--qty", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    engine = create_engine(DATABASE_URL, pool_size=args.pool_size, max_overflow=0, pool_timeout=300)
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    print(f"{args.buyers} buyers x {args.orders_per_buyer} orders x {args.qty} tickets, one tier, {engine.dialect.name}")
+    run(Session, "before", buy_legacy, args.buyers, args.orders_per_buyer, args.qty)
+    run(Session, "after", buy_counter, args.buyers, args.orders_per_buyer, args.qty)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,35 @@
+import os
+import tempfile
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
-
-from main import app
-import models
-from database import Base, get_db
 
 # ---------------- TEST DB SETUP ----------------
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# файл, а не :memory: — его видят и sync (sqlite), и async (aiosqlite) движки
+SQLALCHEMY_DATABASE_URL = "sqlite:///" + os.path.join(tempfile.gettempdir(), "itmo_ticket_test.db")
+# до импорта main: приложение создаёт таблицы при импорте
+os.environ["DATABASE_URL"] = SQLALCHEMY_DATABASE_URL
+os.environ.pop("ASYNC_DATABASE_URL", None)
+# Argon2 в потоке, без пула процессов
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+
+from main import app
+import models, auth, response_cache, seatmap, waiting_room, ratelimit
+from models import Base
+from database import get_db, get_async_db, to_async_url
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool
+    connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL))
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 # ---------------- FIXTURES ----------------
 @pytest.fixture(scope="function", autouse=True)
 def create_tables():
@@ -28,6 +40,12 @@ def create_tables():
     with engine.begin() as conn:
         for table in reversed(Base.metadata.sorted_tables):
             conn.execute(table.delete())
+    # id пользователей в SQLite переиспользуются — кэш принципалов не должен их пережить
+    auth.principal_cache.clear()
+    response_cache.cache.clear()
+    seatmap.clear()
+    waiting_room.clear()
+    ratelimit.limiter.clear()
     # Base.metadata.drop_all(bind=engine)  # раскомментировать если нужно полностью удалять
 
 @pytest.fixture()
@@ -47,7 +65,18 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
+
+@pytest.fixture()
+def query_budget():
+    """Бюджет SQL-запросов: with query_budget(3): client.get(...) — больше 3 statements -> падение."""
+    import sqltrace
+    return sqltrace.max_queries
 
 @pytest.fixture()
 def client():
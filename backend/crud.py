@@ -1,8 +1,8 @@
 from sqlalchemy.orm import Session, joinedload
-from passlib.hash import argon2
-import uuid
-import models, schemas
+import models, schemas, inventory, passwords, response_cache, seatmap, pagination
 from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import exists, func, select
 
 def get_events(db: Session, limit: int = 20):
     return db.query(models.Event)\
@@ -42,7 +42,7 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 def create_user(db: Session, email: str, password: str):
-    hashed = argon2.hash(password)
+    hashed = passwords.hash_password_sync(password)
     user = models.User(email=email, password_hash=hashed)
     db.add(user)
     db.commit()
@@ -55,8 +55,88 @@ def authenticate_user(db: Session, email: str, password: str):
         return None
     return user
 
+# --- ORDERS ---
+
+def get_user_orders(db: Session, user_id: int, limit: int = 20, status: str = None, event_id: int = None, cursor: tuple = None):
+    """
+    История заказов, новые сначала, keyset по (created_at, id).
+    Страница заказов и плоская проекция их позиций — один SQL-запрос без ORM-объектов.
+    Возвращает (заказы, курсор следующей страницы).
+    """
+    page = select(models.Order.id, models.Order.total_amount, models.Order.status, models.Order.created_at)\
+        .where(models.Order.user_id == user_id)
+    if status is not None:
+        page = page.where(models.Order.status == status)
+    if event_id is not None:
+        page = page.where(exists().where(
+            models.OrderItem.order_id == models.Order.id,
+            models.Ticket.id == models.OrderItem.ticket_id,
+            models.Ticket.event_id == event_id,
+        ))
+    if cursor is not None:
+        page = page.where(pagination.before((models.Order.created_at, models.Order.id), cursor))
+    page = page.order_by(models.Order.created_at.desc(), models.Order.id.desc()).limit(limit + 1).subquery()
+
+    rows = db.execute(
+        select(
+            page,
+            models.OrderItem.id.label("item_id"), models.OrderItem.price.label("item_price"),
+            models.Ticket.id.label("ticket_id"), models.Ticket.qr_code, models.Ticket.status.label("ticket_status"),
+            models.Ticket.seat_id,
+            models.PriceTier.name.label("tier_name"),
+            models.Seat.row_label, models.Seat.seat_number,
+            models.Event.title.label("event_title"), models.Event.poster_url.label("event_poster"),
+        )
+        .select_from(page)
+        .outerjoin(models.OrderItem, models.OrderItem.order_id == page.c.id)
+        .outerjoin(models.Ticket, models.Ticket.id == models.OrderItem.ticket_id)
+        .outerjoin(models.PriceTier, models.PriceTier.id == models.Ticket.tier_id)
+        .outerjoin(models.Seat, models.Seat.id == models.Ticket.seat_id)
+        .outerjoin(models.Event, models.Event.id == models.Ticket.event_id)
+        .order_by(page.c.created_at.desc(), page.c.id.desc(), models.OrderItem.id)
+    ).all()
+
+    orders = {}
+    for r in rows:
+        order = orders.get(r.id)
+        if order is None:
+            order = orders[r.id] = {
+                "id": r.id, "total_amount": float(r.total_amount), "status": r.status,
+                "created_at": r.created_at, "items": [],
+            }
+        if r.ticket_id is None:
+            continue
+        order["items"].append({
+            "id": r.item_id,
+            "ticket_id": r.ticket_id,
+            "ticket_name": r.qr_code or f"Билет {r.ticket_id}",
+            "tier_name": r.tier_name,
+            "seat_label": f"{r.row_label or ''}{r.seat_number or ''}" if r.seat_id else None,
+            "event_title": r.event_title,
+            "event_poster": r.event_poster,
+            "price": float(r.item_price),
+            "status": r.ticket_status,
+        })
+    return pagination.page(list(orders.values()), limit, lambda o: (o["created_at"], o["id"]))
+
 # --- ADMIN EVENTS ---
 
+def _create_tiers_with_tickets(db: Session, event_id: int, venue_id, tiers):
+    pts = [models.PriceTier(event_id=event_id, name=t.name, price=t.price, capacity=t.capacity) for t in tiers]
+    db.add_all(pts)
+    db.flush()  # pt.id
+    _materialize_tiers(db, event_id, venue_id, pts, inventory.venue_seat_ids(db, venue_id))
+    return pts
+
+def _materialize_tiers(db: Session, event_id: int, venue_id, pts, seat_ids):
+    inventory.materialize_tickets(db, event_id, [(pt.id, pt.price, int(pt.capacity or 0)) for pt in pts], seat_ids)
+    # места раздаются тарифам подряд (см. inventory._ticket_batches)
+    seats_left = len(seat_ids)
+    for pt in pts:
+        capacity = int(pt.capacity or 0)
+        inventory.init_tier(db, pt.id, event_id, capacity, has_seats=seats_left > 0 and capacity > 0)
+        seats_left -= min(seats_left, capacity)
+
 def admin_create_event(db: Session, data: schemas.EventCreate):
     ev = models.Event(
         title=data.title,
@@ -70,38 +150,11 @@ def admin_create_event(db: Session, data: schemas.EventCreate):
     db.add(ev)
     db.flush()  # чтобы получить ev.id
 
-    # получим все seats для зала (упорядоченные)
-    seat_rows = db.query(models.Seat).filter(models.Seat.venue_id == data.venue_id).order_by(models.Seat.row_label, models.Seat.seat_number).all()
-    seat_ids = [s.id for s in seat_rows]
-    seat_index = 0
-
-    # если price_tiers передали — создаём их и билеты
-    tiers = getattr(data, "price_tiers", []) or []
-    for t in tiers:
-        pt = models.PriceTier(event_id=ev.id, name=t.name, price=t.price, capacity=t.capacity)
-        db.add(pt)
-        db.flush()  # pt.id
-
-        # создаём tickets для этого тарифа
-        cap = int(t.capacity or 0)
-        for _ in range(cap):
-            sid = None
-            # даём сидение если есть свободные сидения
-            if seat_index < len(seat_ids):
-                sid = seat_ids[seat_index]
-                seat_index += 1
-            ticket = models.Ticket(
-                event_id=ev.id,
-                seat_id=sid,
-                tier_id=pt.id,
-                user_id=None,
-                status="available",
-                price=pt.price,
-                qr_code=str(uuid.uuid4())
-            )
-            db.add(ticket)
+    # если price_tiers передали — создаём их одним flush и билеты пачками
+    _create_tiers_with_tickets(db, ev.id, data.venue_id, getattr(data, "price_tiers", []) or [])
 
     db.commit()
+    response_cache.invalidate("/events")
 
     # загрузим event с нужными связями и вернём
     ev = db.query(models.Event)\
@@ -111,10 +164,18 @@ def admin_create_event(db: Session, data: schemas.EventCreate):
     return ev
 
 def admin_update_event(db: Session, event_id: int, data: schemas.EventUpdate):
+    """
+    Обновляет событие инкрементально: поля события — на месте, тарифы — по диффу
+    с существующими (по PriceTierCreate.id). Билеты трогаются только там, где
+    изменилась вместимость или цена; если price_tiers не передали — не трогаются вовсе.
+    Проданные билеты никогда не удаляются: конфликт -> inventory.InventoryError.
+    """
     ev = db.query(models.Event).filter(models.Event.id == event_id).first()
     if not ev:
         return None
 
+    old_venue_id = ev.venue_id
+
     # обновляем поля
     ev.title = data.title or ev.title
     ev.description = data.description or ev.description
@@ -126,47 +187,97 @@ def admin_update_event(db: Session, event_id: int, data: schemas.EventUpdate):
     db.add(ev)
     db.flush()
 
-    # удалим старые билеты и тарифы — проще и надёжнее, затем пересоздадим по переданным
-    db.query(models.Ticket).filter(models.Ticket.event_id == ev.id).delete(synchronize_session=False)
-    db.query(models.PriceTier).filter(models.PriceTier.event_id == ev.id).delete(synchronize_session=False)
-    db.flush()
-
-    # снова получить сиденья актуального зала
-    seat_rows = db.query(models.Seat).filter(models.Seat.venue_id == ev.venue_id).order_by(models.Seat.row_label, models.Seat.seat_number).all()
-    seat_ids = [s.id for s in seat_rows]
-    seat_index = 0
-
-    tiers = getattr(data, "price_tiers", []) or []
-    for t in tiers:
-        pt = models.PriceTier(event_id=ev.id, name=t.name, price=t.price, capacity=t.capacity)
-        db.add(pt)
-        db.flush()
-
-        cap = int(t.capacity or 0)
-        for _ in range(cap):
-            sid = None
-            if seat_index < len(seat_ids):
-                sid = seat_ids[seat_index]
-                seat_index += 1
-            ticket = models.Ticket(
-                event_id=ev.id,
-                seat_id=sid,
-                tier_id=pt.id,
-                user_id=None,
-                status="available",
-                price=pt.price,
-                qr_code=str(uuid.uuid4())
-            )
-            db.add(ticket)
+    tiers_changed = ev.venue_id != old_venue_id or "price_tiers" in data.model_fields_set
+    # тарифы до правки: схемы мест удалённых тарифов тоже надо забыть
+    tier_ids = set(db.execute(select(models.PriceTier.id).where(models.PriceTier.event_id == ev.id)).scalars()) \
+        if tiers_changed else set()
+    if ev.venue_id != old_venue_id:
+        _rebuild_for_new_venue(db, ev)
+    if "price_tiers" in data.model_fields_set:
+        _sync_tiers(db, ev, data.price_tiers or [])
 
     db.commit()
+    response_cache.invalidate("/events")
 
     ev = db.query(models.Event)\
            .options(joinedload(models.Event.venue), joinedload(models.Event.genre), joinedload(models.Event.price_tiers))\
            .filter(models.Event.id == ev.id)\
            .first()
+    if tiers_changed:
+        # билеты тарифов могли пересоздаться — схемы мест этого события строим заново
+        seatmap.invalidate(ev.id, tier_ids | {pt.id for pt in ev.price_tiers})
     return ev
 
+def _sold_counts(db: Session, event_id: int):
+    # сколько билетов каждого тарифа уже не свободно (продано, забронировано, активировано...)
+    rows = db.query(models.Ticket.tier_id, func.count(models.Ticket.id))\
+             .filter(models.Ticket.event_id == event_id, models.Ticket.status != "available")\
+             .group_by(models.Ticket.tier_id).all()
+    return dict(rows)
+
+def _rebuild_for_new_venue(db: Session, ev: models.Event):
+    # у старого зала другие места — пересоздаём билеты, но только если ни один не продан
+    if _sold_counts(db, ev.id):
+        raise inventory.InventoryError("Cannot change venue: event already has sold or held tickets")
+    db.query(models.TierInventory).filter(models.TierInventory.event_id == ev.id).delete(synchronize_session=False)
+    db.query(models.Ticket).filter(models.Ticket.event_id == ev.id).delete(synchronize_session=False)
+    pts = db.query(models.PriceTier).filter(models.PriceTier.event_id == ev.id).order_by(models.PriceTier.id).all()
+    _materialize_tiers(db, ev.id, ev.venue_id, pts, inventory.venue_seat_ids(db, ev.venue_id))
+
+def _sync_tiers(db: Session, ev: models.Event, submitted):
+    existing = {pt.id: pt for pt in db.query(models.PriceTier).filter(models.PriceTier.event_id == ev.id)}
+    kept = {t.id for t in submitted if t.id in existing}
+    removed = [pt for tid, pt in existing.items() if tid not in kept]
+    shrinking = any(t.id in existing and int(t.capacity or 0) < int(existing[t.id].capacity or 0) for t in submitted)
+    sold = _sold_counts(db, ev.id) if removed or shrinking else {}
+
+    # удалённые тарифы
+    for pt in removed:
+        if sold.get(pt.id):
+            raise inventory.InventoryError(f"Cannot remove tier {pt.name}: it has sold or held tickets")
+        db.query(models.TierInventory).filter(models.TierInventory.tier_id == pt.id).delete(synchronize_session=False)
+        db.query(models.Ticket).filter(models.Ticket.tier_id == pt.id).delete(synchronize_session=False)
+        db.delete(pt)
+
+    # изменённые тарифы: цена на месте, вместимость — только дельта
+    grow = []
+    for t in submitted:
+        pt = existing.get(t.id)
+        if pt is None:
+            continue
+        pt.name = t.name
+        if Decimal(str(t.price)) != Decimal(str(pt.price)):
+            pt.price = t.price
+            db.query(models.Ticket)\
+              .filter(models.Ticket.tier_id == pt.id, models.Ticket.status == "available")\
+              .update({models.Ticket.price: t.price}, synchronize_session=False)
+        delta = int(t.capacity or 0) - int(pt.capacity or 0)
+        if delta < 0:
+            inventory.remove_available(db, pt.id, -delta)
+        elif delta > 0:
+            grow.append((pt, delta))
+        pt.capacity = t.capacity
+
+    new_pts = [models.PriceTier(event_id=ev.id, name=t.name, price=t.price, capacity=t.capacity)
+               for t in submitted if t.id not in existing]
+    db.add_all(new_pts)
+    db.flush()
+
+    if not grow and not new_pts:
+        return
+    seat_ids = inventory.free_seat_ids(db, ev.id, ev.venue_id)
+    if grow:
+        # места достаются только тем тарифам, которые и раньше были сидячими
+        seated = {tid for (tid,) in db.query(models.Ticket.tier_id).filter(
+            models.Ticket.event_id == ev.id, models.Ticket.seat_id.isnot(None)
+        ).distinct()}
+        seated_grow = [(pt.id, pt.price, delta) for pt, delta in grow if pt.id in seated]
+        used = inventory.materialize_tickets(db, ev.id, seated_grow, seat_ids)
+        inventory.materialize_tickets(db, ev.id, [(pt.id, pt.price, delta) for pt, delta in grow if pt.id not in seated], [])
+        inventory.release(db, {pt.id: delta for pt, delta in grow})
+        seat_ids = seat_ids[used:]
+    _materialize_tiers(db, ev.id, ev.venue_id, new_pts, seat_ids)
+
 
 def admin_delete_event(db: Session, event_id: int):
     ev = db.query(models.Event).filter(models.Event.id == event_id).first()
@@ -174,6 +285,7 @@ def admin_delete_event(db: Session, event_id: int):
         return False
     db.delete(ev)
     db.commit()
+    response_cache.invalidate("/events")
     return True
 
 # --- ADMIN VENUES ---
@@ -182,6 +294,7 @@ def admin_create_venue(db: Session, data):
     v = models.Venue(**data.dict())
     db.add(v)
     db.commit()
+    response_cache.invalidate("/venues")
     db.refresh(v)
     return v
 
@@ -192,6 +305,8 @@ def admin_update_venue(db: Session, venue_id: int, data):
     for k, val in data.dict(exclude_unset=True).items():
         setattr(v, k, val)
     db.commit()
+    # события отдаются вместе с залом
+    response_cache.invalidate("/venues", "/events")
     db.refresh(v)
     return v
 
@@ -201,5 +316,6 @@ def admin_delete_venue(db: Session, venue_id: int):
         return False
     db.delete(v)
     db.commit()
+    response_cache.invalidate("/venues", "/events")
     return True
 
@@ -0,0 +1,113 @@
+"""
+Асинхронные версии читающих функций crud.py (AsyncSession).
+
+Связи грузятся заранее через selectinload: ленивой подгрузки в async-сессии нет,
+а схемы EventBase сериализуют genre, venue и price_tiers.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import models, pagination, inventory
+
+EVENT_RELATIONS = (
+    selectinload(models.Event.genre),
+    selectinload(models.Event.venue),
+    selectinload(models.Event.price_tiers),
+)
+
+
+async def get_events(
+    db: AsyncSession,
+    limit: int = 20,
+    venue_id: int = None,
+    genre_id: int = None,
+    date_from: datetime = None,
+    date_to: datetime = None,
+    cursor: tuple = None,
+):
+    """
+    Страница каталога в порядке (start_datetime, id) -> (события, курсор следующей страницы).
+    cursor — (start_datetime, id) последнего события предыдущей страницы.
+    """
+    key = (models.Event.start_datetime, models.Event.id)
+    stmt = select(models.Event).options(*EVENT_RELATIONS)
+    if venue_id is not None:
+        stmt = stmt.where(models.Event.venue_id == venue_id)
+    if genre_id is not None:
+        stmt = stmt.where(models.Event.genre_id == genre_id)
+    if date_from is not None:
+        stmt = stmt.where(models.Event.start_datetime >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(models.Event.start_datetime < date_to)
+    if cursor is not None:
+        stmt = stmt.where(pagination.after(key, cursor))
+    rows = (await db.scalars(stmt.order_by(*key).limit(limit + 1))).all()
+    return pagination.page(rows, limit, lambda ev: (ev.start_datetime, ev.id))
+
+
+async def get_event(db: AsyncSession, event_id: int):
+    return await db.scalar(select(models.Event).options(*EVENT_RELATIONS).where(models.Event.id == event_id))
+
+
+async def get_top_events(db: AsyncSession, limit: int = 10):
+    stmt = (
+        select(models.Event)
+        .options(*EVENT_RELATIONS)
+        .where(models.Event.start_datetime >= datetime.now())
+        .order_by(models.Event.start_datetime)
+        .limit(limit)
+    )
+    return (await db.scalars(stmt)).all()
+
+
+async def get_event_availability(db: AsyncSession, event_id: int):
+    """Счётчики всех тарифов события одним запросом (tier_inventory), без COUNT по tickets."""
+    counter = models.TierInventory
+    rows = (await db.execute(
+        select(models.PriceTier.id, models.PriceTier.name, models.PriceTier.price, models.PriceTier.capacity,
+               counter.tier_id.label("counted"), counter.available, counter.held, counter.sold, counter.has_seats)
+        .outerjoin(counter, counter.tier_id == models.PriceTier.id)
+        .where(models.PriceTier.event_id == event_id)
+        .order_by(models.PriceTier.id)
+    )).all()
+    # тарифы без строки счётчика (созданы в обход приложения) — считаем по tickets
+    missing = [r.id for r in rows if r.counted is None]
+    actual = await db.run_sync(inventory.actual_counts, missing) if missing else {}
+    tiers = []
+    for r in rows:
+        available, held, sold, has_seats = actual[r.id] if r.counted is None else (r.available, r.held, r.sold, r.has_seats)
+        tiers.append({
+            "tier_id": r.id, "name": r.name, "price": float(r.price), "capacity": r.capacity,
+            "available": available, "held": held, "sold": sold, "has_seats": bool(has_seats),
+        })
+    return tiers
+
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email))
+
+
+async def get_venue_seats(db: AsyncSession, venue_id: int):
+    stmt = (
+        select(models.Seat)
+        .where(models.Seat.venue_id == venue_id)
+        .order_by(models.Seat.row_label, models.Seat.seat_number)
+    )
+    return (await db.scalars(stmt)).all()
+
+
+async def get_event_tickets(db: AsyncSession, event_id: int, tier_id: int):
+    result = await db.execute(
+        text("""
+        SELECT t.id, s.row_label, s.seat_number, t.status
+        FROM tickets t
+        JOIN seats s ON s.id = t.seat_id
+        WHERE t.event_id = :e AND t.tier_id = :t
+        ORDER BY s.row_label, s.seat_number
+        """),
+        {"e": event_id, "t": tier_id}
+    )
+    return result.fetchall()
@@ -1,20 +1,87 @@
 import os
+import uuid
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from sqlalchemy.orm import declarative_base
 
+import pool_metrics
+
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, future=True)
+# асинхронные драйверы для тех же баз: psycopg2 -> asyncpg, sqlite -> aiosqlite
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    backend = make_url(url).get_backend_name()
+    return f"{ASYNC_DRIVERS.get(backend, scheme)}://{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# --- пул соединений ---
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# режим совместимости с PgBouncer (pool_mode = transaction): без prepared statements
+DB_PGBOUNCER = _env_bool("DB_PGBOUNCER", False)
+
+def engine_options(url: str, is_async: bool = False, name: str = "primary") -> dict:
+    opts = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if make_url(url).get_backend_name() == "sqlite":
+        # у SQLite свой пул по умолчанию, настройки размера к нему не применимы
+        return opts
+    opts.update(
+        poolclass=pool_metrics.TimedAsyncQueuePool if is_async else pool_metrics.TimedQueuePool,
+        pool_logging_name=name,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    if DB_PGBOUNCER and is_async:
+        # asyncpg кэширует prepared statements на соединении, а PgBouncer
+        # в transaction-режиме отдаёт каждой транзакции произвольное серверное соединение
+        opts["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    # psycopg2 server-side prepared statements не использует — для него ничего не нужно
+    return opts
+
+engine = create_engine(DATABASE_URL, future=True, **engine_options(DATABASE_URL, name="primary"))
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True, name="primary_async"))
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+pool_metrics.instrument(engine, "primary")
+pool_metrics.instrument(async_engine.sync_engine, "primary_async")
+
 Base = declarative_base()
 
-def init_db():
+def init_db(bind=None):
+    # таблицы — по models.py, индексы и изменения существующих таблиц — миграциями (migrate.py);
+    # возвращает версии применённых миграций
+    from sqlalchemy import inspect
     from models import Base
-    Base.metadata.create_all(bind=engine)
+    import migrate
+    bind = bind or engine
+    fresh = not inspect(bind).has_table("events")
+    Base.metadata.create_all(bind=bind)
+    if fresh:
+        migrate.stamp(bind)
+        return []
+    return migrate.upgrade(bind)
 
 def get_db():
     db = SessionLocal()
@@ -22,3 +89,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
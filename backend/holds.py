@@ -0,0 +1,241 @@
+"""
+Временные брони (holds) мест и тарифов.
+
+Бронь переводит билеты в статус 'held' короткой транзакцией без ожидания чужих
+блокировок (SKIP LOCKED) и списывает их со счётчиков tier_inventory.
+Оплата брони (checkout) уже не конкурирует за свободные билеты — билеты закреплены
+за пользователем, поэтому тяжёлые блокировки уходят из платёжного пути.
+Просроченные брони снимает фоновый sweeper пачками по HOLD_SWEEP_BATCH броней.
+
+Порядок блокировок на всех путях, где есть бронь (оплата, отмена, sweeper, отмена
+события в refunds.py): строка ticket_holds, затем её билеты, затем счётчики
+тарифов и пользователь. Билеты брони без блокировки её строки не трогает никто,
+поэтому оплата и снятие одной брони не ждут друг друга по кругу.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+import models, inventory, seatfeed
+
+HOLD_TTL_SECONDS = int(os.getenv("HOLD_TTL_SECONDS", "600"))
+HOLD_SWEEP_INTERVAL = float(os.getenv("HOLD_SWEEP_INTERVAL", "15"))
+HOLD_SWEEP_BATCH = int(os.getenv("HOLD_SWEEP_BATCH", "1000"))
+
+log = logging.getLogger(__name__)
+
+
+class HoldError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def create_hold(db: Session, user_id: int, event_id: int, items):
+    """
+    items — список schemas.OrderItemCreate (ticket_id или tier_id + quantity).
+    Возвращает (hold, строки inventory.TICKET_ROW). Если часть мест уже занята — InventoryError.
+    """
+    ticket_ids = sorted({it.ticket_id for it in items if it.ticket_id})
+    tickets = []
+    if ticket_ids:
+        # занятые другими покупателями места просто не попадут в выборку — без ожидания;
+        # строки, а не ORM-объекты: после commit ответ не перечитывает билеты по одному
+        tickets = db.execute(
+            select(*inventory.TICKET_ROW)
+            .where(models.Ticket.id.in_(ticket_ids),
+                   models.Ticket.event_id == event_id,
+                   models.Ticket.status == "available")
+            .order_by(models.Ticket.id)
+            .with_for_update(skip_locked=True)
+        ).all()
+        if len(tickets) != len(ticket_ids):
+            raise inventory.InventoryError("Some of the selected seats are no longer available")
+
+    tier_counts = {}
+    for it in items:
+        if it.ticket_id:
+            continue
+        if not it.tier_id:
+            raise HoldError(400, "Hold item must include ticket_id or tier_id")
+        tier_counts[it.tier_id] = tier_counts.get(it.tier_id, 0) + int(it.quantity or 1)
+    if tier_counts:
+        found = set(db.execute(
+            select(models.PriceTier.id).where(models.PriceTier.id.in_(tier_counts), models.PriceTier.event_id == event_id)
+        ).scalars())
+        for tier_id in tier_counts:
+            if tier_id not in found:
+                raise HoldError(404, f"Tier {tier_id} not found")
+        tickets += inventory.allocate_tiers(db, tier_counts, exclude=[t.id for t in tickets])
+
+    if not tickets:
+        raise HoldError(400, "Nothing to hold")
+
+    expires_at = datetime.utcnow() + timedelta(seconds=HOLD_TTL_SECONDS)
+    hold = models.TicketHold(event_id=event_id, user_id=user_id, status="active",
+                             quantity=len(tickets), expires_at=expires_at)
+    db.add(hold)
+    db.flush()
+
+    held = db.execute(
+        update(models.Ticket)
+        .where(models.Ticket.id.in_([t.id for t in tickets]), models.Ticket.status == "available")
+        .values(status="held", user_id=user_id, hold_id=hold.id, hold_expires_at=expires_at)
+        .execution_options(synchronize_session=False)
+    )
+    if held.rowcount != len(tickets):
+        raise inventory.InventoryError("Some of the selected seats are no longer available")
+    seatfeed.notify(db, tickets, "held")
+    inventory.reserve(db, inventory.count_by_tier(tickets), into="held")
+    db.commit()
+    return hold, tickets
+
+
+def _get_active_hold(db: Session, user_id: int, hold_id: int):
+    hold = db.query(models.TicketHold).with_for_update().filter(
+        models.TicketHold.id == hold_id,
+        models.TicketHold.user_id == user_id
+    ).first()
+    if not hold:
+        raise HoldError(404, "Hold not found")
+    if hold.status != "active":
+        raise HoldError(409, f"Hold is {hold.status}")
+    return hold
+
+
+def _held_tickets(db: Session, hold_ids):
+    # строки броней уже заблокированы вызывающим — билеты берутся вторыми
+    return db.execute(
+        select(*inventory.TICKET_ROW)
+        .where(models.Ticket.hold_id.in_(hold_ids), models.Ticket.status == "held")
+        .order_by(models.Ticket.id)
+        .with_for_update()
+    ).all()
+
+
+def checkout_hold(db: Session, user_id: int, hold_id: int, event_id: int = None):
+    """
+    Превращает бронь в оплаченный заказ. Возвращает (order, tickets, баланс после списания).
+    event_id — событие пропуска очереди: бронь другого события не оплачивается.
+    Блокировки: бронь, её билеты, счётчики тарифов, пользователь (см. начало модуля).
+    Бронь, которую в этот момент снимает sweeper, он пропускает (SKIP LOCKED), а оплата
+    отвечает 410, если срок вышел.
+    """
+    hold = _get_active_hold(db, user_id, hold_id)
+    if event_id is not None and hold.event_id != event_id:
+        raise HoldError(403, "Admission token is for another event")
+    tickets = _held_tickets(db, [hold.id])
+    if hold.expires_at < datetime.utcnow() or len(tickets) != hold.quantity:
+        raise HoldError(410, "Hold expired")
+
+    total = sum((Decimal(str(t.price or 0)) for t in tickets), Decimal("0.00"))
+    order = models.Order(user_id=user_id, total_amount=total, status="paid")
+    db.add(order)
+    db.flush()
+
+    ids = [t.id for t in tickets]
+    db.execute(
+        update(models.Ticket)
+        .where(models.Ticket.id.in_(ids))
+        .values(status="sold", hold_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(insert(models.OrderItem), [{"order_id": order.id, "ticket_id": t.id, "price": t.price} for t in tickets])
+    db.execute(insert(models.WalletTransaction), [{"user_id": user_id, "amount": -total, "reason": "purchase"}])
+    seatfeed.notify(db, tickets, "sold")
+    inventory.convert(db, inventory.count_by_tier(tickets))
+
+    # списание как в create_order: проверка и вычитание одним UPDATE, без чтения баланса
+    balance = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.wallet_balance >= total)
+        .values(wallet_balance=models.User.wallet_balance - total)
+        .returning(models.User.wallet_balance)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if balance is None:
+        raise HoldError(402, "Insufficient balance")
+    hold.status = "converted"
+    db.commit()
+    return order, tickets, Decimal(str(balance))
+
+
+def _release_tickets(db: Session, tickets):
+    db.execute(
+        update(models.Ticket)
+        .where(models.Ticket.id.in_([t.id for t in tickets]), models.Ticket.status == "held")
+        .values(status="available", user_id=None, hold_id=None, hold_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    seatfeed.notify(db, tickets, "available")
+    inventory.release(db, inventory.count_by_tier(tickets), source="held")
+
+
+def release_hold(db: Session, user_id: int, hold_id: int):
+    hold = _get_active_hold(db, user_id, hold_id)
+    tickets = _held_tickets(db, [hold.id])
+    if tickets:
+        _release_tickets(db, tickets)
+    hold.status = "released"
+    db.commit()
+    return len(tickets)
+
+
+def release_expired(db: Session, batch_size: int = HOLD_SWEEP_BATCH) -> int:
+    """
+    Снимает до batch_size просроченных броней: SELECT броней ... SKIP LOCKED (занятые
+    оплатой или отменой пропускаются), SELECT их билетов, по одному UPDATE билетов и броней
+    и по одному UPDATE счётчика на затронутый тариф.
+    Возвращает число освобождённых билетов; None — просроченных броней больше нет.
+    """
+    now = datetime.utcnow()
+    hold_ids = db.execute(
+        select(models.TicketHold.id)
+        .where(models.TicketHold.status == "active", models.TicketHold.expires_at < now)
+        .order_by(models.TicketHold.expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not hold_ids:
+        db.rollback()
+        return None
+    tickets = _held_tickets(db, hold_ids)
+    if tickets:
+        _release_tickets(db, tickets)
+    db.execute(
+        update(models.TicketHold)
+        .where(models.TicketHold.id.in_(hold_ids))
+        .values(status="expired")
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return len(tickets)
+
+
+def sweep(session_factory, batch_size: int = HOLD_SWEEP_BATCH) -> int:
+    released = 0
+    db = session_factory()
+    try:
+        while True:
+            n = release_expired(db, batch_size)
+            if n is None:
+                return released
+            released += n
+    except Exception:
+        log.exception("hold sweep failed")
+        db.rollback()
+        return released
+    finally:
+        db.close()
+
+
+async def run_sweeper(session_factory, interval: float = HOLD_SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(sweep, session_factory)
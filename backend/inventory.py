@@ -0,0 +1,416 @@
+"""
+Учёт остатков по тарифам.
+
+tier_inventory.available / held / sold — авторитетные счётчики билетов тарифа
+(sold — проданные и активированные; возвращённые не считаются нигде).
+Каждый переход статуса билета меняет счётчики в той же транзакции:
+  покупка       reserve(counts)                available -> sold
+  бронь         reserve(counts, "held")        available -> held
+  оплата брони  convert(counts)                held -> sold
+  снятие брони  release(counts, "held")        held -> available
+  возврат       refund(counts)                 sold -> (canceled)
+  отмена события cancel(deltas)                available/held/sold -> (canceled)
+  правка тарифа release(counts) / discard()    +/- available
+reconcile() сверяет счётчики с tickets и чинит расхождения.
+
+Покупка по тарифу устроена так:
+  1. быстрая проверка счётчика без блокировок (распроданный тариф отсекается сразу);
+  2. выбор конкретных билетов через FOR UPDATE SKIP LOCKED — параллельные покупатели
+     берут разные строки и не ждут друг друга;
+  3. атомарное уменьшение счётчика (UPDATE ... WHERE available >= qty) прямо перед commit,
+     чтобы блокировка строки счётчика держалась как можно меньше.
+"""
+import asyncio
+import csv
+import io
+import logging
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from itertools import chain, islice, repeat
+
+from sqlalchemy import Integer, case, column, delete, func, insert, select, true, update, values
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+
+TICKET_BATCH_SIZE = int(os.getenv("TICKET_BATCH_SIZE", "5000"))
+
+
+class InventoryError(Exception):
+    """Недостаточно свободных билетов в тарифе."""
+
+
+SOLD_STATUSES = ("sold", "activated")
+COUNTER_FIELDS = ("available", "held", "sold", "has_seats")
+
+log = logging.getLogger(__name__)
+
+
+def init_tier(db: Session, tier_id: int, event_id: int, available: int, has_seats: bool = False, held: int = 0, sold: int = 0):
+    db.add(models.TierInventory(tier_id=tier_id, event_id=event_id, available=available,
+                                held=held, sold=sold, has_seats=has_seats))
+
+
+def actual_counts(db: Session, tier_ids):
+    """Фактические счётчики по tickets: {tier_id: (available, held, sold, has_seats)}."""
+    state = case(
+        (models.Ticket.status == "available", "available"),
+        (models.Ticket.status == "held", "held"),
+        (models.Ticket.status.in_(SOLD_STATUSES), "sold"),
+        else_="other",
+    )
+    rows = db.execute(
+        select(models.Ticket.tier_id, state, func.count(models.Ticket.id), func.count(models.Ticket.seat_id))
+        .where(models.Ticket.tier_id.in_(tier_ids))
+        .group_by(models.Ticket.tier_id, state)
+    ).all()
+    counts = {tid: {"available": 0, "held": 0, "sold": 0, "seats": 0} for tid in tier_ids}
+    for tier_id, st, n, seats in rows:
+        counts[tier_id][st] = n
+        counts[tier_id]["seats"] += seats
+    return {tid: (c["available"], c["held"], c["sold"], c["seats"] > 0) for tid, c in counts.items()}
+
+
+def _backfill_tier(db: Session, tier_id: int):
+    # для тарифов, созданных в обход приложения (generate-data.py, старые данные)
+    tier = db.get(models.PriceTier, tier_id)
+    if tier is None:
+        return None
+    available, held, sold, has_seats = actual_counts(db, [tier_id])[tier_id]
+    try:
+        with db.begin_nested():
+            init_tier(db, tier_id, tier.event_id, available, has_seats, held, sold)
+    except IntegrityError:
+        # строку успел создать параллельный запрос
+        pass
+    return db.get(models.TierInventory, tier_id)
+
+
+def get_counter(db: Session, tier_id: int):
+    counter = db.get(models.TierInventory, tier_id)
+    if counter is None:
+        counter = _backfill_tier(db, tier_id)
+    return counter
+
+
+# колонки билета, которые нужны заказу и брони (строки, а не ORM-объекты)
+TICKET_ROW = (models.Ticket.id, models.Ticket.event_id, models.Ticket.tier_id, models.Ticket.seat_id,
+              models.Ticket.status, models.Ticket.price)
+
+
+def lock_tickets(db: Session, ticket_ids):
+    """
+    Билеты по id одним SELECT ... FOR UPDATE. Строки блокируются в порядке id —
+    заказы с пересекающимися корзинами ждут друг друга, но не попадают в дедлок.
+    """
+    if not ticket_ids:
+        return []
+    return db.execute(
+        select(*TICKET_ROW)
+        .where(models.Ticket.id.in_(sorted(set(ticket_ids))))
+        .order_by(models.Ticket.id)
+        .with_for_update()
+    ).all()
+
+
+def allocate_tiers(db: Session, counts: dict, exclude=()):
+    """
+    Выбирает {tier_id: qty} свободных билетов, не блокируясь на чужих строках (SKIP LOCKED).
+    На PostgreSQL все тарифы — один запрос (LATERAL по списку тарифов), иначе по запросу на тариф.
+    Счётчики здесь только читаются — уменьшает их reserve().
+    """
+    counts = {tier_id: qty for tier_id, qty in counts.items() if qty > 0}
+    if not counts:
+        return []
+    counter = models.TierInventory
+    available = dict(db.execute(select(counter.tier_id, counter.available).where(counter.tier_id.in_(counts))).all())
+    for tier_id, qty in sorted(counts.items()):
+        if tier_id not in available:
+            backfilled = _backfill_tier(db, tier_id)
+            available[tier_id] = backfilled.available if backfilled is not None else 0
+        if available[tier_id] < qty:
+            raise InventoryError(f"Not enough available tickets for tier {tier_id}")
+
+    # уже выбранные в этом же заказе билеты (свои блокировки SKIP LOCKED не пропускает)
+    exclude = list(exclude)
+    free = (models.Ticket.status == "available",) + ((models.Ticket.id.notin_(exclude),) if exclude else ())
+    if db.get_bind().dialect.name == "postgresql":
+        req = values(column("tier_id", Integer), column("qty", Integer), name="req").data(sorted(counts.items()))
+        picked = (
+            select(*TICKET_ROW)
+            .where(models.Ticket.tier_id == req.c.tier_id, *free)
+            .order_by(models.Ticket.id)
+            .limit(req.c.qty)
+            .with_for_update(skip_locked=True)
+            .lateral("picked")
+        )
+        rows = db.execute(select(picked).select_from(req).join(picked, true())).all()
+    else:
+        rows = []
+        for tier_id, qty in sorted(counts.items()):
+            rows += db.execute(
+                select(*TICKET_ROW)
+                .where(models.Ticket.tier_id == tier_id, *free)
+                .order_by(models.Ticket.id)
+                .limit(qty)
+                .with_for_update(skip_locked=True)
+            ).all()
+
+    got = count_by_tier(rows)
+    for tier_id, qty in sorted(counts.items()):
+        if got.get(tier_id, 0) < qty:
+            raise InventoryError(f"Not enough available tickets for tier {tier_id}")
+    return rows
+
+
+def reserve(db: Session, counts: dict, into: str = "sold"):
+    """
+    Атомарно списывает {tier_id: qty} со свободных в into ("sold" или "held").
+    Строки счётчиков блокируются одним запросом по возрастанию tier_id (единый порядок
+    блокировок исключает дедлоки), затем списываются одним UPDATE.
+    """
+    counts = {tier_id: qty for tier_id, qty in counts.items() if qty > 0}
+    if not counts:
+        return
+    counter = models.TierInventory
+    tier_ids = sorted(counts)
+    locked = set(db.execute(
+        select(counter.tier_id).where(counter.tier_id.in_(tier_ids)).order_by(counter.tier_id).with_for_update()
+    ).scalars())
+    for tier_id in tier_ids:
+        # у старых тарифов строки счётчика может не быть — создаём её
+        if tier_id not in locked and _backfill_tier(db, tier_id) is None:
+            raise InventoryError(f"Not enough available tickets for tier {tier_id}")
+
+    qty = case(counts, value=counter.tier_id)
+    res = db.execute(
+        update(counter)
+        .where(counter.tier_id.in_(tier_ids), counter.available >= qty)
+        .values({counter.available: counter.available - qty, getattr(counter, into): getattr(counter, into) + qty})
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount != len(tier_ids):
+        raise InventoryError(f"Not enough available tickets for tier {', '.join(map(str, tier_ids))}")
+
+
+def _shift(db: Session, tier_id: int, **deltas):
+    # строки может не быть у старых тарифов — тогда её позже посчитает _backfill_tier
+    counter = models.TierInventory
+    db.execute(
+        update(counter)
+        .where(counter.tier_id == tier_id)
+        .values({getattr(counter, name): getattr(counter, name) + delta for name, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _move(db: Session, counts: dict, **deltas):
+    for tier_id in sorted(counts):
+        qty = counts[tier_id]
+        if qty > 0:
+            _shift(db, tier_id, **{name: sign * qty for name, sign in deltas.items()})
+
+
+def release(db: Session, counts: dict, source: str = None):
+    """Возвращает {tier_id: qty} в свободные: из source ("held") или новые билеты (source=None)."""
+    if source:
+        _move(db, counts, available=1, **{source: -1})
+    else:
+        _move(db, counts, available=1)
+
+
+def convert(db: Session, counts: dict, source: str = "held", target: str = "sold"):
+    """Переносит {tier_id: qty} между счётчиками (оплата брони: held -> sold)."""
+    _move(db, counts, **{source: -1, target: 1})
+
+
+def refund(db: Session, counts: dict):
+    """Возвращённые билеты уходят из проданных (в продажу они не возвращаются)."""
+    _move(db, counts, sold=-1)
+
+
+def cancel(db: Session, deltas: dict):
+    """Отмена события: {tier_id: {"available": n, "held": n, "sold": n}} билетов уходят из своих счётчиков."""
+    for tier_id in sorted(deltas):
+        by_status = {name: -qty for name, qty in deltas[tier_id].items() if qty}
+        if by_status:
+            _shift(db, tier_id, **by_status)
+
+
+def discard(db: Session, tier_id: int, qty: int):
+    """Списывает со счётчика удалённые свободные билеты (уменьшение вместимости тарифа)."""
+    if qty > 0:
+        _shift(db, tier_id, available=-qty)
+
+
+def reconcile(db: Session, event_id: int = None):
+    """
+    Сверяет счётчики с tickets и исправляет расхождения. Каждый тариф — отдельная
+    короткая транзакция под блокировкой строки счётчика: конкурирующая покупка
+    дождётся её и применит свою дельту уже к исправленному значению.
+    Возвращает [{tier_id, counter, tickets}] — было в счётчике и по факту — для исправленных тарифов.
+    """
+    query = select(models.PriceTier.id).order_by(models.PriceTier.id)
+    if event_id is not None:
+        query = query.where(models.PriceTier.event_id == event_id)
+    fixed = []
+    for tier_id in db.execute(query).scalars().all():
+        counter = db.query(models.TierInventory).with_for_update().filter(models.TierInventory.tier_id == tier_id).first()
+        if counter is None:
+            _backfill_tier(db, tier_id)
+            db.commit()
+            continue
+        actual = actual_counts(db, [tier_id])[tier_id]
+        stored = (counter.available, counter.held, counter.sold, bool(counter.has_seats))
+        if stored != actual:
+            counter.available, counter.held, counter.sold, counter.has_seats = actual
+            fixed.append({"tier_id": tier_id, "counter": dict(zip(COUNTER_FIELDS, stored)),
+                          "tickets": dict(zip(COUNTER_FIELDS, actual))})
+        db.commit()
+    return fixed
+
+
+def count_by_tier(tickets):
+    counts = defaultdict(int)
+    for t in tickets:
+        if t.tier_id is not None:
+            counts[t.tier_id] += 1
+    return dict(counts)
+
+
+# --- массовое создание билетов ---
+
+TICKET_COPY_COLUMNS = ("event_id", "seat_id", "tier_id", "status", "price", "qr_code", "created_at")
+
+
+def venue_seat_ids(db: Session, venue_id):
+    if venue_id is None:
+        return []
+    return db.execute(
+        select(models.Seat.id)
+        .where(models.Seat.venue_id == venue_id)
+        .order_by(models.Seat.row_label, models.Seat.seat_number)
+    ).scalars().all()
+
+
+def _qr_codes(n: int):
+    # одно обращение к urandom на пачку вместо uuid4() на каждый билет
+    raw = os.urandom(16 * n)
+    return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+
+def _ticket_batches(event_id: int, tiers, seat_ids, batch_size: int):
+    """
+    tiers — [(tier_id, price, capacity)]. Места раздаются тарифам подряд по порядку,
+    билеты сверх числа мест — без места (танцпол). Отдаёт пачки кортежей TICKET_COPY_COLUMNS.
+    """
+    now = datetime.utcnow()
+    offset = 0
+    for tier_id, price, capacity in tiers:
+        seats = seat_ids[offset:offset + capacity]
+        offset += len(seats)
+        seat_iter = chain(seats, repeat(None, capacity - len(seats)))
+        for start in range(0, capacity, batch_size):
+            n = min(batch_size, capacity - start)
+            yield [
+                (event_id, sid, tier_id, "available", price, qr, now)
+                for sid, qr in zip(islice(seat_iter, n), _qr_codes(n))
+            ]
+
+
+def _copy_batch(cursor, batch):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(batch)
+    buf.seek(0)
+    cursor.copy_expert(
+        f"COPY tickets ({', '.join(TICKET_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buf
+    )
+
+
+def materialize_tickets(db: Session, event_id: int, tiers, seat_ids, batch_size: int = TICKET_BATCH_SIZE) -> int:
+    """
+    Создаёт билеты тарифов события пачками: на PostgreSQL (psycopg2) через COPY,
+    иначе через Core insert() с executemany. ORM-объекты Ticket не создаются.
+    seat_ids — свободные места, которые можно раздать. Счётчики tier_inventory
+    не трогает. Возвращает число созданных билетов.
+    """
+    conn = db.connection()
+    use_copy = conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2"
+    cursor = conn.connection.dbapi_connection.cursor() if use_copy else None
+
+    created = 0
+    try:
+        for batch in _ticket_batches(event_id, tiers, list(seat_ids), batch_size):
+            if use_copy:
+                _copy_batch(cursor, batch)
+            else:
+                db.execute(insert(models.Ticket), [dict(zip(TICKET_COPY_COLUMNS, row)) for row in batch])
+            created += len(batch)
+    finally:
+        if cursor is not None:
+            cursor.close()
+    return created
+
+
+def free_seat_ids(db: Session, event_id: int, venue_id):
+    """Места зала, на которые у события ещё нет билетов."""
+    taken = set(db.execute(
+        select(models.Ticket.seat_id)
+        .where(models.Ticket.event_id == event_id, models.Ticket.seat_id.isnot(None))
+    ).scalars())
+    return [sid for sid in venue_seat_ids(db, venue_id) if sid not in taken]
+
+
+def remove_available(db: Session, tier_id: int, qty: int):
+    """
+    Удаляет qty свободных билетов тарифа (сначала самые новые) и списывает их со счётчика.
+    Проданные и забронированные билеты не трогаются: если свободных не хватает — InventoryError.
+    """
+    ids = db.execute(
+        select(models.Ticket.id)
+        .where(models.Ticket.tier_id == tier_id, models.Ticket.status == "available")
+        .order_by(models.Ticket.id.desc())
+        .limit(qty)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if len(ids) < qty:
+        raise InventoryError(f"Cannot reduce tier {tier_id}: only {len(ids)} unsold tickets left")
+    db.execute(
+        delete(models.Ticket)
+        .where(models.Ticket.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    discard(db, tier_id, qty)
+
+
+# --- сверка счётчиков ---
+
+INVENTORY_RECONCILE_INTERVAL = float(os.getenv("INVENTORY_RECONCILE_INTERVAL", "3600"))
+
+
+def reconcile_all(session_factory):
+    db = session_factory()
+    try:
+        fixed = reconcile(db)
+        if fixed:
+            log.warning("reconciled %d tier counters", len(fixed), extra={"tiers": fixed})
+        return fixed
+    except Exception:
+        log.exception("inventory reconcile failed")
+        db.rollback()
+        return []
+    finally:
+        db.close()
+
+
+async def run_reconciler(session_factory, interval: float = INVENTORY_RECONCILE_INTERVAL):
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(reconcile_all, session_factory)
@@ -0,0 +1,161 @@
+"""
+Логи приложения: JSON-строки в stdout, запись — в отдельном потоке.
+
+Все логгеры пишут в корневой, на корне один QueueHandler: в потоке запроса
+запись только дополняется request_id, сообщение подставляется в шаблон и кладётся
+в очередь; JSON и запись в stdout делает QueueListener в своём потоке. Поток
+запроса не ждёт stdout, а логи можно фильтровать по уровню и разбирать.
+
+  {"ts": "...", "level": "INFO", "logger": "inventory", "msg": "...", "request_id": "...", ...поля extra}
+
+  LOG_LEVEL          — уровень корневого логгера (INFO);
+  LOG_FORMAT         — json или text (для локальной отладки);
+  LOG_TRACE_SAMPLE   — доля запросов (0..1) с подробной трассировкой заказа
+                       (логгер trace.*, уровень DEBUG); 0 — выключено.
+
+request_id берётся из заголовка X-Request-ID или генерируется и возвращается
+в ответе тем же заголовком. Решение о трассировке принимается один раз на запрос,
+поэтому у запроса в выборке видна вся цепочка, а не случайные строки.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_TRACE_SAMPLE = float(os.getenv("LOG_TRACE_SAMPLE", "0"))
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+_traced: contextvars.ContextVar = contextvars.ContextVar("traced", default=False)
+
+# атрибуты LogRecord, не относящиеся к extra
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "request_id"}
+
+
+def request_id():
+    return _request_id.get()
+
+
+def tracing() -> bool:
+    """Попал ли текущий запрос в выборку LOG_TRACE_SAMPLE (проверка дешёвая — до сборки полей)."""
+    return _traced.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            data["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+def _add_request_id(record):
+    record.request_id = _request_id.get()
+    return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # без полного format(): JSON собирает поток слушателя, здесь — только то,
+        # что нельзя отложить (аргументы могут измениться, traceback — пропасть)
+        record = copy.copy(record)
+        record.request_id = _request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+_handler = None
+
+
+def configure(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None, queued: bool = True):
+    """
+    Ставит QueueHandler на корневой логгер и запускает слушателя. Повторный вызов — no-op.
+    queued=False — запись прямо в потоке вызова (только для сравнения в бенчмарке).
+    """
+    global _listener, _handler
+    if _handler is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else
+                        logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    if queued:
+        q = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(q, output, respect_handler_level=True)
+        _listener.start()
+        _handler = _QueueHandler(q)
+    else:
+        output.addFilter(_add_request_id)
+        _handler = output
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+    if LOG_TRACE_SAMPLE > 0:
+        logging.getLogger("trace").setLevel(logging.DEBUG)
+
+
+def shutdown():
+    """Снимает обработчик, дописывает очередь и останавливает поток слушателя."""
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+    if _listener is not None:
+        _listener.stop()
+    _listener = _handler = None
+
+
+atexit.register(shutdown)
+
+
+class RequestIdMiddleware:
+    """Кладёт request_id (и решение о трассировке) в контекст запроса, возвращает его в заголовке."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                rid = value.decode("latin-1")[:64]
+                break
+        rid = rid or uuid.uuid4().hex
+        token = _request_id.set(rid)
+        traced = _traced.set(LOG_TRACE_SAMPLE > 0 and random.random() < LOG_TRACE_SAMPLE)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _traced.reset(traced)
+            _request_id.reset(token)
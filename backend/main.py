@@ -1,85 +1,173 @@
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Query
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy import text
+from sqlalchemy import insert, select, text, update
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from decimal import Decimal
 from datetime import datetime
-from jose import jwt, JWTError
-from passlib.hash import argon2
 from dotenv import load_dotenv
-import os, traceback
+import os, asyncio, dataclasses, hmac, logging
 
-import models, crud, schemas
-from database import SessionLocal, init_db, get_db
+import models, crud, crud_async, schemas, inventory, holds, pool_metrics, auth, passwords, response_cache, pagination, seatmap, seatfeed, refunds, metrics, logs, waiting_room, ratelimit, replicas
+from database import SessionLocal, async_engine, init_db, get_db, get_async_db
 
 
 # --- config ---
-SECRET_KEY = os.getenv("SECRET_KEY", "supersecret")
+log = logging.getLogger(__name__)
+trace_log = logging.getLogger("trace.orders")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
 load_dotenv()
 INITIAL_BALANCE = Decimal(os.getenv("INITIAL_BALANCE", "3000.00"))
+# статический Bearer-токен для /metrics и /internal/* (скрейпер Prometheus); без него — только админ
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
 
 # --- init ---
+logs.configure()
 init_db()
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logs.configure()
+    # фоновое снятие просроченных броней
+    sweeper = asyncio.create_task(holds.run_sweeper(SessionLocal))
+    passwords.start()
+    # push статусов мест; между воркерами — через LISTEN/NOTIFY
+    seatfeed.start()
+    tasks = [sweeper]
+    if async_engine.dialect.name == "postgresql":
+        tasks.append(asyncio.create_task(seatfeed.listen(async_engine)))
+    # периодическая сверка счётчиков tier_inventory с tickets
+    tasks.append(asyncio.create_task(inventory.run_reconciler(SessionLocal)))
+    # отмены событий, прерванные прошлой остановкой
+    tasks.append(asyncio.create_task(asyncio.to_thread(refunds.resume, SessionLocal)))
+    # снимки метрик для /metrics других воркеров
+    tasks.append(asyncio.create_task(metrics.run_flusher()))
+    # проверка здоровья и отставания реплик чтения
+    tasks.append(asyncio.create_task(replicas.run_health_checks()))
+    yield
+    for task in tasks:
+        task.cancel()
+    passwords.shutdown()
+    logs.shutdown()
+    await replicas.replica_set.dispose()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+# кэш каталога — внутри CORS, чтобы CORS-заголовки добавлялись и к ответам из кэша
+app.add_middleware(response_cache.ResponseCacheMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER],
 )
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# снаружи всех: время ответа с учётом CORS и кэша
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(replicas.ReadAfterWriteMiddleware)
+# снаружи всех: request_id есть у логов любого слоя и у ответов из кэша
+app.add_middleware(logs.RequestIdMiddleware)
 
 # --- auth utils ---
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        email = payload.get("sub")
-        if not email:
-            raise HTTPException(status_code=401, detail="Invalid auth")
-    except JWTError:
+def get_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> auth.Principal:
+    """
+    Пользователь из токена. Берётся из кэша принципалов; при промахе — один SELECT по id.
+    Сессия db без промаха к базе не подключается.
+    """
+    user_id = auth.decode_user_id(token)
+    if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid auth")
 
-    user = db.query(models.User).filter(models.User.email == email).first()
+    principal = auth.principal_cache.get(user_id)
+    if principal is None:
+        user = db.get(models.User, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        principal = auth.Principal.from_user(user)
+        auth.principal_cache.put(user_id, principal)
+    return principal
+
+def get_current_user(principal: auth.Principal = Depends(get_principal), db: Session = Depends(get_db)):
+    """ORM-объект пользователя — для обработчиков, которые меняют его строку (кошелёк, профиль)."""
+    user = db.get(models.User, principal.id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
-def require_admin(current_user: models.User = Depends(get_current_user)):
+def require_admin(current_user: auth.Principal = Depends(get_principal)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+def require_internal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    """Служебные эндпоинты: INTERNAL_TOKEN или токен админа."""
+    if INTERNAL_TOKEN and hmac.compare_digest(token.encode(), INTERNAL_TOKEN.encode()):
+        return None
+    return require_admin(get_principal(token, db))
+
+def _auth_response(user: models.User):
+    auth.principal_cache.put(user.id, auth.Principal.from_user(user))
+    return {
+        "access_token": auth.create_access_token(user),
+        "token_type": "bearer",
+        "user": {
+            "id": user.id,
+            "email": user.email,
+            "full_name": user.full_name,
+            "wallet_balance": float(user.wallet_balance or 0)
+        }
+    }
+
+# --- internal ---
+@app.get("/internal/pool")
+def pool_status(_=Depends(require_internal)):
+    """Состояние пулов соединений: занято/переполнение и гистограмма ожидания соединения."""
+    return pool_metrics.snapshot()
+
+@app.get("/internal/replicas")
+def replicas_status(_=Depends(require_internal)):
+    """Реплики чтения: в ротации ли и отставание (секунд)."""
+    return replicas.replica_set.status()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics(_=Depends(require_internal)):
+    """Метрики маршрутов и SQL в формате Prometheus (сумма по воркерам, см. metrics.py)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- events ---
 @app.get("/events", response_model=list[schemas.EventBase])
-def list_events(limit: int = 20, venue_id: int = None, db: Session = Depends(get_db)):
-    query = db.query(models.Event)
-    if venue_id is not None:
-        query = query.filter(models.Event.venue_id == venue_id)
-    return query.limit(limit).all()
+async def list_events(
+    response: Response,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    venue_id: int = None,
+    genre_id: int = None,
+    date_from: datetime = None,
+    date_to: datetime = None,
+    cursor: str = None,
+    db: AsyncSession = Depends(replicas.get_async_read_db),
+):
+    """
+    Каталог по дате начала. Курсор следующей страницы — в заголовке X-Next-Cursor
+    (нет заголовка — страниц больше нет), передаётся обратно как ?cursor=.
+    """
+    try:
+        after = pagination.decode_cursor(cursor, datetime, int) if cursor else None
+    except pagination.CursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    events, next_cursor = await crud_async.get_events(db, limit, venue_id, genre_id, date_from, date_to, after)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return events
 
 
 @app.get("/events/{event_id}/tickets")
-def available_tickets(event_id: int, tier_id: int, db: Session = Depends(get_db)):
-    rows = db.execute(
-        text("""
-        SELECT t.id, s.row_label, s.seat_number, t.status
-        FROM tickets t
-        JOIN seats s ON s.id = t.seat_id
-        WHERE t.event_id = :e AND t.tier_id = :t
-        ORDER BY s.row_label, s.seat_number
-        """),
-        {"e": event_id, "t": tier_id}
-    ).fetchall()
+async def available_tickets(event_id: int, tier_id: int, db: AsyncSession = Depends(get_async_db)):
+    rows = await crud_async.get_event_tickets(db, event_id, tier_id)
 
     return [
         {
@@ -91,19 +179,48 @@ def available_tickets(event_id: int, tier_id: int, db: Session = Depends(get_db)
         for r in rows
     ]
 
+@app.get("/events/{event_id}/tiers/{tier_id}/layout")
+async def seat_layout(event_id: int, tier_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Статичная схема мест тарифа: [[ticket_id, row_label, seat_number], ...] в порядке ordinal."""
+    layout = await seatmap.get_layout(db, event_id, tier_id)
+    return {"layout_version": layout.version, "seats": layout.seats}
+
+@app.get("/events/{event_id}/tiers/{tier_id}/availability")
+async def seat_availability(event_id: int, tier_id: int, since: str = None, db: AsyncSession = Depends(get_async_db)):
+    """Статусы мест по 2 бита (base64) или изменения с версии since."""
+    snapshot = await seatmap.get_snapshot(db, event_id, tier_id)
+    return seatmap.availability_payload(event_id, tier_id, snapshot, since)
+
+@app.get("/events/{event_id}/seats/stream")
+async def seat_stream(event_id: int, request: Request):
+    """SSE: изменения статусов мест события, data: [[ticket_id, code], ...]; event: resync — перечитать availability."""
+    return StreamingResponse(
+        seatfeed.stream(event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/events/top", response_model=list[schemas.EventBase])
-def top_events(limit: int = 10, db: Session = Depends(get_db)):
-    return crud.get_top_events(db, limit)
+async def top_events(limit: int = 10, db: AsyncSession = Depends(replicas.get_async_read_db)):
+    return await crud_async.get_top_events(db, limit)
 
 @app.get("/events/{event_id}", response_model=schemas.EventBase)
-def event_detail(event_id: int, db: Session = Depends(get_db)):
-    ev = crud.get_event(db, event_id)
+async def event_detail(event_id: int, db: AsyncSession = Depends(replicas.get_async_read_db)):
+    ev = await crud_async.get_event(db, event_id)
     if not ev:
         raise HTTPException(status_code=404, detail="event not found")
     return ev
 
+@app.get("/events/{event_id}/availability")
+async def event_availability(event_id: int, db: AsyncSession = Depends(get_async_db)):
+    """available / held / sold и has_seats всех тарифов события — один запрос к tier_inventory."""
+    tiers = await crud_async.get_event_availability(db, event_id)
+    if not tiers and await db.get(models.Event, event_id) is None:
+        raise HTTPException(status_code=404, detail="event not found")
+    return {"event_id": event_id, "tiers": tiers}
+
 @app.get("/events/{event_id}/min_price")
-def event_min_price(event_id: int, db: Session = Depends(get_db)):
+def event_min_price(event_id: int, db: Session = Depends(replicas.get_read_db)):
     min_price = crud.get_event_min_price(db, event_id)
     if min_price is None:
         raise HTTPException(status_code=404, detail="No tickets found")
@@ -147,7 +264,7 @@ def has_seats(event_id: int, db: Session = Depends(get_db)):
 
 # --- tickets ---
 @app.post("/tickets/{ticket_id}/activate")
-def activate_ticket(ticket_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def activate_ticket(ticket_id: int, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal)):
     """
     Активировать конкретный билет (ticket_id).
     Требования:
@@ -174,7 +291,7 @@ def activate_ticket(ticket_id: int, db: Session = Depends(get_db), current_user:
         except: pass
         raise
     except Exception as e:
-        traceback.print_exc()
+        log.exception("activate ticket failed")
         try: db.rollback()
         except: pass
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -182,96 +299,125 @@ def activate_ticket(ticket_id: int, db: Session = Depends(get_db), current_user:
 
 # --- orders: refund & list ---
 @app.post("/orders/{order_id}/refund")
-def refund_order(order_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def refund_order(order_id: int, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal)):
     """
     Частичный возврат: возвращаем только билеты с ticket.status == 'sold'.
     Не трогаем total_amount, меняем только статус и билетные статусы.
+    Позиции с билетами читаются одним запросом, билеты и кошелёк обновляются пачкой.
     """
     order = db.query(models.Order).filter(models.Order.id == order_id, models.Order.user_id == current_user.id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    refundable_items = [i for i in order.items if i.ticket and i.ticket.status == "sold"]
+    refundable_items = db.execute(
+        select(models.OrderItem.price, models.Ticket.id, models.Ticket.event_id, models.Ticket.tier_id)
+        .join(models.Ticket, models.Ticket.id == models.OrderItem.ticket_id)
+        .where(models.OrderItem.order_id == order.id, models.Ticket.status == "sold")
+        .order_by(models.Ticket.id)
+        .with_for_update(of=models.Ticket)
+    ).all()
     if not refundable_items:
         raise HTTPException(status_code=400, detail="Нет билетов для возврата (все активированы или отменены)")
 
-    refund_amount = sum(Decimal(str(i.price)) for i in refundable_items)
+    refund_amount = sum((Decimal(str(i.price)) for i in refundable_items), Decimal("0"))
 
     try:
-        # помечаем тикеты как canceled
-        for item in refundable_items:
-            item.ticket.status = "canceled"
-
-        # если все билеты возвращены — считаем заказ полностью возвращённым
-        if all(i.ticket.status != "sold" for i in order.items):
-            order.status = "refunded"
+        # помечаем тикеты как canceled; status в условии — как в create_order
+        canceled = db.execute(
+            update(models.Ticket)
+            .where(models.Ticket.id.in_([i.id for i in refundable_items]), models.Ticket.status == "sold")
+            .values(status="canceled")
+            .execution_options(synchronize_session=False)
+        )
+        if canceled.rowcount != len(refundable_items):
+            raise inventory.InventoryError("Some of the tickets have already been refunded")
+        seatfeed.notify(db, refundable_items, "canceled")
+        inventory.refund(db, inventory.count_by_tier(refundable_items))
+
+        # проданных билетов в заказе не осталось — считаем заказ полностью возвращённым
+        order.status = "refunded"
 
         # возвращаем деньги на кошелёк
-        current_user.wallet_balance = (Decimal(str(current_user.wallet_balance or 0)) + refund_amount)
-        db.add(models.WalletTransaction(user_id=current_user.id, amount=refund_amount, reason="refund"))
+        balance = db.execute(
+            update(models.User)
+            .where(models.User.id == current_user.id)
+            .values(wallet_balance=models.User.wallet_balance + refund_amount)
+            .returning(models.User.wallet_balance)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        db.execute(insert(models.WalletTransaction), [
+            {"user_id": current_user.id, "amount": refund_amount, "reason": "refund"}
+        ])
 
         db.commit()
+        auth.principal_cache.put(current_user.id, dataclasses.replace(current_user, wallet_balance=Decimal(str(balance))))
 
         return {
             "refunded": len(refundable_items),
             "amount": float(refund_amount),
-            "wallet_balance": float(current_user.wallet_balance)
+            "wallet_balance": float(balance)
         }
+    except inventory.InventoryError as e:
+        try: db.rollback()
+        except: pass
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception:
-        traceback.print_exc()
+        log.exception("refund failed")
         try: db.rollback()
         except: pass
         raise HTTPException(status_code=500, detail="Internal server error")
 
 # --- auth ---
-@app.post("/auth/register")
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    if db.query(models.User).filter(models.User.email == user.email).first():
+async def _rate_limit(action: str, request: Request, email: str):
+    """429 до запроса к базе и Argon2: корзины по IP клиента и по email (ratelimit.py)."""
+    try:
+        await ratelimit.limiter.check(action, ip=request.client.host if request.client else None,
+                                      email=email.strip().lower())
+    except ratelimit.RateLimited as e:
+        raise HTTPException(status_code=429, detail="Too many attempts, try again later",
+                            headers=ratelimit.retry_after_header(e))
+
+async def register_rate_limit(request: Request, user: schemas.UserCreate):
+    await _rate_limit("register", request, user.email)
+
+async def login_rate_limit(request: Request, form_data: schemas.UserLogin):
+    await _rate_limit("login", request, form_data.email)
+
+@app.post("/auth/register", dependencies=[Depends(register_rate_limit)])
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    if await crud_async.get_user_by_email(db, user.email):
         raise HTTPException(status_code=400, detail="Пользователь с таким email уже существует")
 
     db_user = models.User(
         email=user.email,
-        password_hash=argon2.hash(user.password),
+        password_hash=await passwords.hash_password(user.password),
         full_name=user.full_name or "",
         wallet_balance=INITIAL_BALANCE
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
-    token = jwt.encode({"sub": db_user.email}, SECRET_KEY, algorithm="HS256")
-    return {
-        "access_token": token,
-        "token_type": "bearer",
-        "user": {
-            "id": db_user.id,
-            "email": db_user.email,
-            "full_name": db_user.full_name,
-            "wallet_balance": float(db_user.wallet_balance or 0)
-        }
-    }
+    return _auth_response(db_user)
 
-@app.post("/auth/login")
-def login(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.email).first()
-    if not user or not argon2.verify(form_data.password, user.password_hash):
+@app.post("/auth/login", dependencies=[Depends(login_rate_limit)])
+async def login(form_data: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await crud_async.get_user_by_email(db, form_data.email)
+    if not user:
+        raise HTTPException(status_code=400, detail="Неправильный email или пароль")
+    ok, new_hash = await passwords.verify_password(form_data.password, user.password_hash)
+    if not ok:
         raise HTTPException(status_code=400, detail="Неправильный email или пароль")
+    if new_hash:
+        # параметры Argon2 поменялись — тихо пересохраняем хеш
+        user.password_hash = new_hash
+        await db.commit()
 
-    token = jwt.encode({"sub": user.email}, SECRET_KEY, algorithm="HS256")
-    return {
-        "access_token": token,
-        "token_type": "bearer",
-        "user": {
-            "id": user.id,
-            "email": user.email,
-            "full_name": user.full_name,
-            "wallet_balance": float(user.wallet_balance or 0)
-        }
-    }
+    return _auth_response(user)
 
 # --- users ---
 @app.get("/users/me")
-def get_me(current_user: models.User = Depends(get_current_user)):
+def get_me(current_user: auth.Principal = Depends(get_principal)):
     try:
         return {
             "id": current_user.id,
@@ -281,7 +427,7 @@ def get_me(current_user: models.User = Depends(get_current_user)):
             "role": current_user.role
         }
     except Exception:
-        traceback.print_exc()
+        log.exception("serialize user failed")
         raise HTTPException(status_code=500, detail="Failed to serialize user")
 
 @app.patch("/users/me")
@@ -293,6 +439,7 @@ def update_profile(updates: schemas.UserUpdate, db: Session = Depends(get_db), c
     if updates.full_name is not None:
         current_user.full_name = updates.full_name
     db.commit()
+    auth.principal_cache.invalidate(current_user.id)
     db.refresh(current_user)
     return {
         "id": current_user.id,
@@ -302,131 +449,242 @@ def update_profile(updates: schemas.UserUpdate, db: Session = Depends(get_db), c
     }
 
 
+# --- waiting room ---
+@app.post("/events/{event_id}/queue")
+def join_queue(event_id: int, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal)):
+    """Встать в очередь на покупку билетов события (при WAITING_ROOM_CHECKOUTS > 0)."""
+    if not waiting_room.enabled():
+        raise HTTPException(status_code=404, detail="Waiting room is disabled")
+    if not waiting_room.known(event_id) and db.get(models.Event, event_id) is None:
+        raise HTTPException(status_code=404, detail="event not found")
+    return waiting_room.join(event_id, current_user.id)
+
+@app.get("/events/{event_id}/queue")
+def queue_position(event_id: int, current_user: auth.Principal = Depends(get_principal)):
+    """Позиция в очереди, оценка ожидания в секундах и admission_token, когда очередь подошла."""
+    status = waiting_room.position(event_id, current_user.id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Not in queue")
+    return status
+
+
+def _admit(admission_token: str, user_id: int, event_id: int = None):
+    """Пропуск очереди, если она включена (None — выключена); 403 — пропуска нет или он на другое событие."""
+    if not waiting_room.enabled():
+        return None
+    try:
+        admission = waiting_room.admit(admission_token, user_id)
+    except waiting_room.AdmissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if event_id is not None and admission.event_id != event_id:
+        raise HTTPException(status_code=403, detail="Admission token is for another event")
+    return admission
+
+
 # --- orders: creation (already present) ---
 @app.post("/orders")
-def create_order(order_data: schemas.OrderCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    total = Decimal("0.00")
-    tickets_to_buy = []
+def create_order(order_data: schemas.OrderCreate, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal),
+                 admission_token: str = Header(None, alias=waiting_room.ADMISSION_HEADER)):
+    """
+    Число запросов к базе не зависит от размера корзины: билеты по id и по тарифам
+    выбираются и блокируются пачкой, позиции заказа пишутся одним INSERT.
+    Порядок блокировок всегда один — билеты (по id), счётчики тарифов (по tier_id),
+    строка пользователя — поэтому пересекающиеся заказы не дедлочат друг друга.
+    При включённой очереди (waiting_room) нужен пропуск — до любых запросов к базе.
+    """
+    ticket_ids, tier_counts = [], {}
+    for it in order_data.items:
+        if getattr(it, "ticket_id", None):
+            ticket_ids.append(it.ticket_id)
+        elif getattr(it, "tier_id", None):
+            tier_counts[it.tier_id] = tier_counts.get(it.tier_id, 0) + int(it.quantity or 1)
+        else:
+            raise HTTPException(status_code=400, detail="Order item must include ticket_id or tier_id")
+    if len(set(ticket_ids)) != len(ticket_ids):
+        duplicate = next(tid for tid in ticket_ids if ticket_ids.count(tid) > 1)
+        raise HTTPException(status_code=400, detail=f"Ticket {duplicate} not available")
+    admission = _admit(admission_token, current_user.id)
 
     try:
-        print("[ORDER] payload:", order_data)
-        print("[ORDER] user_before:", current_user.email, current_user.wallet_balance)
-
-        for it in order_data.items:
-            qty = int(it.quantity or 1)
-
-            if getattr(it, "ticket_id", None):
-                ticket = db.query(models.Ticket).with_for_update().filter(models.Ticket.id == it.ticket_id).first()
-                if not ticket:
-                    raise HTTPException(status_code=404, detail=f"Ticket {it.ticket_id} not found")
-                if ticket.status != "available":
-                    raise HTTPException(status_code=400, detail=f"Ticket {it.ticket_id} not available")
-                tickets_to_buy.append(ticket)
-                total += Decimal(str(ticket.price or 0))
-
-            elif getattr(it, "tier_id", None):
-                available = (
-                    db.query(models.Ticket)
-                      .with_for_update()
-                      .filter(models.Ticket.tier_id == it.tier_id, models.Ticket.status == "available")
-                      .order_by(models.Ticket.id)
-                      .limit(qty)
-                      .all()
-                )
-                if not available or len(available) < qty:
-                    raise HTTPException(status_code=400, detail=f"Not enough available tickets for tier {it.tier_id}")
-                for t in available:
-                    tickets_to_buy.append(t)
-                    total += Decimal(str(t.price or 0))
-            else:
-                raise HTTPException(status_code=400, detail="Order item must include ticket_id or tier_id")
-
-        print(f"[ORDER DEBUG] total={total}; balance_before={current_user.wallet_balance}")
-
-        user_balance = Decimal(str(current_user.wallet_balance or "0"))
-        if user_balance < total:
-            raise HTTPException(status_code=400, detail="Insufficient balance")
+        if logs.tracing():
+            trace_log.debug("order requested", extra={"user_id": current_user.id, "ticket_ids": ticket_ids, "tier_counts": tier_counts})
+
+        tickets_to_buy = inventory.lock_tickets(db, ticket_ids)
+        found = {t.id: t for t in tickets_to_buy}
+        for tid in ticket_ids:
+            if tid not in found:
+                raise HTTPException(status_code=404, detail=f"Ticket {tid} not found")
+            if found[tid].status != "available":
+                raise HTTPException(status_code=400, detail=f"Ticket {tid} not available")
+        # SKIP LOCKED: параллельные покупатели тарифа получают разные билеты
+        tickets_to_buy += inventory.allocate_tiers(db, tier_counts, exclude=ticket_ids)
+        if not tickets_to_buy:
+            raise HTTPException(status_code=400, detail="Empty order")
+        if admission is not None and any(t.event_id != admission.event_id for t in tickets_to_buy):
+            raise HTTPException(status_code=403, detail="Admission token is for another event")
+        total = sum((Decimal(str(t.price or 0)) for t in tickets_to_buy), Decimal("0.00"))
 
         new_order = models.Order(user_id=current_user.id, total_amount=total, status="paid")
         db.add(new_order)
         db.flush()
 
-        for ticket in tickets_to_buy:
-            ticket.status = "sold"
-            ticket.user_id = current_user.id
-            db.add(models.OrderItem(order_id=new_order.id, ticket_id=ticket.id, price=ticket.price))
-
-        current_user.wallet_balance = user_balance - total
-        db.add(models.WalletTransaction(user_id=current_user.id, amount=-total, reason="purchase"))
+        ids = [t.id for t in tickets_to_buy]
+        # status в условии: без FOR UPDATE (SQLite) параллельный заказ мог забрать билет после выборки
+        sold = db.execute(
+            update(models.Ticket)
+            .where(models.Ticket.id.in_(ids), models.Ticket.status == "available")
+            .values(status="sold", user_id=current_user.id)
+            .execution_options(synchronize_session=False)
+        )
+        if sold.rowcount != len(ids):
+            raise inventory.InventoryError("Some of the selected tickets are no longer available")
+        db.execute(insert(models.OrderItem), [
+            {"order_id": new_order.id, "ticket_id": t.id, "price": t.price} for t in tickets_to_buy
+        ])
+        db.execute(insert(models.WalletTransaction), [
+            {"user_id": current_user.id, "amount": -total, "reason": "purchase"}
+        ])
+        seatfeed.notify(db, tickets_to_buy, "sold")
+
+        inventory.reserve(db, inventory.count_by_tier(tickets_to_buy))
+
+        # списание без чтения баланса: проверка и вычитание в одном UPDATE
+        balance = db.execute(
+            update(models.User)
+            .where(models.User.id == current_user.id, models.User.wallet_balance >= total)
+            .values(wallet_balance=models.User.wallet_balance - total)
+            .returning(models.User.wallet_balance)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if balance is None:
+            raise HTTPException(status_code=400, detail="Insufficient balance")
 
+        order_id = new_order.id
         db.commit()
-
-        print(f"[ORDER DEBUG] user_after={current_user.email} balance_after={current_user.wallet_balance}")
+        # баланс уже известен из RETURNING — обновляем кэш, а не сбрасываем его
+        auth.principal_cache.put(current_user.id, dataclasses.replace(current_user, wallet_balance=Decimal(str(balance))))
+        if admission is not None:
+            waiting_room.release(admission)
+        if logs.tracing():
+            trace_log.debug("order paid", extra={"order_id": order_id, "user_id": current_user.id, "tickets": len(tickets_to_buy),
+                                                 "total": total, "wallet_balance": balance})
 
     except HTTPException:
         try: db.rollback()
         except: pass
         raise
+    except inventory.InventoryError as e:
+        try: db.rollback()
+        except: pass
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception:
-        traceback.print_exc()
+        log.exception("order failed")
         try: db.rollback()
         except: pass
         raise HTTPException(status_code=500, detail="Internal server error")
 
     return {
-        "id": new_order.id,
-        "total_amount": float(new_order.total_amount),
-        "status": new_order.status,
+        "id": order_id,
+        "total_amount": float(total),
+        "status": "paid",
         "items": [{"ticket_id": t.id, "price": float(t.price)} for t in tickets_to_buy],
-        "wallet_balance": float(current_user.wallet_balance)
+        "wallet_balance": float(balance)
     }
 
 
+# --- holds ---
+def _hold_error(db: Session, e: Exception):
+    try: db.rollback()
+    except: pass
+    if isinstance(e, holds.HoldError):
+        return HTTPException(status_code=e.status_code, detail=e.detail)
+    return HTTPException(status_code=409, detail=str(e))
+
+@app.post("/events/{event_id}/holds")
+def create_hold(event_id: int, data: schemas.HoldCreate, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal),
+                admission_token: str = Header(None, alias=waiting_room.ADMISSION_HEADER)):
+    """
+    Бронирует места (ticket_id) или количество билетов тарифа (tier_id + quantity)
+    на HOLD_TTL_SECONDS. Оплата — POST /holds/{hold_id}/checkout.
+    При включённой очереди нужен пропуск этого события; место в очереди занято
+    до оплаты или снятия брони (с тем же заголовком) либо до истечения пропуска.
+    """
+    _admit(admission_token, current_user.id, event_id)
+    try:
+        hold, tickets = holds.create_hold(db, current_user.id, event_id, data.items)
+    except (holds.HoldError, inventory.InventoryError) as e:
+        raise _hold_error(db, e)
+    return {
+        "id": hold.id,
+        "event_id": hold.event_id,
+        "expires_at": hold.expires_at,
+        "total_amount": float(sum(Decimal(str(t.price or 0)) for t in tickets)),
+        "items": [{"ticket_id": t.id, "price": float(t.price)} for t in tickets]
+    }
+
+@app.post("/holds/{hold_id}/checkout")
+def checkout_hold(hold_id: int, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal),
+                  admission_token: str = Header(None, alias=waiting_room.ADMISSION_HEADER)):
+    admission = _admit(admission_token, current_user.id)
+    try:
+        order, tickets, balance = holds.checkout_hold(db, current_user.id, hold_id,
+                                                      event_id=admission.event_id if admission else None)
+    except holds.HoldError as e:
+        raise _hold_error(db, e)
+    auth.principal_cache.put(current_user.id, dataclasses.replace(current_user, wallet_balance=balance))
+    if admission is not None:
+        waiting_room.release(admission)
+    return {
+        "id": order.id,
+        "total_amount": float(order.total_amount),
+        "status": order.status,
+        "items": [{"ticket_id": t.id, "price": float(t.price)} for t in tickets],
+        "wallet_balance": float(balance)
+    }
+
+@app.delete("/holds/{hold_id}")
+def release_hold(hold_id: int, db: Session = Depends(get_db), current_user: auth.Principal = Depends(get_principal),
+                 admission_token: str = Header(None, alias=waiting_room.ADMISSION_HEADER)):
+    try:
+        released = holds.release_hold(db, current_user.id, hold_id)
+    except holds.HoldError as e:
+        raise _hold_error(db, e)
+    # покупатель передумал — его место в очереди отдаётся следующему
+    if waiting_room.enabled() and admission_token:
+        try:
+            waiting_room.release(waiting_room.admit(admission_token, current_user.id))
+        except waiting_room.AdmissionError:
+            pass
+    return {"status": "released", "released": released}
+
+
 @app.get("/orders/me")
-def get_my_orders(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_my_orders(
+    response: Response,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    status: str = None,
+    event_id: int = None,
+    cursor: str = None,
+    db: Session = Depends(replicas.get_read_db),
+    current_user: auth.Principal = Depends(get_principal),
+):
     """
-    Возвращаем заказы пользователя с деталями билетов.
-    Сортируем по newest first.
+    Заказы пользователя с деталями билетов, newest first, постранично.
+    Курсор следующей страницы — в заголовке X-Next-Cursor, передаётся обратно как ?cursor=.
+    Фильтры: status заказа, event_id (заказы с билетами этого события).
     """
-    orders = db.query(models.Order).options(
-        joinedload(models.Order.items).joinedload(models.OrderItem.ticket).joinedload(models.Ticket.event),
-        joinedload(models.Order.items).joinedload(models.OrderItem.ticket).joinedload(models.Ticket.tier),
-        joinedload(models.Order.items).joinedload(models.OrderItem.ticket).joinedload(models.Ticket.seat),
-    ).filter(models.Order.user_id == current_user.id).order_by(models.Order.created_at.desc()).all()
-
-    result = []
-    for o in orders:
-        order_items = []
-        for i in o.items:
-            ticket = i.ticket
-            if not ticket:
-                continue
-            event = ticket.event
-            tier = ticket.tier
-            seat_label = f"{getattr(ticket.seat, 'row_label','')}{getattr(ticket.seat,'seat_number','')}" if ticket.seat else None
-            order_items.append({
-                "id": i.id,
-                "ticket_id": ticket.id,
-                "ticket_name": getattr(ticket, "qr_code", f"Билет {ticket.id}"),
-                "tier_name": tier.name if tier else None,
-                "seat_label": seat_label,
-                "event_title": event.title if event else None,
-                "event_poster": getattr(event, "poster_url", None),
-                "price": float(i.price),
-                "status": ticket.status
-            })
-
-        result.append({
-            "id": o.id,
-            "total_amount": float(o.total_amount),
-            "status": o.status,
-            "items": order_items
-        })
-    return result
+    try:
+        before = pagination.decode_cursor(cursor, datetime, int) if cursor else None
+    except pagination.CursorError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    orders, next_cursor = crud.get_user_orders(db, current_user.id, limit, status, event_id, before)
+    if next_cursor:
+        response.headers[pagination.NEXT_CURSOR_HEADER] = next_cursor
+    return orders
 
 # --- venues ---
 @app.get("/venues")
-def list_venues(db: Session = Depends(get_db)):
+def list_venues(db: Session = Depends(replicas.get_read_db)):
     """
     Возвращаем все залы с их базовой инфой.
     """
@@ -442,8 +700,8 @@ def list_venues(db: Session = Depends(get_db)):
     ]
 
 @app.get("/venues/{venue_id}/seats")
-def venue_seats(venue_id: int, db: Session = Depends(get_db)):
-    seats = db.query(models.Seat).filter(models.Seat.venue_id == venue_id).order_by(models.Seat.row_label, models.Seat.seat_number).all()
+async def venue_seats(venue_id: int, db: AsyncSession = Depends(replicas.get_async_read_db)):
+    seats = await crud_async.get_venue_seats(db, venue_id)
     return [
         {
             "id": s.id,
@@ -456,7 +714,7 @@ def venue_seats(venue_id: int, db: Session = Depends(get_db)):
     ]
 
 @app.get("/venues/{venue_id}")
-def get_venue(venue_id: int, db: Session = Depends(get_db)):
+def get_venue(venue_id: int, db: Session = Depends(replicas.get_read_db)):
     v = db.query(models.Venue).filter(models.Venue.id == venue_id).first()
     if not v:
         raise HTTPException(status_code=404, detail="Venue not found")
@@ -476,7 +734,7 @@ def admin_list_venues(db: Session = Depends(get_db), _: models.User = Depends(re
 
 # --- GET ALL GENRES ---
 @app.get("/genres")
-def list_genres(db: Session = Depends(get_db)):
+def list_genres(db: Session = Depends(replicas.get_read_db)):
     return db.query(models.Genre).all()
 
 @app.post("/admin/events")
@@ -494,7 +752,11 @@ def admin_update_event(
     db: Session = Depends(get_db),
     _: models.User = Depends(require_admin)
 ):
-    ev = crud.admin_update_event(db, event_id, data)
+    try:
+        ev = crud.admin_update_event(db, event_id, data)
+    except inventory.InventoryError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
     if not ev:
         raise HTTPException(status_code=404, detail="Event not found")
     ev = db.query(models.Event)\
@@ -519,6 +781,40 @@ def admin_delete_event(
         raise HTTPException(status_code=404, detail="Event not found")
     return {"status": "deleted"}
 
+@app.post("/admin/events/{event_id}/cancel", status_code=202)
+def admin_cancel_event(
+    event_id: int,
+    background: BackgroundTasks,
+    db: Session = Depends(get_db),
+    _: models.User = Depends(require_admin)
+):
+    """
+    Отменяет событие: все билеты — в 'canceled', деньги за проданные — на кошельки покупателей.
+    Работает в фоне пачками (refunds.py); прогресс — GET этого же адреса. Повторный вызов
+    продолжает прерванную отмену.
+    """
+    if refunds.start(db, event_id) is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    response_cache.invalidate("/events")
+    background.add_task(refunds.run, SessionLocal, event_id)
+    return refunds.progress(db, event_id)
+
+@app.get("/admin/events/{event_id}/cancel")
+def admin_cancel_event_progress(event_id: int, db: Session = Depends(get_db), _: models.User = Depends(require_admin)):
+    progress = refunds.progress(db, event_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Cancellation not found")
+    return progress
+
+@app.post("/admin/inventory/reconcile")
+def admin_reconcile_inventory(
+    event_id: int = None,
+    db: Session = Depends(get_db),
+    _: models.User = Depends(require_admin)
+):
+    """Сверить счётчики tier_inventory с tickets (всех событий или одного) и исправить расхождения."""
+    return {"fixed": inventory.reconcile(db, event_id)}
+
 # --- ADMIN VENUES ---
 
 @app.post("/admin/venues")
@@ -0,0 +1,307 @@
+"""
+Метрики запросов для Prometheus: GET /metrics (text format 0.0.4).
+
+  http_requests_total{method,route,status}            — число ответов
+  http_request_duration_seconds{method,route}          — гистограмма времени ответа
+  http_request_db_queries{method,route}                — гистограмма числа SQL-запросов на запрос
+  http_request_db_seconds_total{method,route}          — суммарное время в базе
+  db_queries_total / db_query_seconds_total            — все SQL-запросы процесса, в т.ч. фоновые
+
+route — шаблон маршрута FastAPI (/events/{event_id}), а не сырой путь, чтобы
+число рядов не росло с числом событий.
+
+SQL считается хуками before/after_cursor_execute на всех Engine (sync и async),
+они же передают каждый statement в sqltrace (медленные запросы, N+1):
+запрос HTTP кладёт свой RequestStats в contextvar, и sync-обработчики в
+threadpool видят тот же объект (контекст копируется в поток). Statement внутри
+запроса копится только в RequestStats, без lock; реестр (и счётчики процесса)
+обновляется один раз на запрос, под одним коротким lock. Под lock на каждый
+statement идут лишь запросы вне HTTP: фоновые задачи и то, что запрос оставил
+после ответа (задачи, унаследовавшие его контекст).
+
+Несколько воркеров uvicorn: у каждого процесса свой реестр. Если задан
+METRICS_DIR, воркер раз в METRICS_FLUSH_INTERVAL секунд (и при каждом /metrics)
+атомарно пишет снимок в METRICS_DIR/<pid>.json, а /metrics суммирует снимки
+всех воркеров — любой воркер за балансировщиком отдаёт общие числа. Снимки
+завершившихся воркеров остаются: счётчики Prometheus не должны уменьшаться.
+Каталог нужно очищать при перезапуске сервиса.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import sqltrace
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+UNMATCHED = "<unmatched>"
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_seconds: float = 0.0
+    scope: dict = None
+    shapes: dict = field(default_factory=dict)  # нормализованный SQL -> сколько раз (sqltrace)
+    done: bool = False  # уже учтён в реестре: дальнейшие statement — напрямую в реестр
+
+    def route(self) -> str:
+        return route_template(self.scope) if self.scope is not None else UNMATCHED
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+
+def _bucket(bounds, value) -> int:
+    i = 0
+    while i < len(bounds) and value > bounds[i]:
+        i += 1
+    return i
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}   # (method, route, status) -> n
+        self.routes = {}     # (method, route) -> [latency buckets, latency sum, query buckets, queries, db seconds, n]
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        lat, q = _bucket(LATENCY_BUCKETS, seconds), _bucket(QUERY_BUCKETS, stats.queries)
+        with self._lock:
+            key = (method, route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            r = self.routes.get((method, route))
+            if r is None:
+                r = self.routes[(method, route)] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0,
+                                                    [0] * (len(QUERY_BUCKETS) + 1), 0, 0.0, 0]
+            r[0][lat] += 1
+            r[1] += seconds
+            r[2][q] += 1
+            r[3] += stats.queries
+            r[4] += stats.db_seconds
+            r[5] += 1
+            self.queries += stats.queries
+            self.db_seconds += stats.db_seconds
+
+    def observe_query(self, seconds: float):
+        """SQL вне HTTP-запроса; statement запроса учитываются в observe_request."""
+        with self._lock:
+            self.queries += 1
+            self.db_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": [[*k, n] for k, n in self.requests.items()],
+                "routes": [[m, route, [list(r[0]), r[1], list(r[2]), r[3], r[4], r[5]]]
+                           for (m, route), r in self.routes.items()],
+                "queries": self.queries,
+                "db_seconds": self.db_seconds,
+            }
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.routes.clear()
+            self.queries, self.db_seconds = 0, 0.0
+
+
+registry = Registry()
+
+
+# ---------------- SQL ----------------
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("metrics_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    stats = _current.get()
+    if stats is None or stats.done:
+        registry.observe_query(seconds)
+    else:
+        stats.queries += 1
+        stats.db_seconds += seconds
+    sqltrace.observe(statement, seconds, stats)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    started = context.connection.info.get("metrics_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+# ---------------- HTTP ----------------
+
+def route_template(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # ответ не дошёл до роутера (например, отдан кэшем ответов) — сопоставляем сами
+    app = scope.get("app")
+    if app is not None:
+        from starlette.routing import Match
+
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+    return UNMATCHED
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope=scope)
+        token = _current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            stats.done = True
+            registry.observe_request(scope["method"], route_template(scope), status, time.perf_counter() - started, stats)
+
+
+# ---------------- воркеры и экспорт ----------------
+
+def flush():
+    """Пишет снимок реестра этого процесса в METRICS_DIR/<pid>.json (атомарно)."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, path)
+
+
+async def run_flusher(interval: float = METRICS_FLUSH_INTERVAL):
+    if not METRICS_DIR or interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception:
+            log.exception("metrics flush failed")
+
+
+def _snapshots():
+    if not METRICS_DIR:
+        return [registry.snapshot()]
+    flush()
+    snaps = []
+    for name in sorted(os.listdir(METRICS_DIR)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snaps.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # файл воркера переписывается прямо сейчас
+    return snaps
+
+
+def merge(snaps) -> dict:
+    requests, routes, queries, db_seconds = {}, {}, 0, 0.0
+    for snap in snaps:
+        for method, route, status, n in snap["requests"]:
+            requests[(method, route, status)] = requests.get((method, route, status), 0) + n
+        for method, route, r in snap["routes"]:
+            acc = routes.get((method, route))
+            if acc is None:
+                routes[(method, route)] = [list(r[0]), r[1], list(r[2]), r[3], r[4], r[5]]
+                continue
+            acc[0] = [a + b for a, b in zip(acc[0], r[0])]
+            acc[2] = [a + b for a, b in zip(acc[2], r[2])]
+            for i in (1, 3, 4, 5):
+                acc[i] += r[i]
+        queries += snap["queries"]
+        db_seconds += snap["db_seconds"]
+    return {"requests": requests, "routes": routes, "queries": queries, "db_seconds": db_seconds}
+
+
+def _labels(**labels) -> str:
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram(lines, name, labels, bounds, counts, total, n):
+    cumulative = 0
+    for bound, c in zip(bounds + (float("inf"),), counts):
+        cumulative += c
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f"{name}_bucket{_labels(**labels, le=le)} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {total}")
+    lines.append(f"{name}_count{_labels(**labels)} {n}")
+
+
+def render() -> str:
+    data = merge(_snapshots())
+    lines = [
+        "# HELP http_requests_total HTTP responses by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, route, status), n in sorted(data["requests"].items()):
+        lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {n}")
+
+    routes = sorted(data["routes"].items())
+    lines += ["# HELP http_request_duration_seconds HTTP request latency.",
+              "# TYPE http_request_duration_seconds histogram"]
+    for (method, route), r in routes:
+        _histogram(lines, "http_request_duration_seconds", {"method": method, "route": route},
+                   LATENCY_BUCKETS, r[0], r[1], r[5])
+    lines += ["# HELP http_request_db_queries SQL statements issued per HTTP request.",
+              "# TYPE http_request_db_queries histogram"]
+    for (method, route), r in routes:
+        _histogram(lines, "http_request_db_queries", {"method": method, "route": route},
+                   QUERY_BUCKETS, r[2], r[3], r[5])
+    lines += ["# HELP http_request_db_seconds_total Time spent in SQL statements by route.",
+              "# TYPE http_request_db_seconds_total counter"]
+    for (method, route), r in routes:
+        lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {r[4]}")
+
+    lines += ["# HELP db_queries_total SQL statements executed, including background tasks.",
+              "# TYPE db_queries_total counter",
+              f"db_queries_total {data['queries']}",
+              "# HELP db_query_seconds_total Time spent in SQL statements, including background tasks.",
+              "# TYPE db_query_seconds_total counter",
+              f"db_query_seconds_total {data['db_seconds']}"]
+    return "\n".join(lines) + "\n"
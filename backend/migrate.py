@@ -0,0 +1,146 @@
+"""
+Версионные миграции схемы: backend/migrations/NNNN_name.sql.
+
+Таблицы создаёт init_db() (create_all по models.py), всё остальное — индексы
+и изменения существующих таблиц — только миграциями. Применённые версии
+хранятся в schema_migrations, каждая миграция выполняется один раз.
+Пустая база создаётся сразу по models.py, и все миграции отмечаются
+применёнными (stamp); база из docker/init-schema.sql или от прежних версий
+приложения доводится миграциями. create_all не добавляет колонок в существующие
+таблицы, а новые создаёт сразу со всеми колонками, поэтому колонки добавляются
+только через ADD COLUMN IF NOT EXISTS (в SQLite такого синтаксиса нет — там
+колонка проверяется по PRAGMA table_info).
+
+Операторы выполняются по одному в autocommit: CREATE/DROP INDEX CONCURRENTLY
+не работает внутри транзакции и не блокирует запись в таблицу. В SQLite
+CONCURRENTLY просто убирается. Несколько воркеров, стартующих одновременно,
+сериализуются pg_advisory_lock.
+
+    cd backend
+    python migrate.py           # создать новые таблицы и применить новые миграции
+    python migrate.py status    # список миграций и их состояние
+"""
+import os
+import re
+import sys
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, func, select
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+ADD_COLUMN = re.compile(r"ALTER TABLE (\w+) ADD COLUMN IF NOT EXISTS (\w+)", re.IGNORECASE)
+ADVISORY_LOCK_ID = 20240611
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", metadata,
+    Column("version", String, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+
+def available():
+    """[(version, name, path)] по возрастанию версии."""
+    found = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = MIGRATION_FILE.match(filename)
+        if m:
+            found.append((m.group(1), m.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return found
+
+
+def statements(path: str, dialect: str):
+    with open(path, encoding="utf-8") as f:
+        sql = "\n".join(line for line in f if not line.lstrip().startswith("--"))
+    for stmt in sql.split(";"):
+        stmt = " ".join(stmt.split())
+        if not stmt:
+            continue
+        if dialect != "postgresql":
+            stmt = stmt.replace(" CONCURRENTLY", "")
+        yield stmt
+
+
+def _drop_invalid_index(conn, stmt: str):
+    # прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс,
+    # и IF NOT EXISTS при повторе его бы пропустил
+    m = re.match(r"CREATE (?:UNIQUE )?INDEX CONCURRENTLY IF NOT EXISTS (\w+)", stmt, re.IGNORECASE)
+    if not m:
+        return
+    invalid = conn.exec_driver_sql(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        f"WHERE c.relname = '{m.group(1)}' AND NOT i.indisvalid"
+    ).first()
+    if invalid:
+        conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {m.group(1)}")
+
+
+def _add_column_sqlite(conn, stmt: str):
+    """ADD COLUMN IF NOT EXISTS для SQLite: None — колонка уже есть, иначе оператор без IF NOT EXISTS."""
+    m = ADD_COLUMN.match(stmt)
+    if not m:
+        return stmt
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({m.group(1)})")}
+    if m.group(2) in columns:
+        return None
+    return re.sub(r" IF NOT EXISTS", "", stmt, count=1, flags=re.IGNORECASE)
+
+
+def applied(conn):
+    metadata.create_all(conn)
+    return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def stamp(engine):
+    """Отмечает все миграции применёнными — для базы, только что созданной по models.py."""
+    with engine.begin() as conn:
+        seen = applied(conn)
+        for version, name, _ in available():
+            if version not in seen:
+                conn.execute(schema_migrations.insert().values(version=version, name=name))
+
+
+def upgrade(engine):
+    """Применяет ещё не применённые миграции; возвращает их версии."""
+    dialect = engine.dialect.name
+    done = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if dialect == "postgresql":
+            conn.exec_driver_sql(f"SELECT pg_advisory_lock({ADVISORY_LOCK_ID})")
+        try:
+            seen = applied(conn)
+            for version, name, path in available():
+                if version in seen:
+                    continue
+                for stmt in statements(path, dialect):
+                    if dialect == "postgresql":
+                        _drop_invalid_index(conn, stmt)
+                    elif dialect == "sqlite":
+                        stmt = _add_column_sqlite(conn, stmt)
+                        if stmt is None:
+                            continue
+                    conn.exec_driver_sql(stmt)
+                conn.execute(schema_migrations.insert().values(version=version, name=name))
+                done.append(version)
+        finally:
+            if dialect == "postgresql":
+                conn.exec_driver_sql(f"SELECT pg_advisory_unlock({ADVISORY_LOCK_ID})")
+    return done
+
+
+def main():
+    from database import engine, init_db
+
+    if sys.argv[1:] == ["status"]:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            seen = applied(conn)
+        for version, name, _ in available():
+            print(f"{version} {name:40s} {'applied' if version in seen else 'pending'}")
+        return
+    done = init_db(engine)
+    print("applied: " + (", ".join(done) if done else "nothing"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,12 @@
+-- Колонки, которых нет у баз от прежних версий приложения: create_all создаёт новые
+-- таблицы (ticket_holds, tier_inventory), но не дополняет существующие (tickets).
+-- Версия 0000 — раньше 0001, которой нужен tickets.hold_id; на уже обновлённых базах
+-- все операторы — no-op.
+
+-- брони (holds.py)
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS hold_id INTEGER REFERENCES ticket_holds (id) ON DELETE SET NULL;
+
+-- счётчики состояний (inventory.py); tier_inventory из docker/init-schema.sql — только с available
+ALTER TABLE tier_inventory ADD COLUMN IF NOT EXISTS held INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tier_inventory ADD COLUMN IF NOT EXISTS sold INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tier_inventory ADD COLUMN IF NOT EXISTS has_seats BOOLEAN NOT NULL DEFAULT false;
@@ -0,0 +1,27 @@
+-- Индексы горячих запросов main.py / crud.py / inventory.py / holds.py.
+-- Составные индексы вместо малоселективного idx_tickets_status.
+
+-- каталог: keyset-пагинация GET /events по (start_datetime, id), с фильтрами и без
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_start_id ON events (start_datetime, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_genre_start_id ON events (genre_id, start_datetime, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_venue_start_id ON events (venue_id, start_datetime, id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_events_start;
+
+-- тарифы события
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_price_tiers_event ON price_tiers (event_id);
+
+-- билеты: места тарифа (/events/{id}/tickets, доступность), выдача билетов тарифа по id, брони
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_event_tier_status ON tickets (event_id, tier_id, status);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_tier_status_id ON tickets (tier_id, status, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_hold ON tickets (hold_id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_tickets_status;
+
+-- просроченные брони для sweeper'а
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ticket_holds_active_expiry ON ticket_holds (expires_at) WHERE status = 'active';
+
+-- схема зала
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_seats_venue_row_number ON seats (venue_id, row_label, seat_number);
+
+-- история заказов пользователя
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_order_items_order ON order_items (order_id);
@@ -0,0 +1,8 @@
+-- Счётчики tier_inventory по всем состояниям билета: held, sold (sold + activated) и признак сидячего тарифа.
+-- Для GET /events/{id}/availability без COUNT(*) по tickets. Колонки добавляет 0000.
+
+UPDATE tier_inventory SET
+    available = (SELECT count(*) FROM tickets t WHERE t.tier_id = tier_inventory.tier_id AND t.status = 'available'),
+    held = (SELECT count(*) FROM tickets t WHERE t.tier_id = tier_inventory.tier_id AND t.status = 'held'),
+    sold = (SELECT count(*) FROM tickets t WHERE t.tier_id = tier_inventory.tier_id AND t.status IN ('sold', 'activated')),
+    has_seats = EXISTS (SELECT 1 FROM tickets t WHERE t.tier_id = tier_inventory.tier_id AND t.seat_id IS NOT NULL);
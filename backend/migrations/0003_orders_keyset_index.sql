@@ -0,0 +1,4 @@
+-- GET /orders/me: keyset-пагинация по (created_at, id) внутри пользователя.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_orders_user_created_id ON orders (user_id, created_at, id);
+DROP INDEX CONCURRENTLY IF EXISTS idx_orders_user_created;
@@ -0,0 +1,4 @@
+-- Массовый возврат при отмене события: выборка непогашенных билетов события пачками по id.
+-- Таблицу event_cancellations создаёт init_db() по models.py.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_tickets_event_status_id ON tickets (event_id, status, id);
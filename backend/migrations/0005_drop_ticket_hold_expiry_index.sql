@@ -0,0 +1,4 @@
+-- Sweeper (holds.py) блокирует брони раньше их билетов: просроченные брони выбираются
+-- по idx_ticket_holds_active_expiry, их билеты — по idx_tickets_hold.
+-- Частичный индекс билетов по hold_expires_at больше не нужен.
+DROP INDEX CONCURRENTLY IF EXISTS idx_tickets_held_expiry;
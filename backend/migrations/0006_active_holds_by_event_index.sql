@@ -0,0 +1,2 @@
+-- Отмена события (refunds.py) блокирует активные брони события раньше их билетов.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ticket_holds_active_event ON ticket_holds (event_id) WHERE status = 'active';
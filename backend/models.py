@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, TIMESTAMP, Text, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, TIMESTAMP, Text, JSON, Index, Boolean, text
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 
@@ -16,9 +16,9 @@ class User(Base):
     created_at = Column(TIMESTAMP(timezone=True), default=datetime.utcnow)
 
     def verify_password(self, password: str) -> bool:
-        # verify outside (passlib) or keep helper
-        from passlib.hash import argon2
-        return argon2.verify(password, self.password_hash)
+        # синхронная проверка; обработчики запросов используют passwords.verify_password (пул процессов)
+        from passwords import verify_password_sync
+        return verify_password_sync(password, self.password_hash)[0]
 
 class Genre(Base):
     __tablename__ = "genres"
@@ -34,6 +34,9 @@ class Venue(Base):
 
 class Seat(Base):
     __tablename__ = "seats"
+    __table_args__ = (
+        Index("idx_seats_venue_row_number", "venue_id", "row_label", "seat_number"),
+    )
     id = Column(Integer, primary_key=True)
     venue_id = Column(Integer, ForeignKey("venues.id"))
     row_label = Column(String)
@@ -43,6 +46,12 @@ class Seat(Base):
 
 class Event(Base):
     __tablename__ = "events"
+    __table_args__ = (
+        # keyset-пагинация каталога по (start_datetime, id), с фильтрами и без
+        Index("idx_events_start_id", "start_datetime", "id"),
+        Index("idx_events_genre_start_id", "genre_id", "start_datetime", "id"),
+        Index("idx_events_venue_start_id", "venue_id", "start_datetime", "id"),
+    )
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     description = Column(Text)
@@ -59,6 +68,9 @@ class Event(Base):
 
 class PriceTier(Base):
     __tablename__ = "price_tiers"
+    __table_args__ = (
+        Index("idx_price_tiers_event", "event_id"),
+    )
     id = Column(Integer, primary_key=True)
     event_id = Column(Integer, ForeignKey("events.id"))
     name = Column(String, nullable=False)
@@ -67,8 +79,26 @@ class PriceTier(Base):
 
     event = relationship("Event", back_populates="price_tiers")
 
+class TierInventory(Base):
+    __tablename__ = "tier_inventory"
+    # авторитетные счётчики билетов тарифа по состояниям (см. inventory.py)
+    tier_id = Column(Integer, ForeignKey("price_tiers.id", ondelete="CASCADE"), primary_key=True)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), index=True)
+    available = Column(Integer, nullable=False, default=0)
+    held = Column(Integer, nullable=False, default=0, server_default="0")
+    sold = Column(Integer, nullable=False, default=0, server_default="0")  # sold + activated
+    has_seats = Column(Boolean, nullable=False, default=False, server_default=text("false"))
+
 class Ticket(Base):
     __tablename__ = "tickets"
+    __table_args__ = (
+        Index("idx_tickets_event_tier_status", "event_id", "tier_id", "status"),
+        Index("idx_tickets_tier_status_id", "tier_id", "status", "id"),
+        # билеты брони: оплата, отмена и sweeper (holds.py)
+        Index("idx_tickets_hold", "hold_id"),
+        # массовый возврат при отмене события (refunds.py)
+        Index("idx_tickets_event_status_id", "event_id", "status", "id"),
+    )
     id = Column(Integer, primary_key=True)
     event_id = Column(Integer, ForeignKey("events.id"))
     seat_id = Column(Integer, ForeignKey("seats.id"), nullable=True)  # добавил
@@ -76,6 +106,7 @@ class Ticket(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     status = Column(String, nullable=False, default="available")  # available, held, sold, refunded, used
     hold_expires_at = Column(DateTime, nullable=True)  # добавил
+    hold_id = Column(Integer, ForeignKey("ticket_holds.id", ondelete="SET NULL"), nullable=True)
     price = Column(Numeric(10, 2))
     qr_code = Column(String)
     created_at = Column(TIMESTAMP(timezone=True), default=datetime.utcnow)
@@ -85,8 +116,42 @@ class Ticket(Base):
     tier = relationship("PriceTier")
     owner = relationship("User")
 
+class TicketHold(Base):
+    __tablename__ = "ticket_holds"
+    __table_args__ = (
+        # выборка просроченных броней для sweeper'а (holds.py)
+        Index("idx_ticket_holds_active_expiry", "expires_at",
+              postgresql_where=text("status = 'active'"), sqlite_where=text("status = 'active'")),
+        # активные брони отменяемого события (refunds.py)
+        Index("idx_ticket_holds_active_event", "event_id",
+              postgresql_where=text("status = 'active'"), sqlite_where=text("status = 'active'")),
+    )
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id"))
+    status = Column(String, nullable=False, default="active")  # active, converted, released, expired
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), default=datetime.utcnow)
+
+class EventCancellation(Base):
+    __tablename__ = "event_cancellations"
+    # прогресс отмены события и массового возврата (refunds.py)
+    event_id = Column(Integer, ForeignKey("events.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, nullable=False, default="running")  # running, done, failed
+    refunded_tickets = Column(Integer, nullable=False, default=0)
+    refunded_amount = Column(Numeric(12, 2), nullable=False, default=0)
+    canceled_tickets = Column(Integer, nullable=False, default=0)  # непроданные: свободные и забронированные
+    started_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # история заказов: keyset по (created_at, id)
+        Index("idx_orders_user_created_id", "user_id", "created_at", "id"),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     total_amount = Column(Numeric(10, 2), nullable=False)
@@ -98,6 +163,9 @@ class Order(Base):
 
 class OrderItem(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        Index("idx_order_items_order", "order_id"),
+    )
     id = Column(Integer, primary_key=True)
     order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"))
     ticket_id = Column(Integer, ForeignKey("tickets.id"))
@@ -0,0 +1,55 @@
+"""
+Keyset-пагинация: непрозрачный курсор вместо OFFSET.
+
+Курсор — base64 от JSON со значениями ключа сортировки последней строки
+страницы, например (start_datetime, id). Следующая страница берётся условием
+(start_datetime, id) > курсор по составному индексу, поэтому её цена
+не зависит от номера страницы.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+MAX_PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, *types) -> tuple:
+    """Значения курсора, приведённые к types (datetime, int, ...); битый курсор -> CursorError."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise CursorError("invalid cursor")
+        return tuple(datetime.fromisoformat(v) if t is datetime else t(v) for t, v in zip(types, values))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, TypeError, ValueError) as e:
+        raise CursorError("invalid cursor") from e
+
+
+def after(columns, values):
+    """Условие "строка идёт после курсора" для сортировки по columns по возрастанию."""
+    return tuple_(*columns) > tuple_(*values)
+
+
+def before(columns, values):
+    """То же для сортировки по убыванию (новые сначала)."""
+    return tuple_(*columns) < tuple_(*values)
+
+
+def page(rows, limit: int, key):
+    """Из limit + 1 выбранных строк -> (страница, курсор следующей страницы или None)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
@@ -0,0 +1,98 @@
+"""
+Хеширование паролей Argon2 вне потока обработки запроса.
+
+Argon2 — это 50–100 мс CPU на вызов. Хеширование и проверка уходят
+в ограниченный ProcessPoolExecutor (PASSWORD_HASH_WORKERS процессов,
+не больше PASSWORD_HASH_QUEUE задач одновременно), поэтому всплеск логинов
+не останавливает каталог на том же воркере. PASSWORD_HASH_WORKERS=0 —
+без процессов, в потоке (тесты, отладка).
+
+Параметры стоимости задаются через ARGON2_*; хеш со старыми параметрами
+пересчитывается при успешном входе (verify_password возвращает новый хеш).
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.hash import argon2
+
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", str(max(1, PASSWORD_HASH_WORKERS) * 8)))
+
+hasher = argon2.using(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+
+
+def hash_password_sync(password: str) -> str:
+    return hasher.hash(password)
+
+
+def verify_password_sync(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """(пароль верный, новый хеш если параметры Argon2 поменялись — иначе None)."""
+    try:
+        if not hasher.verify(password, password_hash):
+            return False, None
+    except (ValueError, TypeError):
+        # не argon2-хеш или битая строка
+        return False, None
+    if hasher.needs_update(password_hash):
+        return True, hasher.hash(password)
+    return True, None
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+_slots_loop = None
+
+
+def _get_executor(workers: int = PASSWORD_HASH_WORKERS) -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if workers <= 0:
+        return None
+    if _executor is None:
+        # spawn, а не fork: форкать процесс с потоками uvicorn/SQLAlchemy небезопасно
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def _run(fn, *args):
+    global _slots, _slots_loop
+    loop = asyncio.get_running_loop()
+    if _slots is None or _slots_loop is not loop:
+        _slots, _slots_loop = asyncio.Semaphore(PASSWORD_HASH_QUEUE), loop
+    async with _slots:
+        executor = _get_executor()
+        if executor is None:
+            return await asyncio.to_thread(fn, *args)
+        return await loop.run_in_executor(executor, fn, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run(hash_password_sync, password)
+
+
+async def verify_password(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return await _run(verify_password_sync, password, password_hash)
+
+
+def start():
+    """Поднимает процессы заранее, чтобы первый логин не ждал их запуска."""
+    executor = _get_executor()
+    if executor is not None:
+        executor.submit(hash_password_sync, "warmup")
+
+
+def shutdown():
+    global _executor, _slots
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    _slots = None
@@ -0,0 +1,122 @@
+"""
+Метрики пулов соединений SQLAlchemy для /internal/pool.
+
+Счётчики собираются через события пула (checkout, checkin, connect, invalidate),
+время ожидания свободного соединения — через TimedQueuePool, который замеряет
+QueuePool._do_get (у SQLAlchemy нет публичного события "начали ждать соединение").
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class PoolStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+
+    def observe_wait(self, seconds: float, timed_out: bool = False):
+        i = 0
+        while i < len(WAIT_BUCKETS) and seconds > WAIT_BUCKETS[i]:
+            i += 1
+        with self._lock:
+            self.wait_counts[i] += 1
+            self.wait_sum += seconds
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            cumulative, buckets = 0, {}
+            for bound, n in zip(WAIT_BUCKETS + (float("inf"),), self.wait_counts):
+                cumulative += n
+                buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            return {
+                "pool_class": type(pool).__name__ if pool is not None else None,
+                "size": _call(pool, "size"),
+                "checked_out": _call(pool, "checkedout"),
+                "checked_in": _call(pool, "checkedin"),
+                # QueuePool.overflow() отрицателен, пока пул не заполнен
+                "overflow": max(0, _call(pool, "overflow") or 0),
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds": {"buckets": buckets, "count": cumulative, "sum": round(self.wait_sum, 6)},
+            }
+
+
+def _call(pool, method):
+    fn = getattr(pool, method, None)
+    try:
+        return fn() if fn else None
+    except NotImplementedError:
+        return None
+
+
+REGISTRY: dict[str, PoolStats] = {}
+
+
+class _TimedGetMixin:
+    def _do_get(self):
+        stats = REGISTRY.get(self.logging_name)
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            if stats is not None:
+                stats.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        if stats is not None:
+            stats.observe_wait(time.perf_counter() - started)
+        return conn
+
+
+class TimedQueuePool(_TimedGetMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedGetMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument(engine, name: str) -> PoolStats:
+    """Подписывается на события пула engine (sync Engine или AsyncEngine.sync_engine)."""
+    stats = REGISTRY.setdefault(name, PoolStats(name))
+    stats.engine = engine
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_conn, record, proxy):
+        stats.checkouts += 1
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_conn, record):
+        stats.checkins += 1
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_conn, record):
+        stats.connects += 1
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_conn, record, exc):
+        stats.invalidations += 1
+
+    return stats
+
+
+def snapshot() -> dict:
+    return {name: stats.snapshot() for name, stats in REGISTRY.items()}
@@ -0,0 +1,205 @@
+"""
+Ограничение частоты /auth/login и /auth/register — до Argon2.
+
+Каждое правило — token bucket на ключ: ёмкость N, пополнение N токенов за S секунд
+(в env как "N/S", "0" — правило выключено). Ключи отдельные для IP клиента и для
+email, поэтому перебор паролей одного аккаунта с многих адресов упирается в
+лимит email, а перебор многих аккаунтов с одного адреса — в лимит IP:
+
+  RATE_LIMIT_LOGIN_IP        30/60
+  RATE_LIMIT_LOGIN_EMAIL     5/60
+  RATE_LIMIT_REGISTER_IP     10/60
+  RATE_LIMIT_REGISTER_EMAIL  3/60
+
+Запрос берёт по токену из всех своих корзин сразу или ни из одной: отказ по email
+не тратит лимит IP. Отказ — 429 с Retry-After; он проверяется раньше любых
+запросов к базе и хеширования, в памяти процесса (словарь и lock).
+
+IP — request.client.host; за прокси uvicorn нужно запускать с --proxy-headers
+и --forwarded-allow-ips, иначе все клиенты будут одним адресом прокси.
+
+Несколько воркеров: у каждого свои корзины (лимит фактически умножается на число
+воркеров). Если задан RATE_LIMIT_REDIS_URL (нужен пакет redis), корзины общие —
+в Redis, одним Lua-скриптом на запрос. Уже отказанные ключи помнятся локально до
+Retry-After, так что повторные попытки в Redis не ходят; при недоступном Redis
+работает локальный лимит.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+# не больше стольких ключей в памяти: при переполнении выбрасываются давно не тронутые корзины
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+log = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def parse_rule(text: str):
+    """"N/S" -> (ёмкость N, N/S токенов в секунду); "0" или "" -> None."""
+    if not text or text.strip() == "0":
+        return None
+    count, _, seconds = text.partition("/")
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+RULES = {
+    ("login", "ip"): parse_rule(os.getenv("RATE_LIMIT_LOGIN_IP", "30/60")),
+    ("login", "email"): parse_rule(os.getenv("RATE_LIMIT_LOGIN_EMAIL", "5/60")),
+    ("register", "ip"): parse_rule(os.getenv("RATE_LIMIT_REGISTER_IP", "10/60")),
+    ("register", "email"): parse_rule(os.getenv("RATE_LIMIT_REGISTER_EMAIL", "3/60")),
+}
+
+
+class Buckets:
+    """
+    Token bucket'ы в памяти процесса: key -> (токены, время обновления, ёмкость, скорость).
+    Порядок словаря — LRU: при переполнении уходят корзины, которых дольше всего не касались.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.max_keys = max_keys
+
+    def take(self, requests, now: float) -> float:
+        """requests — [(key, capacity, rate)]. 0 — токены взяты из всех корзин, иначе секунды до повтора."""
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, capacity, rate in requests:
+                tokens, updated, _, _ = self._buckets.get(key, (capacity, now, capacity, rate))
+                if key in self._buckets:
+                    # отказанный ключ тоже свежий: перебор не вытесняет свою же корзину
+                    self._buckets.move_to_end(key)
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                levels.append((key, tokens, capacity, rate))
+            if wait:
+                return wait
+            for key, tokens, capacity, rate in levels:
+                self._buckets[key] = (tokens - 1, now, capacity, rate)
+            self._prune()
+            return 0.0
+
+    def _prune(self):
+        # самые старые корзины обычно уже пополнились; даже при атаке с огромного числа ключей
+        # свежие (исчерпанные) корзины остаются, а память ограничена max_keys
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# Lua: те же корзины в Redis (HASH tokens/updated), все или ни одной, TTL — время полного пополнения.
+# Возвращает ожидание по каждому ключу ("0" — токен есть).
+_REDIS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local levels, waits = {}, {}
+local limited = false
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2])
+  local rate = tonumber(ARGV[i * 2 + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'updated')
+  local tokens = tonumber(state[1]) or capacity
+  local updated = tonumber(state[2]) or now
+  tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+  waits[i] = '0'
+  if tokens < 1 then
+    waits[i] = tostring((1 - tokens) / rate)
+    limited = true
+  end
+  levels[i] = tokens
+end
+if limited then return waits end
+for i, key in ipairs(KEYS) do
+  local capacity = tonumber(ARGV[i * 2])
+  local rate = tonumber(ARGV[i * 2 + 1])
+  redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'updated', tostring(now))
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return waits
+"""
+
+
+class Limiter:
+    def __init__(self, rules: dict = None, redis_url: str = RATE_LIMIT_REDIS_URL):
+        self.rules = RULES if rules is None else rules
+        self.local = Buckets()
+        self._blocked = {}  # key -> monotonic время, до которого отказываем без Redis
+        self._redis = None
+        self._script = None
+        if redis_url:
+            import redis.asyncio  # необязательная зависимость: только при RATE_LIMIT_REDIS_URL
+
+            self._redis = redis.asyncio.from_url(redis_url)
+            self._script = self._redis.register_script(_REDIS_SCRIPT)
+
+    def _requests(self, action: str, keys: dict):
+        requests = []
+        for kind, value in keys.items():
+            rule = self.rules.get((action, kind))
+            if rule is not None and value:
+                requests.append(((action, kind, value), *rule))
+        return requests
+
+    async def check(self, action: str, **keys):
+        """Берёт токены action из корзин keys (ip=..., email=...) или бросает RateLimited."""
+        requests = self._requests(action, keys)
+        if not requests:
+            return
+        now = time.monotonic()
+        if self._redis is None:
+            wait = self.local.take(requests, now)
+        else:
+            blocked = max((self._blocked.get(r[0], 0.0) for r in requests), default=0.0)
+            if blocked > now:
+                raise RateLimited(blocked - now)
+            waits = await self._take_shared(requests)
+            if waits is None:
+                wait = self.local.take(requests, now)
+            else:
+                for r, key_wait in zip(requests, waits):
+                    if key_wait:
+                        self._blocked[r[0]] = now + key_wait
+                if len(self._blocked) > RATE_LIMIT_MAX_KEYS:
+                    self._blocked = {k: t for k, t in self._blocked.items() if t > now}
+                wait = max(waits)
+        if wait:
+            raise RateLimited(wait)
+
+    async def _take_shared(self, requests):
+        """Ожидание по каждой корзине (0 — токен взят); None — Redis недоступен."""
+        args = [time.time()]
+        for _, capacity, rate in requests:
+            args += [capacity, rate]
+        try:
+            waits = await self._script(keys=["ratelimit:" + ":".join(map(str, r[0])) for r in requests], args=args)
+            return [float(w) for w in waits]
+        except Exception:
+            log.warning("shared rate limit unavailable, using local buckets", exc_info=True)
+            return None
+
+    def clear(self):
+        self.local.clear()
+        self._blocked.clear()
+
+
+def retry_after_header(e: RateLimited) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+
+
+limiter = Limiter()
@@ -0,0 +1,248 @@
+"""
+Отмена события и массовый возврат денег за все проданные билеты.
+
+Работа идёт пачками по REFUND_CHUNK билетов, каждая пачка — отдельная короткая
+транзакция из нескольких set-based запросов:
+  - билеты пачки (available, held, sold, activated) блокируются одним SELECT по (event_id, status, id);
+  - все они одним UPDATE переходят в 'canceled' — непроданные тоже, чтобы событие
+    перестало продаваться;
+  - счётчики tier_inventory уменьшаются по затронутым тарифам;
+  - деньги суммируются по пользователям: один UPDATE кошельков (CASE по id)
+    и один INSERT в wallet_transactions на пачку;
+  - заказы, в которых не осталось оплаченных билетов, помечаются 'refunded'.
+Порядок блокировок — как у create_order, refund_order и броней (holds.py): активные брони
+события, билеты, счётчики, пользователи; иначе пачка могла бы встать в дедлок с покупкой
+того же тарифа или с оплатой брони.
+
+Деньги возвращаются за все оплаченные билеты, в том числе активированные:
+событие не состоялось, активация (вход) ничего не меняет.
+
+Прогресс хранится в event_cancellations. Обработанные билеты уже 'canceled' и в
+следующую пачку не попадают, поэтому прерванную отмену можно просто запустить
+снова — ничего не вернётся дважды. Упавшая пачка повторяется до REFUND_RETRIES раз
+с паузой, затем задание получает статус 'failed'; его продолжает повторный
+POST /admin/events/{id}/cancel или следующий старт приложения (resume()).
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import case, exists, func, insert, select, update
+from sqlalchemy.orm import Session, aliased
+
+import models, inventory, seatfeed, auth
+
+REFUND_CHUNK = int(os.getenv("REFUND_CHUNK", "1000"))
+REFUND_RETRIES = int(os.getenv("REFUND_RETRIES", "3"))
+REFUND_RETRY_DELAY = float(os.getenv("REFUND_RETRY_DELAY", "1"))
+PAID_STATUSES = inventory.SOLD_STATUSES
+PENDING_STATUSES = ("available", "held") + PAID_STATUSES
+
+log = logging.getLogger(__name__)
+
+
+def start(db: Session, event_id: int):
+    """Создаёт (или возвращает уже начатую) отмену события. None — события нет."""
+    job = db.get(models.EventCancellation, event_id)
+    if job is None:
+        if db.get(models.Event, event_id) is None:
+            return None
+        job = models.EventCancellation(event_id=event_id, status="running")
+        db.add(job)
+    elif job.status in ("done", "failed"):
+        # после завершения могли появиться новые билеты (изменение тарифов) — добираем их;
+        # упавшее задание продолжается с последней пачки
+        job.status, job.finished_at = "running", None
+    db.commit()
+    return job
+
+
+def process_chunk(db: Session, event_id: int, chunk: int = REFUND_CHUNK) -> int:
+    """Отменяет одну пачку билетов события; возвращает их число (0 — всё сделано)."""
+    # строка задания сериализует воркеры, обрабатывающие одно событие
+    job = db.query(models.EventCancellation).with_for_update().filter(
+        models.EventCancellation.event_id == event_id
+    ).first()
+    if job is None or job.status != "running":
+        db.rollback()
+        return 0
+
+    # брони события — до их билетов, как в holds.py: идущая оплата или отмена брони
+    # дойдёт до конца, а не встанет в дедлок с пачкой
+    db.execute(
+        select(models.TicketHold.id)
+        .where(models.TicketHold.event_id == event_id, models.TicketHold.status == "active")
+        .order_by(models.TicketHold.id)
+        .with_for_update()
+    ).all()
+    tickets = db.execute(
+        select(models.Ticket.id, models.Ticket.event_id, models.Ticket.tier_id, models.Ticket.user_id,
+               models.Ticket.status, models.Ticket.hold_id, models.Ticket.price)
+        .where(models.Ticket.event_id == event_id, models.Ticket.status.in_(PENDING_STATUSES))
+        .order_by(models.Ticket.id)
+        .limit(chunk)
+        .with_for_update()
+    ).all()
+    if not tickets:
+        job.status, job.finished_at = "done", datetime.utcnow()
+        db.commit()
+        return 0
+
+    sold = [t for t in tickets if t.status in PAID_STATUSES]
+    # цена возврата — как в POST /orders/{id}/refund: из позиции заказа
+    paid = dict(db.execute(
+        select(models.OrderItem.ticket_id, models.OrderItem.price)
+        .where(models.OrderItem.ticket_id.in_([t.id for t in sold]))
+    ).all()) if sold else {}
+
+    db.execute(
+        update(models.Ticket)
+        .where(models.Ticket.id.in_([t.id for t in tickets]))
+        .values(status="canceled", hold_id=None, hold_expires_at=None)
+        .execution_options(synchronize_session=False)
+    )
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    for t in tickets:
+        if t.tier_id is not None:
+            deltas[t.tier_id]["sold" if t.status in PAID_STATUSES else t.status] += 1
+    inventory.cancel(db, deltas)
+
+    credits = defaultdict(Decimal)
+    for t in sold:
+        if t.user_id is not None:
+            credits[t.user_id] += Decimal(str(paid.get(t.id, t.price) or 0))
+    if credits:
+        db.execute(
+            update(models.User)
+            .where(models.User.id.in_(list(credits)))
+            .values(wallet_balance=models.User.wallet_balance + case(credits, value=models.User.id))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(insert(models.WalletTransaction), [
+            {"user_id": user_id, "amount": amount, "reason": "event_canceled"} for user_id, amount in sorted(credits.items())
+        ])
+
+    if sold:
+        sold_item = aliased(models.OrderItem)
+        order_ids = select(models.OrderItem.order_id).where(models.OrderItem.ticket_id.in_([t.id for t in sold]))
+        still_sold = exists().where(
+            sold_item.order_id == models.Order.id,
+            sold_item.ticket_id == models.Ticket.id,
+            models.Ticket.status.in_(PAID_STATUSES),
+        )
+        db.execute(
+            update(models.Order)
+            .where(models.Order.id.in_(order_ids), ~still_sold)
+            .values(status="refunded")
+            .execution_options(synchronize_session=False)
+        )
+
+    hold_ids = {t.hold_id for t in tickets if t.status == "held" and t.hold_id}
+    if hold_ids:
+        db.execute(
+            update(models.TicketHold)
+            .where(models.TicketHold.id.in_(hold_ids), models.TicketHold.status == "active")
+            .values(status="released")
+            .execution_options(synchronize_session=False)
+        )
+
+    seatfeed.notify(db, tickets, "canceled")
+    job.refunded_tickets += len(sold)
+    job.refunded_amount = Decimal(str(job.refunded_amount or 0)) + sum(credits.values(), Decimal("0"))
+    job.canceled_tickets += len(tickets) - len(sold)
+    job.updated_at = datetime.utcnow()
+    db.commit()
+    for user_id in credits:
+        auth.principal_cache.invalidate(user_id)
+    return len(tickets)
+
+
+def remaining(db: Session, event_id: int) -> dict:
+    """Сколько билетов события ещё ждёт отмены, по статусам."""
+    rows = db.execute(
+        select(models.Ticket.status, func.count(models.Ticket.id))
+        .where(models.Ticket.event_id == event_id, models.Ticket.status.in_(PENDING_STATUSES))
+        .group_by(models.Ticket.status)
+    ).all()
+    return {status: n for status, n in rows}
+
+
+def progress(db: Session, event_id: int):
+    job = db.get(models.EventCancellation, event_id)
+    if job is None:
+        return None
+    return {
+        "event_id": event_id,
+        "status": job.status,
+        "refunded_tickets": job.refunded_tickets,
+        "refunded_amount": float(job.refunded_amount or 0),
+        "canceled_tickets": job.canceled_tickets,
+        "remaining": remaining(db, event_id),
+        "started_at": job.started_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _fail(db: Session, event_id: int):
+    try:
+        db.rollback()
+        db.execute(
+            update(models.EventCancellation)
+            .where(models.EventCancellation.event_id == event_id, models.EventCancellation.status == "running")
+            .values(status="failed", updated_at=datetime.utcnow())
+        )
+        db.commit()
+    except Exception:
+        log.exception("could not mark event cancellation failed", extra={"event_id": event_id})
+        db.rollback()
+
+
+def run(session_factory, event_id: int, chunk: int = REFUND_CHUNK, retries: int = REFUND_RETRIES) -> int:
+    """
+    Обрабатывает пачки до конца; каждая в своей транзакции. Упавшая пачка откатывается
+    и повторяется (до retries раз подряд), затем задание — 'failed'.
+    Возвращает число отменённых билетов.
+    """
+    done, failures = 0, 0
+    db = session_factory()
+    try:
+        while True:
+            try:
+                n = process_chunk(db, event_id, chunk)
+            except Exception:
+                db.rollback()
+                failures += 1
+                if failures > retries:
+                    log.exception("event cancellation failed", extra={"event_id": event_id, "tickets": done})
+                    _fail(db, event_id)
+                    return done
+                log.warning("event cancellation chunk failed, retrying", exc_info=True,
+                            extra={"event_id": event_id, "attempt": failures})
+                time.sleep(REFUND_RETRY_DELAY * failures)
+                continue
+            failures = 0
+            done += n
+            if n == 0:
+                return done
+    finally:
+        db.close()
+
+
+def resume(session_factory):
+    """Доводит до конца отмены, прерванные остановкой приложения или упавшие."""
+    db = session_factory()
+    try:
+        event_ids = db.execute(
+            select(models.EventCancellation.event_id).where(models.EventCancellation.status.in_(("running", "failed")))
+        ).scalars().all()
+        for event_id in event_ids:
+            start(db, event_id)
+    finally:
+        db.close()
+    for event_id in event_ids:
+        run(session_factory, event_id)
@@ -0,0 +1,201 @@
+"""
+Чтение с реплик: каталог и история заказов идут на реплики, записи — на primary.
+
+  DATABASE_REPLICA_URLS      — реплики через запятую (пусто — всё на primary);
+  REPLICA_HEALTH_INTERVAL    — период проверки реплик, секунд (5);
+  REPLICA_MAX_LAG            — отставание, секунд, после которого реплика считается
+                               нездоровой (10; только PostgreSQL);
+  REPLICA_STICKY_SECONDS     — сколько после записи клиент читает с primary (5).
+
+Обработчики чтения берут сессию через get_read_db / get_async_read_db: следующая
+здоровая реплика по кругу, а если здоровых нет — primary. Всё, что пишет (заказы,
+возвраты, активация билета, /admin/*), остаётся на get_db.
+
+Read-your-writes: после успешного POST/PUT/PATCH/DELETE клиент REPLICA_STICKY_SECONDS
+читает с primary — иначе только что купленный заказ мог бы не найтись в /orders/me,
+пока реплика догоняет. Признаков два: пользователь из токена (в памяти воркера) и
+cookie db_primary_until (её видит любой воркер за балансировщиком).
+
+Проверка здоровья — фоновая задача: SELECT 1 и отставание по replay timestamp;
+упавшая или отставшая реплика выводится из ротации до следующей успешной проверки.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi import Depends, Request
+
+import auth, pool_metrics
+from database import engine_options, get_async_db, get_db, to_async_url
+
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+STICKY_COOKIE = "db_primary_until"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+log = logging.getLogger(__name__)
+
+# отставание реплики; 0 — это primary или реплика применила всё полученное
+LAG_SQL = text("""
+    SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+""")
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = create_engine(url, future=True, **engine_options(url, name=name))
+        async_url = to_async_url(url)
+        self.async_engine = create_async_engine(async_url, **engine_options(async_url, is_async=True, name=f"{name}_async"))
+        self.Session = sessionmaker(bind=self.engine, autoflush=False, autocommit=False)
+        self.AsyncSession = async_sessionmaker(bind=self.async_engine, autoflush=False, expire_on_commit=False)
+        pool_metrics.instrument(self.engine, name)
+        pool_metrics.instrument(self.async_engine.sync_engine, f"{name}_async")
+        self.healthy = True
+        self.lag = 0.0
+
+    def check(self, max_lag: float = None) -> bool:
+        max_lag = REPLICA_MAX_LAG if max_lag is None else max_lag
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = float(conn.execute(LAG_SQL).scalar() or 0)
+                else:
+                    conn.execute(text("SELECT 1"))
+                    self.lag = 0.0
+            healthy = self.lag <= max_lag
+        except Exception:
+            log.warning("replica %s health check failed", self.name, exc_info=True)
+            healthy = False
+        if healthy != self.healthy:
+            log.warning("replica %s is %s (lag %.1fs)", self.name, "back in rotation" if healthy else "out of rotation", self.lag)
+        self.healthy = healthy
+        return healthy
+
+
+class ReplicaSet:
+    def __init__(self, urls=()):
+        self.replicas = [Replica(f"replica{i + 1}", url) for i, url in enumerate(urls)]
+        self._rr = itertools.count()
+        self._sticky = {}   # user_id -> time.time(), до которого читаем с primary
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """Следующая здоровая реплика по кругу; None — читать с primary."""
+        n = len(self.replicas)
+        for _ in range(n):
+            replica = self.replicas[next(self._rr) % n]
+            if replica.healthy:
+                return replica
+        return None
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def stick(self, user_id: int, until: float):
+        with self._lock:
+            self._sticky[user_id] = until
+            if len(self._sticky) > 100_000:
+                now = time.time()
+                self._sticky = {uid: t for uid, t in self._sticky.items() if t > now}
+
+    def sticky(self, request: Request) -> bool:
+        """Клиент недавно писал — читает с primary."""
+        now = time.time()
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+                return True
+        except ValueError:
+            pass
+        if not self._sticky:
+            return False
+        user_id = _user_id(request.headers.get("authorization"))
+        return user_id is not None and self._sticky.get(user_id, 0) > now
+
+    def status(self) -> list:
+        return [{"name": r.name, "healthy": r.healthy, "lag": r.lag} for r in self.replicas]
+
+    async def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+            await replica.async_engine.dispose()
+
+
+def _user_id(authorization):
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    return auth.decode_user_id(authorization[7:])
+
+
+replica_set = ReplicaSet(DATABASE_REPLICA_URLS)
+
+
+def _route(request: Request):
+    if not replica_set.replicas or replica_set.sticky(request):
+        return None
+    return replica_set.pick()
+
+
+def get_read_db(request: Request, primary=Depends(get_db)):
+    """Сессия для обработчиков только на чтение: реплика или primary (см. модуль)."""
+    replica = _route(request)
+    if replica is None:
+        yield primary
+        return
+    db = replica.Session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request, primary=Depends(get_async_db)):
+    replica = _route(request)
+    if replica is None:
+        yield primary
+        return
+    async with replica.AsyncSession() as db:
+        yield db
+
+
+async def run_health_checks(interval: float = REPLICA_HEALTH_INTERVAL):
+    if not replica_set.replicas or interval <= 0:
+        return
+    while True:
+        await asyncio.to_thread(replica_set.check)
+        await asyncio.sleep(interval)
+
+
+class ReadAfterWriteMiddleware:
+    """После успешной записи клиент REPLICA_STICKY_SECONDS читает с primary (пользователь + cookie)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS or not replica_set.replicas:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = time.time() + REPLICA_STICKY_SECONDS
+                headers = dict(scope["headers"])
+                user_id = _user_id(headers.get(b"authorization", b"").decode("latin-1"))
+                if user_id is not None:
+                    replica_set.stick(user_id, until)
+                cookie = (f"{STICKY_COOKIE}={until:.3f}; Max-Age={int(REPLICA_STICKY_SECONDS) + 1}; "
+                          f"Path=/; HttpOnly; SameSite=Lax")
+                message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode("latin-1"))]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,230 @@
+"""
+Кэш HTTP-ответов каталога (ASGI middleware).
+
+Каталог (/events, /genres, /venues ...) меняется только через /admin/*,
+поэтому GET-ответы этих маршрутов хранятся в памяти воркера:
+  - у каждого маршрута свой TTL (CACHE_ROUTES);
+  - сильный ETag (sha256 тела) и ответ 304 на совпавший If-None-Match;
+  - stale-while-revalidate: устаревшая запись ещё RESPONSE_CACHE_SWR секунд
+    отдаётся сразу, а обновление идёт в фоне;
+  - stale-if-error: если база не ответила, отдаём устаревшую запись
+    (не старше RESPONSE_CACHE_STALE_IF_ERROR секунд) вместо 500.
+Админские изменения сбрасывают ключи явно: invalidate("/events", ...).
+Кэш у каждого воркера свой: на других воркерах запись живёт не дольше TTL.
+
+Ключ — путь и только те параметры запроса, которые маршрут принимает
+(?x=<случайное> не плодит записи). Записей не больше RESPONSE_CACHE_MAX_ENTRIES:
+сверх лимита вытесняются давно не читанные (LRU), записи старше
+TTL + stale-окон удаляются при обращении.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlencode
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+RESPONSE_CACHE_SWR = float(os.getenv("RESPONSE_CACHE_SWR", "30"))
+RESPONSE_CACHE_STALE_IF_ERROR = float(os.getenv("RESPONSE_CACHE_STALE_IF_ERROR", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+# (шаблон пути, TTL в секундах, параметры запроса, которые входят в ключ)
+CACHE_ROUTES = [
+    (re.compile(r"^/events$"), 15.0, ("limit", "venue_id", "genre_id", "date_from", "date_to", "cursor")),
+    (re.compile(r"^/events/top$"), 30.0, ("limit",)),
+    (re.compile(r"^/genres$"), 300.0, ()),
+    (re.compile(r"^/venues$"), 60.0, ()),
+    (re.compile(r"^/venues/\d+$"), 60.0, ()),
+    (re.compile(r"^/venues/\d+/seats$"), 300.0, ()),
+    (re.compile(r"^/events/\d+/tiers/\d+/layout$"), 300.0, ()),
+]
+
+log = logging.getLogger(__name__)
+
+STORED_HEADERS = {b"content-type", b"content-encoding", b"x-next-cursor"}
+
+
+@dataclass
+class CacheEntry:
+    status: int
+    headers: list
+    body: bytes
+    etag: str
+    stored_at: float
+    ttl: float
+    generation: int = 0
+
+    def age(self, now: float) -> float:
+        return now - self.stored_at
+
+    def usable(self, now: float) -> bool:
+        return self.age(now) < self.ttl + max(RESPONSE_CACHE_SWR, RESPONSE_CACHE_STALE_IF_ERROR)
+
+
+class ResponseCache:
+    """LRU по ключам запросов, как auth.TTLCache, но с TTL на запись и инвалидацией по префиксу."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        # растёт при каждой инвалидации: фоновое обновление, начатое до неё, не запишет старые данные
+        self.generation = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not entry.usable(time.monotonic()):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry, generation: int):
+        with self._lock:
+            if generation == self.generation:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, *prefixes: str):
+        with self._lock:
+            self.generation += 1
+            for key in [k for k in self._entries if k.startswith(prefixes)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+cache = ResponseCache()
+
+
+def invalidate(*prefixes: str):
+    cache.invalidate(*prefixes)
+
+
+def route(path: str):
+    """(TTL, параметры ключа) маршрута или None — маршрут не кэшируется."""
+    for pattern, ttl, params in CACHE_ROUTES:
+        if pattern.match(path):
+            return ttl, params
+    return None
+
+
+def cache_key(path: str, query_string: bytes, params) -> str:
+    query = [(k, v) for k, v in parse_qsl(query_string.decode("latin-1"), keep_blank_values=True) if k in params]
+    return path + "?" + urlencode(sorted(query))
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class ResponseCacheMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._refreshing: set[str] = set()
+        # ссылки на фоновые обновления: иначе незавершённую задачу может собрать GC
+        self._tasks: set[asyncio.Task] = set()
+
+    async def __call__(self, scope, receive, send):
+        if not RESPONSE_CACHE_ENABLED or scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+        cached_route = route(scope["path"])
+        if cached_route is None:
+            return await self.app(scope, receive, send)
+
+        ttl, params = cached_route
+        key = cache_key(scope["path"], scope.get("query_string", b""), params)
+        if_none_match = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"if-none-match"), None)
+        now = time.monotonic()
+        entry = cache.get(key)
+
+        if entry is not None and entry.age(now) < entry.ttl:
+            return await self._send_entry(entry, now, if_none_match, send)
+        if entry is not None and entry.age(now) < entry.ttl + RESPONSE_CACHE_SWR:
+            if key not in self._refreshing:
+                self._refreshing.add(key)
+                task = asyncio.create_task(self._refresh(scope, key, ttl))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return await self._send_entry(entry, now, if_none_match, send)
+
+        try:
+            fresh = await self._fetch(scope, ttl)
+        except Exception:
+            fresh = None
+            if entry is None or entry.age(now) >= entry.ttl + RESPONSE_CACHE_STALE_IF_ERROR:
+                raise
+        if fresh is None or fresh.status >= 500:
+            if entry is not None and entry.age(now) < entry.ttl + RESPONSE_CACHE_STALE_IF_ERROR:
+                return await self._send_entry(entry, now, if_none_match, send)
+        if fresh.status == 200:
+            cache.set(key, fresh, fresh.generation)
+        return await self._send_entry(fresh, now, if_none_match, send, stored=fresh.status == 200)
+
+    async def _fetch(self, scope, ttl: float):
+        generation = cache.generation
+        status, headers, chunks = 500, [], []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def capture(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [(k, v) for k, v in message.get("headers", []) if k.lower() in STORED_HEADERS]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(dict(scope), receive, capture)
+        body = b"".join(chunks)
+        return CacheEntry(status, headers, body, make_etag(body), time.monotonic(), ttl, generation)
+
+    async def _refresh(self, scope, key: str, ttl: float):
+        try:
+            fresh = await self._fetch(scope, ttl)
+            if fresh.status == 200:
+                cache.set(key, fresh, fresh.generation)
+        except Exception:
+            # база недоступна — продолжаем отдавать устаревшую запись
+            log.warning("cache refresh failed for %s", key, exc_info=True)
+        finally:
+            self._refreshing.discard(key)
+
+    async def _send_entry(self, entry: CacheEntry, now: float, if_none_match, send, stored: bool = True):
+        headers = list(entry.headers)
+        if stored:
+            remaining = max(0, int(entry.ttl - entry.age(now)))
+            headers += [
+                (b"etag", entry.etag.encode()),
+                (b"cache-control", f"public, max-age={remaining}, stale-while-revalidate={int(RESPONSE_CACHE_SWR)}".encode()),
+                (b"age", str(max(0, int(entry.age(now)))).encode()),
+            ]
+        if stored and if_none_match and _etag_matches(if_none_match, entry.etag):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        headers.append((b"content-length", str(len(entry.body)).encode()))
+        await send({"type": "http.response.start", "status": entry.status, "headers": headers})
+        await send({"type": "http.response.body", "body": entry.body})
@@ -69,6 +69,9 @@ class OrderItemCreate(BaseModel):
 class OrderCreate(BaseModel):
     items: List[OrderItemCreate]
 
+class HoldCreate(BaseModel):
+    items: List[OrderItemCreate]
+
 class PriceTierCreate(BaseModel):
     name: str
     price: float
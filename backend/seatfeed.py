@@ -0,0 +1,164 @@
+"""
+Push изменений статусов мест: GET /events/{id}/seats/stream (Server-Sent Events).
+
+Переходы статусов билетов (покупка, бронь, снятие брони, возврат) регистрируются
+в сессии через notify(db, tickets, status) и публикуются только после commit:
+  - PostgreSQL: pg_notify в той же транзакции, каждый воркер слушает канал
+    (LISTEN) и раздаёт изменения своим подписчикам — так доходят изменения
+    с любого воркера;
+  - SQLite/без Postgres: сразу локальным подписчикам после commit.
+
+Сообщение: {"event_id": ..., "changes": [[ticket_id, code], ...]}, code — как в
+seatmap (0 свободно, 1 забронировано, 2 продано/недоступно).
+
+У каждого подписчика своя очередь на SEATFEED_QUEUE сообщений. Медленный клиент
+не тормозит остальных: при переполнении его очередь сбрасывается и он получает
+event: resync — перечитать /availability целиком.
+"""
+import asyncio
+import json
+import logging
+import os
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from seatmap import STATUS_CODES, TAKEN
+
+SEATFEED_CHANNEL = os.getenv("SEATFEED_CHANNEL", "seat_status")
+SEATFEED_QUEUE = int(os.getenv("SEATFEED_QUEUE", "100"))
+SEATFEED_KEEPALIVE = float(os.getenv("SEATFEED_KEEPALIVE", "15"))
+SEATFEED_RECONNECT = float(os.getenv("SEATFEED_RECONNECT", "5"))
+
+# лимит payload у NOTIFY — 8000 байт
+NOTIFY_CHUNK = 400
+
+RESYNC = {"resync": True}
+
+log = logging.getLogger(__name__)
+
+_subscribers: dict[int, set] = {}
+_loop = None
+
+
+def start():
+    """Запоминает event loop приложения: публикации приходят и из потоков (sync-обработчики, sweeper)."""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+
+def subscribe(event_id: int) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=SEATFEED_QUEUE)
+    _subscribers.setdefault(event_id, set()).add(queue)
+    return queue
+
+
+def unsubscribe(event_id: int, queue: asyncio.Queue):
+    queues = _subscribers.get(event_id)
+    if queues is not None:
+        queues.discard(queue)
+        if not queues:
+            del _subscribers[event_id]
+
+
+def _dispatch(message: dict):
+    # только в потоке event loop
+    for queue in list(_subscribers.get(message["event_id"], ())):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+
+def publish_local(message: dict):
+    if _loop is None or _loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        _dispatch(message)
+    else:
+        _loop.call_soon_threadsafe(_dispatch, message)
+
+
+def notify(db: Session, tickets, status: str):
+    """Запомнить переход билетов (объекты/строки с .id и .event_id) в status до commit сессии."""
+    code = STATUS_CODES.get(status, TAKEN)
+    pending = db.info.setdefault("seatfeed", {})
+    for t in tickets:
+        pending.setdefault(t.event_id, {})[t.id] = code
+
+
+def _messages(pending: dict):
+    for event_id, changes in pending.items():
+        items = sorted(changes.items())
+        for i in range(0, len(items), NOTIFY_CHUNK):
+            yield {"event_id": event_id, "changes": [list(c) for c in items[i:i + NOTIFY_CHUNK]]}
+
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session):
+    pending = session.info.get("seatfeed")
+    if not pending or session.get_bind().dialect.name != "postgresql":
+        return
+    for message in _messages(pending):
+        session.execute(select(func.pg_notify(SEATFEED_CHANNEL, json.dumps(message, separators=(",", ":")))))
+    # доставит LISTEN, локально публиковать не нужно
+    session.info.pop("seatfeed", None)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    pending = session.info.pop("seatfeed", None)
+    if pending:
+        for message in _messages(pending):
+            publish_local(message)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("seatfeed", None)
+
+
+async def listen(engine):
+    """LISTEN канала на отдельном соединении (asyncpg), с переподключением."""
+    def on_notify(connection, pid, channel, payload):
+        _dispatch(json.loads(payload))
+
+    while True:
+        try:
+            async with engine.connect() as conn:
+                driver = (await conn.get_raw_connection()).driver_connection
+                await driver.add_listener(SEATFEED_CHANNEL, on_notify)
+                while True:
+                    await asyncio.sleep(SEATFEED_KEEPALIVE)
+                    # мёртвое соединение иначе молча перестанет получать уведомления
+                    await driver.execute("SELECT 1")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("seatfeed listener failed, reconnecting")
+            await asyncio.sleep(SEATFEED_RECONNECT)
+
+
+async def stream(event_id: int, is_disconnected):
+    """Тело SSE-ответа: изменения мест события, keepalive-комментарии, resync при переполнении."""
+    queue = subscribe(event_id)
+    try:
+        yield f"retry: {int(SEATFEED_RECONNECT * 1000)}\n\n"
+        while not await is_disconnected():
+            try:
+                message = await asyncio.wait_for(queue.get(), SEATFEED_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if message is RESYNC:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                yield f"data: {json.dumps(message['changes'], separators=(',', ':'))}\n\n"
+    finally:
+        unsubscribe(event_id, queue)
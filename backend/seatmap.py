@@ -0,0 +1,163 @@
+"""
+Компактная схема мест тарифа для SeatMap.
+
+Вместо списка словарей на каждый опрос:
+  - layout — статичная часть: билеты тарифа в порядке (ряд, место).
+    Позиция билета в списке — его порядковый номер (ordinal).
+    Меняется только при правке тарифов, кэшируется.
+  - availability — по 2 бита на место в порядке ordinal (0 свободно, 1 забронировано,
+    2 продано/недоступно), base64. Для 20k мест это ~7 КБ вместо мегабайтов JSON.
+    version — хеш содержимого: одинаков на всех воркерах, поэтому клиент может
+    прислать since=<version> и получить только изменившиеся места.
+
+Снимок доступности держится SEATMAP_SNAPSHOT_TTL секунд, так что частые опросы
+одного тарифа превращаются в один лёгкий запрос (без join и сортировки) в секунду.
+"""
+import base64
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from auth import TTLCache
+
+SEATMAP_LAYOUT_TTL = float(os.getenv("SEATMAP_LAYOUT_TTL", "300"))
+SEATMAP_SNAPSHOT_TTL = float(os.getenv("SEATMAP_SNAPSHOT_TTL", "1"))
+SEATMAP_HISTORY = int(os.getenv("SEATMAP_HISTORY", "32"))
+
+AVAILABLE, HELD, TAKEN = 0, 1, 2
+STATUS_CODES = {"available": AVAILABLE, "held": HELD}
+
+
+@dataclass(frozen=True)
+class Layout:
+    version: str
+    seats: list  # [[ticket_id, row_label, seat_number], ...] по ordinal
+    ordinal: dict  # ticket_id -> ordinal
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: str
+    layout_version: str
+    count: int
+    bits: bytes
+
+
+_layouts = TTLCache(maxsize=1000, ttl=SEATMAP_LAYOUT_TTL)
+_snapshots = TTLCache(maxsize=1000, ttl=SEATMAP_SNAPSHOT_TTL)
+# недавние снимки тарифа: version -> bits, для ответов since=
+_history: "OrderedDict[tuple, OrderedDict]" = OrderedDict()
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def pack(codes) -> bytes:
+    """2 бита на место, 4 места в байте, ordinal 0 — младшие биты первого байта."""
+    out = bytearray((len(codes) + 3) // 4)
+    for i, code in enumerate(codes):
+        out[i >> 2] |= code << ((i & 3) * 2)
+    return bytes(out)
+
+
+def unpack(bits: bytes, count: int):
+    return [(bits[i >> 2] >> ((i & 3) * 2)) & 3 for i in range(count)]
+
+
+def diff(old: bytes, new: bytes, count: int):
+    """[[ordinal, code], ...] мест, у которых код изменился."""
+    changes = []
+    for byte_index, (a, b) in enumerate(zip(old, new)):
+        if a == b:
+            continue
+        for shift in range(4):
+            i = byte_index * 4 + shift
+            code = (b >> (shift * 2)) & 3
+            if i < count and code != (a >> (shift * 2)) & 3:
+                changes.append([i, code])
+    return changes
+
+
+async def get_layout(db: AsyncSession, event_id: int, tier_id: int, refresh: bool = False) -> Layout:
+    key = (event_id, tier_id)
+    layout = None if refresh else _layouts.get(key)
+    if layout is not None:
+        return layout
+    rows = (await db.execute(
+        select(models.Ticket.id, models.Seat.row_label, models.Seat.seat_number)
+        .join(models.Seat, models.Seat.id == models.Ticket.seat_id)
+        .where(models.Ticket.event_id == event_id, models.Ticket.tier_id == tier_id)
+        .order_by(models.Seat.row_label, models.Seat.seat_number)
+    )).all()
+    seats = [[r.id, r.row_label, r.seat_number] for r in rows]
+    version = _digest(",".join(str(s[0]) for s in seats).encode())
+    layout = Layout(version, seats, {s[0]: i for i, s in enumerate(seats)})
+    _layouts.put(key, layout)
+    return layout
+
+
+async def get_snapshot(db: AsyncSession, event_id: int, tier_id: int) -> Snapshot:
+    key = (event_id, tier_id)
+    snapshot = _snapshots.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    layout = await get_layout(db, event_id, tier_id)
+    rows = (await db.execute(
+        select(models.Ticket.id, models.Ticket.status)
+        .where(models.Ticket.event_id == event_id, models.Ticket.tier_id == tier_id,
+               models.Ticket.seat_id.isnot(None))
+    )).all()
+    if len(rows) != len(layout.seats) or any(r.id not in layout.ordinal for r in rows):
+        # тариф пересобран админом — схема устарела
+        layout = await get_layout(db, event_id, tier_id, refresh=True)
+
+    codes = [TAKEN] * len(layout.seats)
+    for r in rows:
+        i = layout.ordinal.get(r.id)
+        if i is not None:
+            codes[i] = STATUS_CODES.get(r.status, TAKEN)
+    bits = pack(codes)
+    snapshot = Snapshot(_digest(layout.version.encode() + bits), layout.version, len(codes), bits)
+    _snapshots.put(key, snapshot)
+
+    history = _history.setdefault(key, OrderedDict())
+    _history.move_to_end(key)
+    history[snapshot.version] = bits
+    while len(history) > SEATMAP_HISTORY:
+        history.popitem(last=False)
+    while len(_history) > 1000:
+        _history.popitem(last=False)
+    return snapshot
+
+
+def availability_payload(event_id: int, tier_id: int, snapshot: Snapshot, since: str = None) -> dict:
+    """Полный bitmap или, если since есть в истории этого воркера, только изменения."""
+    payload = {"version": snapshot.version, "layout_version": snapshot.layout_version, "count": snapshot.count}
+    old = _history.get((event_id, tier_id), {}).get(since) if since else None
+    if old is not None:
+        payload["changes"] = diff(old, snapshot.bits, snapshot.count)
+    else:
+        payload["bitmap"] = base64.b64encode(snapshot.bits).decode()
+    return payload
+
+
+def invalidate(event_id: int, tier_ids):
+    """Забывает схемы и снимки тарифов одного события (после правки его тарифов или зала)."""
+    for tier_id in tier_ids:
+        key = (event_id, tier_id)
+        _layouts.invalidate(key)
+        _snapshots.invalidate(key)
+        _history.pop(key, None)
+
+
+def clear():
+    _layouts.clear()
+    _snapshots.clear()
+    _history.clear()
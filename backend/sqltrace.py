@@ -0,0 +1,129 @@
+"""
+Разбор SQL-запросов: журнал медленных запросов, детектор N+1 и бюджеты запросов в тестах.
+
+Хуки курсора живут в metrics.py (там же замер времени и контекст запроса),
+сюда приходит каждый выполненный statement через observe():
+  - запрос дольше SQL_SLOW_MS миллисекунд пишется в лог "sql.slow" с нормализованным
+    SQL (литералы и списки IN заменены на ?) и маршрутом, из которого он пришёл;
+  - если в рамках одного HTTP-запроса один и тот же нормализованный statement
+    выполнился SQL_N_PLUS_ONE_THRESHOLD раз, в лог "sql.n_plus_one" уходит
+    предупреждение (одно на форму запроса) — типичный признак ленивой загрузки в цикле;
+  - capture() / max_queries(n) собирают statements в тестах:
+
+        with sqltrace.max_queries(4):
+            client.get("/events")
+
+    max_queries можно повесить и декоратором на функцию. При превышении —
+    AssertionError со списком запросов и повторяющимися формами.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+from contextlib import ContextDecorator, contextmanager
+
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "200"))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+
+slow_log = logging.getLogger("sql.slow")
+n_plus_one_log = logging.getLogger("sql.n_plus_one")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|\$\d+|(?<![:\w]):(?!:)\w+|__\[POSTCOMPILE_\w+\]|%s|\?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_VALUES = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize(statement: str) -> str:
+    """Форма запроса: без литералов и значений параметров, списки IN (...) и VALUES свёрнуты."""
+    sql = _SPACE.sub(" ", statement).strip()
+    sql = _STRING.sub("?", sql)
+    sql = _PARAM.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _LIST.sub("(?)", sql)
+    return _VALUES.sub(r"\1", sql)
+
+
+class Capture:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, threshold: int = 2) -> dict:
+        """{форма: сколько раз} для форм, выполненных не меньше threshold раз."""
+        counts = {}
+        for statement in self.statements:
+            shape = normalize(statement)
+            counts[shape] = counts.get(shape, 0) + 1
+        return {shape: n for shape, n in counts.items() if n >= threshold}
+
+    def report(self) -> str:
+        lines = [f"{i + 1:3d}. {normalize(s)}" for i, s in enumerate(self.statements)]
+        repeated = self.repeated()
+        if repeated:
+            lines.append("repeated:")
+            lines += [f"  {n}x {shape}" for shape, n in sorted(repeated.items(), key=lambda x: -x[1])]
+        return "\n".join(lines)
+
+
+_captures: list = []
+_captures_lock = threading.Lock()
+
+
+@contextmanager
+def capture():
+    """Собирает все statements всех движков (в т.ч. из потоков приложения) внутри блока."""
+    c = Capture()
+    with _captures_lock:
+        _captures.append(c)
+    try:
+        yield c
+    finally:
+        with _captures_lock:
+            _captures.remove(c)
+
+
+class max_queries(ContextDecorator):
+    """Бюджет запросов: блок или функция должны уложиться в limit statements."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._ctx = None
+        self.captured = None
+
+    def __enter__(self):
+        self._ctx = capture()
+        self.captured = self._ctx.__enter__()
+        return self.captured
+
+    def __exit__(self, *exc):
+        self._ctx.__exit__(*exc)
+        if exc[0] is None and self.captured.count > self.limit:
+            raise AssertionError(
+                f"{self.captured.count} SQL statements, budget {self.limit}:\n{self.captured.report()}"
+            )
+        return False
+
+
+def observe(statement: str, seconds: float, stats=None):
+    """Вызывается из metrics после каждого statement. stats — metrics.RequestStats или None (фон)."""
+    if _captures:
+        with _captures_lock:
+            for c in _captures:
+                c.statements.append(statement)
+    if seconds * 1000 >= SQL_SLOW_MS:
+        slow_log.warning("slow query %.1f ms route=%s: %s", seconds * 1000,
+                         stats.route() if stats is not None else "-", normalize(statement))
+    if stats is not None and SQL_N_PLUS_ONE_THRESHOLD > 0:
+        shape = normalize(statement)
+        n = stats.shapes[shape] = stats.shapes.get(shape, 0) + 1
+        if n == SQL_N_PLUS_ONE_THRESHOLD:
+            n_plus_one_log.warning("possible N+1: statement repeated %d times in route=%s: %s",
+                                   n, stats.route(), shape)
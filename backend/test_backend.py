@@ -193,3 +193,1228 @@ def test_event_has_seats(admin_token):
 def test_venue_seats(admin_token):
     r = client.get("/venues/1/seats")
     assert r.status_code == 200
+
+
+# ---------------- API (TestClient + sqlite из conftest) ----------------
+
+def seed_event(db, title="Event", days=10, tiers=(("Standard", 1000, 5),), tickets=False):
+    """Событие в новом зале на 3 места; tickets=True — билеты тарифов без мест и их счётчики."""
+    import inventory, models
+    genre = db.query(models.Genre).filter_by(name="Концерт").first() or models.Genre(name="Концерт")
+    venue = models.Venue(name="Hall", address="addr")
+    db.add_all([genre, venue])
+    db.flush()
+    db.add_all([models.Seat(venue_id=venue.id, row_label="A", seat_number=i, seat_type="standard", base_price=1000) for i in range(1, 4)])
+    ev = models.Event(title=title, genre_id=genre.id, venue_id=venue.id, start_datetime=datetime.now() + timedelta(days=days))
+    db.add(ev)
+    db.flush()
+    pts = [models.PriceTier(event_id=ev.id, name=name, price=price, capacity=cap) for name, price, cap in tiers]
+    db.add_all(pts)
+    db.flush()
+    if tickets:
+        inventory.materialize_tickets(db, ev.id, [(pt.id, pt.price, pt.capacity) for pt in pts], [])
+        for pt in pts:
+            inventory.init_tier(db, pt.id, ev.id, pt.capacity)
+    db.commit()
+    return ev.id, venue.id
+
+def tier_of(db, event_id, name=None):
+    import models
+    q = db.query(models.PriceTier.id).filter_by(event_id=event_id)
+    return (q.filter_by(name=name) if name else q).one()[0]
+
+def test_api_events_list_loads_relations(client, db):
+    event_id, _ = seed_event(db)
+    r = client.get("/events")
+    assert r.status_code == 200
+    ev = next(e for e in r.json() if e["id"] == event_id)
+    assert ev["genre"]["name"] == "Концерт"
+    assert ev["venue"]["name"] == "Hall"
+    assert ev["price_tiers"][0]["name"] == "Standard"
+
+def test_api_event_detail_notfound(client):
+    r = client.get("/events/999")
+    assert r.status_code == 404
+
+def test_api_venue_seats_ordered(client, db):
+    _, venue_id = seed_event(db)
+    r = client.get(f"/venues/{venue_id}/seats")
+    assert r.status_code == 200
+    assert [s["seat_number"] for s in r.json()] == [1, 2, 3]
+
+def test_api_async_handlers_use_async_session(client, db):
+    import asyncio
+    from sqlalchemy import event as sa_event
+    import crud_async
+    from conftest import TestingAsyncSessionLocal, async_engine, engine
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 3),), tickets=True)
+    tier_id = tier_of(db, event_id)
+
+    seen = {"sync": 0, "async": 0}
+    listeners = [(engine, lambda *args: seen.__setitem__("sync", seen["sync"] + 1)),
+                 (async_engine.sync_engine, lambda *args: seen.__setitem__("async", seen["async"] + 1))]
+    for target, fn in listeners:
+        sa_event.listen(target, "before_cursor_execute", fn)
+    try:
+        assert client.get(f"/events/{event_id}").json()["price_tiers"][0]["id"] == tier_id
+        r = client.get(f"/events/{event_id}/availability")
+        assert r.status_code == 200, r.text
+    finally:
+        for target, fn in listeners:
+            sa_event.remove(target, "before_cursor_execute", fn)
+    # async-обработчики ходят в базу только через AsyncSession
+    assert seen["sync"] == 0 and seen["async"] >= 2
+
+    # параллельные сессии на одном движке не мешают друг другу, связи загружены заранее
+    async def scenario():
+        async def load():
+            async with TestingAsyncSessionLocal() as s:
+                ev = await crud_async.get_event(s, event_id)
+                return ev.title, tuple(pt.name for pt in ev.price_tiers), ev.venue.name
+        return await asyncio.gather(*(load() for _ in range(5)))
+    results = asyncio.run(scenario())
+    assert len(set(results)) == 1 and results[0][1] == ("Standard",)
+
+def register(client, email="buyer@test.com"):
+    r = client.post("/auth/register", json={"email": email, "password": "pass", "full_name": "Buyer"})
+    assert r.status_code == 200
+    return r.json()["access_token"]
+
+def buyer(client, db, email="buyer@test.com", wallet=1000):
+    import models
+    token = register(client, email)
+    db.query(models.User).filter_by(email=email).update({"wallet_balance": wallet})
+    db.commit()
+    return {"Authorization": f"Bearer {token}"}
+
+def admin_headers(client, db, email="admin@test.com"):
+    import auth, models
+    token = register(client, email)
+    db.query(models.User).filter_by(email=email).update({"role": "admin"})
+    db.commit()
+    auth.principal_cache.clear()
+    return {"Authorization": f"Bearer {token}"}
+
+def test_api_token_carries_id_role_exp(client):
+    from jose import jwt
+    import auth
+    claims = jwt.decode(register(client), auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    assert claims["role"] == "user"
+    assert int(claims["sub"]) > 0
+    assert claims["exp"] > datetime.utcnow().timestamp()
+
+def test_api_profile_update_invalidates_principal(client):
+    headers = {"Authorization": f"Bearer {register(client)}"}
+    assert client.get("/users/me", headers=headers).json()["full_name"] == "Buyer"
+    assert client.patch("/users/me", json={"full_name": "Renamed"}, headers=headers).status_code == 200
+    assert client.get("/users/me", headers=headers).json()["full_name"] == "Renamed"
+
+def test_principal_cache_ttl_and_lru():
+    import auth
+    cache = auth.TTLCache(maxsize=2, ttl=60)
+    cache.put(1, "a"); cache.put(2, "b")
+    cache.get(1)
+    cache.put(3, "c")
+    assert cache.get(2) is None and cache.get(1) == "a"
+    expired = auth.TTLCache(maxsize=2, ttl=-1)
+    expired.put(1, "a")
+    assert expired.get(1) is None
+
+def test_api_login_rehashes_outdated_hash(client, db):
+    import models
+    from passlib.hash import argon2
+    db.add(models.User(email="old@test.com", password_hash=argon2.using(time_cost=2).hash("pass"), full_name=""))
+    db.commit()
+    r = client.post("/auth/login", json={"email": "old@test.com", "password": "pass"})
+    assert r.status_code == 200
+    db.expire_all()
+    assert "t=2" not in db.query(models.User).filter_by(email="old@test.com").one().password_hash
+    assert client.post("/auth/login", json={"email": "old@test.com", "password": "nope"}).status_code == 400
+
+def test_api_catalog_etag_304(client, db):
+    seed_event(db)
+    r = client.get("/genres")
+    assert r.status_code == 200 and r.headers["etag"]
+    assert "max-age" in r.headers["cache-control"]
+    r2 = client.get("/genres", headers={"If-None-Match": r.headers["etag"]})
+    assert r2.status_code == 304 and r2.content == b""
+    assert client.get("/genres", headers={"If-None-Match": '"other"'}).status_code == 200
+
+def test_api_catalog_cache_key_and_bound(client, db, monkeypatch):
+    import response_cache
+    seed_event(db)
+    for i in range(5):
+        assert client.get("/genres", params={"x": i}).status_code == 200
+    client.get("/events", params={"limit": 2, "junk": 1})
+    assert sorted(response_cache.cache._entries) == ["/events?limit=2", "/genres?"]
+    monkeypatch.setattr(response_cache.cache, "maxsize", 2)
+    client.get("/events", params={"limit": 3})
+    assert sorted(response_cache.cache._entries) == ["/events?limit=2", "/events?limit=3"]
+
+def test_api_catalog_cache_invalidated_by_admin(client, db):
+    import crud, schemas
+    _, venue_id = seed_event(db)
+    assert client.get(f"/venues/{venue_id}").json()["name"] == "Hall"
+    assert client.get("/events").json()[0]["venue"]["name"] == "Hall"
+    crud.admin_update_venue(db, venue_id, schemas.VenueUpdate(name="Big Hall", address="addr", seats_map_json=None))
+    assert client.get(f"/venues/{venue_id}").json()["name"] == "Big Hall"
+    assert client.get("/events").json()[0]["venue"]["name"] == "Big Hall"
+
+def test_api_events_keyset_pagination(client, db):
+    for i in range(5):
+        seed_event(db, title=f"E{i}", days=i + 1)
+    seen, cursor = [], None
+    while True:
+        r = client.get("/events", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        seen += [e["title"] for e in r.json()]
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == [f"E{i}" for i in range(5)]
+    assert client.get("/events", params={"cursor": "garbage"}).status_code == 400
+
+def test_api_events_constant_queries(client, db):
+    from sqlalchemy import event as sa_event
+    from conftest import async_engine
+    for i in range(6):
+        seed_event(db, title=f"E{i}", days=i + 1, tiers=(("A", 100, 1), ("B", 200, 1)))
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    sa_event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        assert len(client.get("/events", params={"limit": 100}).json()) == 6
+    finally:
+        sa_event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+    assert len(statements) == 4  # события + genre + venue + price_tiers
+
+# ---------------- индексы и планы горячих запросов ----------------
+# планы строятся по SQL, который реально отправили эндпоинты и фоновые задачи
+
+def seq_scans(conn, sql, params):
+    """Таблицы, которые план читает целиком (sqlite: SCAN без индекса, postgres: Seq Scan)."""
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql, params).scalar()[0]["Plan"]
+        nodes, found = [plan], []
+        while nodes:
+            node = nodes.pop()
+            if node["Node Type"] == "Seq Scan":
+                found.append(node["Relation Name"])
+            nodes += node.get("Plans", [])
+        return found
+    rows = [r[-1] for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params)]
+    # подзапрос с LIMIT (anon_1) читается целиком, но он уже ограничен индексом
+    derived = {r.split()[1] for r in rows if r.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+    return [r for r in rows if r.startswith("SCAN ") and " USING " not in r and r.split()[1] not in derived]
+
+def hot_path_statements(client, db):
+    """SELECT'ы горячих путей: каталог, места, покупка, брони, sweeper, история заказов, вход."""
+    from sqlalchemy import event as sa_event
+    from conftest import engine, async_engine
+    import holds, inventory, models
+    event_id, venue_id = seed_event(db, tiers=(("Seated", 100, 3), ("Floor", 50, 4)))
+    seated, floor = db.query(models.PriceTier).filter_by(event_id=event_id).order_by(models.PriceTier.id).all()
+    seats = inventory.venue_seat_ids(db, venue_id)
+    inventory.materialize_tickets(db, event_id, [(seated.id, 100, 3), (floor.id, 50, 4)], seats)
+    inventory.init_tier(db, seated.id, event_id, 3, has_seats=True)
+    inventory.init_tier(db, floor.id, event_id, 4)
+    db.commit()
+    headers = buyer(client, db)
+
+    seen = []
+    listener = lambda conn, cursor, statement, params, *args: seen.append((statement, params))
+    engines = (engine, async_engine.sync_engine)
+    for e in engines:
+        sa_event.listen(e, "before_cursor_execute", listener)
+    try:
+        r = client.get("/events", params={"limit": 1})
+        client.get("/events", params={"limit": 1, "cursor": r.headers["x-next-cursor"]} if "x-next-cursor" in r.headers else {})
+        client.get("/events", params={"genre_id": 1, "date_from": "2020-01-01T00:00:00"})
+        client.get("/events", params={"venue_id": venue_id})
+        client.get(f"/events/{event_id}")
+        client.get(f"/events/{event_id}/min_price")
+        client.get(f"/events/{event_id}/tickets", params={"tier_id": seated.id})
+        client.get(f"/events/{event_id}/tier/{seated.id}/available")
+        client.get(f"/events/{event_id}/has-seats")
+        client.get(f"/events/{event_id}/availability")
+        client.get(f"/venues/{venue_id}/seats")
+        assert client.post("/orders", json={"items": [{"tier_id": floor.id, "quantity": 2}]}, headers=headers).status_code == 200
+        hold = client.post(f"/events/{event_id}/holds", json={"items": [{"tier_id": floor.id}]}, headers=headers).json()
+        assert client.post(f"/holds/{hold['id']}/checkout", headers=headers).status_code == 200
+        holds.release_expired(db)
+        client.get("/orders/me", params={"limit": 1}, headers=headers)
+        client.get("/orders/me", params={"status": "paid"}, headers=headers)
+        client.post("/auth/login", json={"email": "buyer@test.com", "password": "pass"})
+    finally:
+        for e in engines:
+            sa_event.remove(e, "before_cursor_execute", listener)
+    return [(sql, params) for sql, params in seen if sql.lstrip().upper().startswith("SELECT")]
+
+def test_hot_queries_use_indexes(client, db):
+    statements = hot_path_statements(client, db)
+    assert len(statements) > 20
+    conn = db.connection()
+    scans = {sql: found for sql, params in statements if (found := seq_scans(conn, sql, params))}
+    assert scans == {}
+
+def test_migrations_apply_once(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    import migrate, models
+    engine = create_engine(f"sqlite:///{tmp_path / 'm.db'}")
+    models.Base.metadata.create_all(engine)
+    migrate.stamp(engine)
+    assert migrate.upgrade(engine) == []
+    # база, на которой 0001 ещё не применялась
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX idx_tickets_tier_status_id")
+        conn.exec_driver_sql("DELETE FROM schema_migrations WHERE version = '0001'")
+    assert migrate.upgrade(engine) == ["0001"]
+    assert "idx_tickets_tier_status_id" in {ix["name"] for ix in inspect(engine).get_indexes("tickets")}
+    assert migrate.upgrade(engine) == []
+
+def baseline_schema(engine):
+    """Схема до броней и счётчиков: без ticket_holds / tier_inventory / event_cancellations и tickets.hold_id."""
+    from sqlalchemy import Column, ForeignKey, MetaData, Table
+    import models
+    baseline = MetaData()
+    for table in models.Base.metadata.sorted_tables:
+        if table.name in ("ticket_holds", "tier_inventory", "event_cancellations"):
+            continue
+        Table(table.name, baseline, *[
+            Column(c.name, c.type, *[ForeignKey(fk.target_fullname) for fk in c.foreign_keys], primary_key=c.primary_key)
+            for c in table.columns if c.name != "hold_id"
+        ])
+    baseline.create_all(engine)
+    return baseline
+
+def test_init_db_upgrades_baseline_schema(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from sqlalchemy.orm import Session
+    import database, inventory, migrate, models
+    versions = [v for v, _, _ in migrate.available()]
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    tables = baseline_schema(engine).tables
+    with engine.begin() as conn:
+        conn.execute(tables["events"].insert().values(id=1, title="Old", start_datetime=datetime(2030, 1, 1)))
+        conn.execute(tables["price_tiers"].insert().values(id=1, event_id=1, name="Floor", price=10, capacity=2))
+        conn.execute(tables["tickets"].insert(), [{"event_id": 1, "tier_id": 1, "status": s, "price": 10} for s in ("sold", "available")])
+
+    assert database.init_db(engine) == versions
+    schema = inspect(engine)
+    assert "hold_id" in {c["name"] for c in schema.get_columns("tickets")}
+    assert "idx_tickets_hold" in {ix["name"] for ix in schema.get_indexes("tickets")}
+    assert {"held", "sold", "has_seats"} <= {c["name"] for c in schema.get_columns("tier_inventory")}
+    assert database.init_db(engine) == []
+    with Session(engine) as db:
+        counter = inventory.get_counter(db, 1)
+        assert (counter.available, counter.held, counter.sold) == (1, 0, 1)
+
+    # база, созданная по models.py, но без stamp: колонки уже есть — миграции их пропускают
+    fresh = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    models.Base.metadata.create_all(fresh)
+    assert migrate.upgrade(fresh) == versions
+
+def test_seatmap_pack_roundtrip_and_diff():
+    import seatmap
+    codes = [0, 1, 2, 0, 2, 2, 1]
+    bits = seatmap.pack(codes)
+    assert len(bits) == 2 and seatmap.unpack(bits, len(codes)) == codes
+    changed = seatmap.pack([0, 2, 2, 0, 2, 0, 1])
+    assert seatmap.diff(bits, changed, len(codes)) == [[1, 2], [5, 0]]
+
+def test_api_seat_availability_bitmap_and_delta(client, db):
+    import base64, models, seatmap
+    event_id, venue_id = seed_event(db, tiers=(("Standard", 1000, 3),))
+    tier_id = db.query(models.PriceTier).filter_by(event_id=event_id).one().id
+    seats = db.query(models.Seat).filter_by(venue_id=venue_id).order_by(models.Seat.seat_number).all()
+    db.add_all([models.Ticket(event_id=event_id, tier_id=tier_id, seat_id=s.id, status="available", price=1000) for s in seats])
+    db.commit()
+
+    layout = client.get(f"/events/{event_id}/tiers/{tier_id}/layout").json()
+    assert [s[1:] for s in layout["seats"]] == [["A", 1], ["A", 2], ["A", 3]]
+    first = client.get(f"/events/{event_id}/tiers/{tier_id}/availability").json()
+    assert first["layout_version"] == layout["layout_version"]
+    assert seatmap.unpack(base64.b64decode(first["bitmap"]), first["count"]) == [0, 0, 0]
+
+    ticket = db.get(models.Ticket, layout["seats"][1][0])
+    ticket.status = "sold"
+    db.commit()
+    seatmap._snapshots.clear()
+    delta = client.get(f"/events/{event_id}/tiers/{tier_id}/availability", params={"since": first["version"]}).json()
+    assert delta["version"] != first["version"] and delta["changes"] == [[1, 2]]
+    unknown = client.get(f"/events/{event_id}/tiers/{tier_id}/availability", params={"since": "nope"}).json()
+    assert "bitmap" in unknown
+
+def test_seatfeed_commit_fanout_and_resync(db):
+    import asyncio, models, seatfeed
+    event_id, _ = seed_event(db)
+    ticket = models.Ticket(event_id=event_id, tier_id=None, status="available", price=1)
+    db.add(ticket)
+    db.commit()
+
+    def sell(status):
+        ticket.status = status
+        seatfeed.notify(db, [ticket], status)
+        db.commit()
+
+    async def scenario():
+        seatfeed.start()
+        queue = seatfeed.subscribe(event_id)
+        # коммит из потока, как в sync-обработчике; откат ничего не публикует
+        seatfeed.notify(db, [ticket], "held")
+        db.rollback()
+        await asyncio.to_thread(sell, "sold")
+        assert await asyncio.wait_for(queue.get(), 1) == {"event_id": event_id, "changes": [[ticket.id, 2]]}
+        assert queue.empty()
+        for _ in range(seatfeed.SEATFEED_QUEUE + 1):
+            seatfeed.publish_local({"event_id": event_id, "changes": []})
+        assert queue.get_nowait() is seatfeed.RESYNC
+        seatfeed.unsubscribe(event_id, queue)
+        assert event_id not in seatfeed._subscribers
+
+    asyncio.run(scenario())
+
+def test_seatfeed_stream_format():
+    import asyncio, seatfeed
+
+    async def scenario():
+        seatfeed.start()
+        disconnected = False
+        async def is_disconnected():
+            return disconnected
+        gen = seatfeed.stream(7, is_disconnected)
+        assert (await gen.__anext__()).startswith("retry:")
+        pending = asyncio.ensure_future(gen.__anext__())
+        await asyncio.sleep(0)
+        seatfeed.publish_local({"event_id": 7, "changes": [[1, 0]]})
+        assert await asyncio.wait_for(pending, 1) == "data: [[1,0]]\n\n"
+        await gen.aclose()
+        assert 7 not in seatfeed._subscribers
+
+    asyncio.run(scenario())
+
+def test_inventory_counters_follow_transitions_and_reconcile(db):
+    import inventory, models
+    event_id, _ = seed_event(db, tiers=(("Standard", 1000, 4),), tickets=True)
+    tier_id = tier_of(db, event_id)
+
+    def counters():
+        db.expire_all()
+        c = db.get(models.TierInventory, tier_id)
+        return c.available, c.held, c.sold
+
+    inventory.reserve(db, {tier_id: 2}, into="held")
+    inventory.convert(db, {tier_id: 1})
+    inventory.release(db, {tier_id: 1}, source="held")
+    inventory.reserve(db, {tier_id: 1})
+    inventory.refund(db, {tier_id: 1})
+    db.commit()
+    assert counters() == (2, 0, 1)
+
+    # счётчики разошлись с tickets (все 4 билета свободны) — сверка чинит
+    fixed = inventory.reconcile(db, event_id)
+    assert fixed[0]["tickets"]["available"] == 4 and fixed[0]["counter"]["sold"] == 1
+    assert counters() == (4, 0, 0)
+    assert inventory.reconcile(db, event_id) == []
+
+def test_api_reconcile_counts_activated_tickets_as_sold(client, db):
+    import models
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 3),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = buyer(client, db)
+    r = client.post("/orders", json={"items": [{"tier_id": tier_id, "quantity": 2}]}, headers=headers)
+    assert r.status_code == 200, r.text
+    ticket_id = r.json()["items"][0]["ticket_id"]
+    assert client.post(f"/tickets/{ticket_id}/activate", headers=headers).json()["status"] == "activated"
+
+    r = client.post("/admin/inventory/reconcile", params={"event_id": event_id}, headers=admin_headers(client, db))
+    assert r.status_code == 200 and r.json() == {"fixed": []}
+    db.expire_all()
+    c = db.get(models.TierInventory, tier_id)
+    assert (c.available, c.held, c.sold) == (1, 0, 2)
+
+def test_api_admin_update_event_syncs_tiers_in_place(client, db):
+    import inventory, models
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 4),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = buyer(client, db)
+    admin = admin_headers(client, db)
+    r = client.post("/orders", json={"items": [{"tier_id": tier_id, "quantity": 2}]}, headers=headers)
+    assert r.status_code == 200, r.text
+    sold_ids = {i["ticket_id"] for i in r.json()["items"]}
+
+    def patch(price, capacity):
+        tiers = [{"id": tier_id, "name": "Standard", "price": price, "capacity": capacity}]
+        return client.patch(f"/admin/events/{event_id}", json={"price_tiers": tiers}, headers=admin)
+
+    def tickets():
+        db.expire_all()
+        return {t.id: (t.status, t.price) for t in db.query(models.Ticket).filter_by(tier_id=tier_id)}
+
+    def counters():
+        db.expire_all()
+        c = db.get(models.TierInventory, tier_id)
+        return c.available, c.held, c.sold
+
+    # цена меняется на месте: те же билеты, проданные — по старой цене
+    before = tickets()
+    r = patch(150, 4)
+    assert r.status_code == 200, r.text
+    assert [t["id"] for t in r.json()["price_tiers"]] == [tier_id]
+    after = tickets()
+    assert after.keys() == before.keys()
+    assert {tid: v for tid, v in after.items() if tid in sold_ids} == {tid: ("sold", 100) for tid in sold_ids}
+    assert {v for tid, v in after.items() if tid not in sold_ids} == {("available", 150)}
+
+    # рост вместимости досоздаёт только недостающие билеты
+    assert patch(150, 6).status_code == 200
+    grown = tickets()
+    assert after.keys() < grown.keys() and len(grown) == 6
+    assert {grown[tid] for tid in grown.keys() - after.keys()} == {("available", 150)}
+    assert counters() == (4, 0, 2)
+
+    # уменьшение удаляет только свободные; задеть проданные нельзя
+    assert patch(150, 3).status_code == 200
+    shrunk = tickets()
+    assert len(shrunk) == 3 and sold_ids <= shrunk.keys()
+    assert counters() == (1, 0, 2)
+    r = patch(150, 1)
+    assert r.status_code == 409
+    assert tickets() == shrunk and counters() == (1, 0, 2)
+    assert db.get(models.PriceTier, tier_id).capacity == 3
+    r = client.patch(f"/admin/events/{event_id}", json={"price_tiers": []}, headers=admin)
+    assert r.status_code == 409
+    assert tickets() == shrunk
+    assert inventory.reconcile(db, event_id) == []
+
+def test_api_admin_update_event_metadata_tiers_and_venue(client, db):
+    import inventory, models, seatmap, sqltrace
+    _, venue_id = seed_event(db)
+    _, other_venue = seed_event(db, title="Other venue")
+    admin = admin_headers(client, db)
+    r = client.post("/admin/events", json={"title": "Show", "venue_id": venue_id, "start_datetime": "2030-01-01T20:00:00",
+                                           "price_tiers": [{"name": "Seated", "price": 100, "capacity": 2}]}, headers=admin)
+    event_id = r.json()["id"]
+    seated = tier_of(db, event_id)
+    other_id = client.post("/admin/events", json={"title": "Neighbour", "venue_id": other_venue, "start_datetime": "2030-01-02T20:00:00",
+                                                  "price_tiers": [{"name": "Seated", "price": 100, "capacity": 1}]},
+                           headers=admin).json()["id"]
+    other_tier = tier_of(db, other_id)
+
+    def patch(**body):
+        r = client.patch(f"/admin/events/{event_id}", json=body, headers=admin)
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    def layouts():
+        for e, t in ((event_id, seated), (other_id, other_tier)):
+            assert client.get(f"/events/{e}/tiers/{t}/layout").status_code == 200
+        return {key for key in ((event_id, seated), (other_id, other_tier)) if seatmap._layouts.get(key) is not None}
+
+    def seats(tier):
+        db.expire_all()
+        return [t.seat_id for t in db.query(models.Ticket).filter_by(tier_id=tier).order_by(models.Ticket.id)]
+
+    # только поля события: ни билетов, ни счётчиков, схемы мест остаются в кэше
+    assert len(layouts()) == 2
+    with sqltrace.capture() as q:
+        assert patch(title="Renamed")["title"] == "Renamed"
+    assert not [sql for sql in q.statements if "tickets" in sql or "tier_inventory" in sql]
+    assert len(seatmap._layouts._data) == 2
+
+    # новый тариф: билеты на свободные места зала, остальное — без мест; чужие схемы не сбрасываются
+    layouts()
+    tiers = [{"id": seated, "name": "Seated", "price": 100, "capacity": 2}, {"name": "Balcony", "price": 60, "capacity": 2}]
+    assert [t["name"] for t in patch(price_tiers=tiers)["price_tiers"]] == ["Seated", "Balcony"]
+    balcony = tier_of(db, event_id, "Balcony")
+    venue_seats = inventory.venue_seat_ids(db, venue_id)
+    assert seats(seated) == venue_seats[:2] and seats(balcony) == [venue_seats[2], None]
+    c = db.get(models.TierInventory, balcony)
+    assert (c.available, c.has_seats) == (2, True)
+    assert seatmap._layouts.get((other_id, other_tier)) is not None and seatmap._layouts.get((event_id, seated)) is None
+
+    # смена зала пересобирает билеты на местах нового зала
+    layouts()
+    assert patch(venue_id=other_venue)["venue"]["id"] == other_venue
+    new_seats = inventory.venue_seat_ids(db, other_venue)
+    assert seats(seated) == new_seats[:2] and seats(balcony) == [new_seats[2], None]
+    assert seatmap._layouts.get((other_id, other_tier)) is not None and seatmap._layouts.get((event_id, seated)) is None
+    assert inventory.reconcile(db, event_id) == []
+
+    # после продажи зал не меняется
+    headers = buyer(client, db)
+    assert client.post("/orders", json={"items": [{"tier_id": balcony}]}, headers=headers).status_code == 200
+    assert client.patch(f"/admin/events/{event_id}", json={"venue_id": venue_id}, headers=admin).status_code == 409
+    assert seats(seated) == new_seats[:2]
+
+def test_api_holds_checkout_release_and_expiry(client, db, monkeypatch):
+    import holds, inventory, models
+    from conftest import TestingSessionLocal
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 5),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = buyer(client, db, wallet=150)
+
+    def hold(qty):
+        r = client.post(f"/events/{event_id}/holds", json={"items": [{"tier_id": tier_id, "quantity": qty}]}, headers=headers)
+        assert r.status_code == 200, r.text
+        return r.json()["id"]
+
+    def counters():
+        db.expire_all()
+        c = db.get(models.TierInventory, tier_id)
+        return c.available, c.held, c.sold
+
+    first, second = hold(1), hold(1)
+    assert counters() == (3, 2, 0)
+    # денег хватает на одну оплату: вторая получает 402, баланс не уходит в минус
+    r = client.post(f"/holds/{first}/checkout", headers=headers)
+    assert r.status_code == 200 and r.json()["wallet_balance"] == 50
+    assert client.post(f"/holds/{second}/checkout", headers=headers).status_code == 402
+    assert client.post(f"/holds/{first}/checkout", headers=headers).status_code == 409
+    assert client.delete(f"/holds/{second}", headers=headers).json() == {"status": "released", "released": 1}
+    assert counters() == (4, 0, 1)
+
+    # просроченную бронь не оплатить, её билеты возвращает sweeper
+    monkeypatch.setattr(holds, "HOLD_TTL_SECONDS", -1)
+    expired = hold(2)
+    assert counters() == (2, 2, 1)
+    assert client.post(f"/holds/{expired}/checkout", headers=headers).status_code == 410
+    assert holds.sweep(TestingSessionLocal, batch_size=1) == 2
+    assert counters() == (4, 0, 1)
+    assert db.get(models.TicketHold, expired).status == "expired"
+    user = db.query(models.User).filter_by(email="buyer@test.com").one()
+    assert user.wallet_balance == 50 and db.query(models.OrderItem).count() == 1
+    assert db.query(models.WalletTransaction).filter_by(user_id=user.id).count() == 1
+    assert inventory.reconcile(db, event_id) == []
+
+def test_api_hold_expires_during_checkout(client, db, monkeypatch):
+    import holds, inventory, models, sqltrace
+    from conftest import TestingSessionLocal
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 5),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = buyer(client, db)
+
+    def hold(qty=2):
+        r = client.post(f"/events/{event_id}/holds", json={"items": [{"tier_id": tier_id, "quantity": qty}]}, headers=headers)
+        assert r.status_code == 200, r.text
+        return r.json()["id"]
+
+    def tables(statements):
+        # порядок первого обращения к таблицам броней и билетов
+        order = []
+        for sql in statements:
+            for table in ("ticket_holds", "tickets"):
+                if f"FROM {table} " in sql + " " and table not in order:
+                    order.append(table)
+        return order
+
+    # срок брони выходит, пока идёт оплата: sweeper снимает её между чтением брони и билетов
+    hold_id = hold()
+    held_tickets = holds._held_tickets
+
+    def expire_meanwhile(session, hold_ids):
+        monkeypatch.setattr(holds, "_held_tickets", held_tickets)  # sweeper — уже с настоящей функцией
+        other = TestingSessionLocal()
+        other.query(models.TicketHold).filter_by(id=hold_id).update({"expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        other.commit()
+        other.close()
+        assert holds.sweep(TestingSessionLocal) == 2
+        return held_tickets(session, hold_ids)
+
+    monkeypatch.setattr(holds, "_held_tickets", expire_meanwhile)
+    assert client.post(f"/holds/{hold_id}/checkout", headers=headers).status_code == 410
+    monkeypatch.undo()
+    db.expire_all()
+    assert db.get(models.TicketHold, hold_id).status == "expired"
+    assert db.query(models.User).filter_by(email="buyer@test.com").one().wallet_balance == 1000
+    assert db.query(models.Order).count() == 0
+    assert inventory.reconcile(db, event_id) == []
+
+    # оплата, отмена и sweeper блокируют бронь раньше её билетов
+    paid, released = hold(), hold(1)
+    with sqltrace.capture() as q:
+        assert client.post(f"/holds/{paid}/checkout", headers=headers).status_code == 200
+    assert tables(q.statements) == ["ticket_holds", "tickets"]
+    with sqltrace.capture() as q:
+        assert client.delete(f"/holds/{released}", headers=headers).status_code == 200
+    assert tables(q.statements) == ["ticket_holds", "tickets"]
+    monkeypatch.setattr(holds, "HOLD_TTL_SECONDS", -1)
+    hold(1)
+    with sqltrace.capture() as q:
+        assert holds.sweep(TestingSessionLocal) == 1
+    assert tables(q.statements) == ["ticket_holds", "tickets"]
+    assert inventory.reconcile(db, event_id) == []
+
+def test_api_hold_seats_constant_queries(client, db, query_budget):
+    import models
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 12),), tickets=True)
+    ids = [t.id for t in db.query(models.Ticket).filter_by(event_id=event_id).order_by(models.Ticket.id)]
+    headers = buyer(client, db)
+
+    # выбранные места: ответ собирается из тех же строк, без SELECT на каждое место
+    def hold(ticket_ids):
+        with query_budget(6) as q:
+            r = client.post(f"/events/{event_id}/holds", json={"items": [{"ticket_id": i} for i in ticket_ids]},
+                            headers=headers)
+        assert r.status_code == 200, r.text
+        assert [i["ticket_id"] for i in r.json()["items"]] == ticket_ids and r.json()["total_amount"] == 100 * len(ticket_ids)
+        return q.count
+
+    assert hold(ids[:2]) == hold(ids[2:12])
+
+def test_api_event_availability_all_tiers(client, db):
+    import inventory, models
+    event_id, venue_id = seed_event(db, tiers=(("Seated", 1000, 3), ("Floor", 500, 2)))
+    pts = db.query(models.PriceTier).filter_by(event_id=event_id).order_by(models.PriceTier.id).all()
+    import crud
+    crud._materialize_tiers(db, event_id, venue_id, pts, inventory.venue_seat_ids(db, venue_id))
+    db.commit()
+    db.query(models.TierInventory).filter_by(tier_id=pts[1].id).delete()  # тариф без счётчика
+    db.query(models.Ticket).filter_by(tier_id=pts[1].id).limit(1).first().status = "held"
+    db.commit()
+
+    r = client.get(f"/events/{event_id}/availability")
+    assert r.status_code == 200
+    tiers = {t["name"]: t for t in r.json()["tiers"]}
+    assert (tiers["Seated"]["available"], tiers["Seated"]["has_seats"]) == (3, True)
+    assert (tiers["Floor"]["available"], tiers["Floor"]["held"], tiers["Floor"]["has_seats"]) == (1, 1, False)
+    assert client.get("/events/999/availability").status_code == 404
+
+def test_api_admin_create_event_materializes_tickets(client, db):
+    import inventory, models, sqltrace
+    _, venue_id = seed_event(db)  # зал на 3 места
+    admin = admin_headers(client, db)
+    tiers = [{"name": "VIP", "price": 300, "capacity": 2}, {"name": "Standard", "price": 100, "capacity": 3},
+             {"name": "Floor", "price": 50, "capacity": 4}]
+    with sqltrace.capture() as q:
+        r = client.post("/admin/events", json={"title": "New", "venue_id": venue_id, "start_datetime": "2030-01-01T20:00:00",
+                                               "price_tiers": tiers}, headers=admin)
+    assert r.status_code == 200, r.text
+    event_id = r.json()["id"]
+    # без COPY (SQLite) — INSERT executemany пачками, а не по билету
+    inserts = [sql for sql in q.statements if sql.startswith("INSERT INTO tickets")]
+    assert 0 < len(inserts) < 9 and not any(sql.startswith("COPY") for sql in q.statements)
+
+    # места раздаются тарифам подряд, остальное — без места
+    seats = inventory.venue_seat_ids(db, venue_id)
+    by_tier = {}
+    for t in db.query(models.Ticket).filter_by(event_id=event_id).order_by(models.Ticket.id):
+        by_tier.setdefault(t.tier.name, []).append(t)
+    assert {name: len(ts) for name, ts in by_tier.items()} == {"VIP": 2, "Standard": 3, "Floor": 4}
+    assert [t.seat_id for t in by_tier["VIP"]] == seats[:2]
+    assert [t.seat_id for t in by_tier["Standard"]] == [seats[2], None, None]
+    assert {t.seat_id for t in by_tier["Floor"]} == {None}
+    assert {(t.status, float(t.price)) for t in by_tier["Floor"]} == {("available", 50)}
+    assert len({t.qr_code for ts in by_tier.values() for t in ts}) == 9
+
+    counters = {c.tier_id: c for c in db.query(models.TierInventory).filter_by(event_id=event_id)}
+    tier_ids = {name: tier_of(db, event_id, name) for name in by_tier}
+    assert {name: (counters[tid].available, counters[tid].held, counters[tid].sold, counters[tid].has_seats)
+            for name, tid in tier_ids.items()} == {"VIP": (2, 0, 0, True), "Standard": (3, 0, 0, True),
+                                                    "Floor": (4, 0, 0, False)}
+    assert inventory.reconcile(db, event_id) == []
+
+    # пачки: 10 билетов по 4 — три INSERT
+    pt = models.PriceTier(event_id=event_id, name="Extra", price=10, capacity=10)
+    db.add(pt)
+    db.flush()
+    with sqltrace.capture() as q:
+        assert inventory.materialize_tickets(db, event_id, [(pt.id, 10, 10)], [], batch_size=4) == 10
+    assert q.count == 3
+    db.rollback()
+
+def test_api_my_orders_keyset_and_filters(client, db):
+    import models
+    headers = {"Authorization": f"Bearer {register(client)}"}
+    user = db.query(models.User).filter_by(email="buyer@test.com").one()
+    event_a, _ = seed_event(db, title="A")
+    event_b, _ = seed_event(db, title="B")
+    start = datetime(2030, 1, 1)
+    for i in range(5):
+        event_id = event_a if i % 2 == 0 else event_b
+        order = models.Order(user_id=user.id, total_amount=100, status="paid" if i < 4 else "refunded",
+                             created_at=start + timedelta(minutes=i))
+        ticket = models.Ticket(event_id=event_id, status="sold", price=100, qr_code=f"qr{i}")
+        db.add_all([order, ticket])
+        db.flush()
+        db.add(models.OrderItem(order_id=order.id, ticket_id=ticket.id, price=100))
+    db.commit()
+
+    seen, cursor = [], None
+    while True:
+        r = client.get("/orders/me", params={"limit": 2, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert r.status_code == 200
+        seen += [o["items"][0]["ticket_name"] for o in r.json()]
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == ["qr4", "qr3", "qr2", "qr1", "qr0"]
+    assert [o["status"] for o in client.get("/orders/me", params={"status": "refunded"}, headers=headers).json()] == ["refunded"]
+    by_event = client.get("/orders/me", params={"event_id": event_b}, headers=headers).json()
+    assert [o["items"][0]["event_title"] for o in by_event] == ["B", "B"]
+
+def test_api_order_round_trips_do_not_grow_with_cart(client, db):
+    from sqlalchemy import event as sa_event
+    from conftest import engine
+    import inventory, models
+    headers = buyer(client, db, wallet=10000)
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 40),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    ids = [t.id for t in db.query(models.Ticket).filter_by(tier_id=tier_id).order_by(models.Ticket.id)]
+
+    def statements(items):
+        seen = []
+        listener = lambda *args: seen.append(args[2])
+        sa_event.listen(engine, "before_cursor_execute", listener)
+        try:
+            r = client.post("/orders", json={"items": items}, headers=headers)
+        finally:
+            sa_event.remove(engine, "before_cursor_execute", listener)
+        assert r.status_code == 200, r.text
+        return len(seen)
+
+    assert statements([{"ticket_id": ids[0]}]) == statements([{"ticket_id": i} for i in ids[1:11]])
+    assert statements([{"tier_id": tier_id, "quantity": 1}]) == statements([{"tier_id": tier_id, "quantity": 10}])
+    assert statements([{"ticket_id": ids[30]}, {"tier_id": tier_id, "quantity": 1}]) == \
+        statements([{"ticket_id": i} for i in ids[31:36]] + [{"tier_id": tier_id, "quantity": 3}])
+
+    db.expire_all()
+    assert db.query(models.User).filter_by(email="buyer@test.com").one().wallet_balance == 10000 - 100 * 32
+    assert inventory.reconcile(db, event_id) == []
+    r = client.post("/orders", json={"items": [{"ticket_id": ids[0]}]}, headers=headers)
+    assert r.status_code == 400
+    r = client.post("/orders", json={"items": [{"ticket_id": ids[39]}, {"ticket_id": ids[39]}]}, headers=headers)
+    assert r.status_code == 400
+
+def test_api_cancel_event_refunds_in_chunks(client, db):
+    import inventory, models, refunds
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 8),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    buyers = [buyer(client, db, f"b{i}@test.com") for i in range(2)]
+    admin = admin_headers(client, db)
+    for headers, qty in zip(buyers, (3, 2)):
+        assert client.post("/orders", json={"items": [{"tier_id": tier_id, "quantity": qty}]}, headers=headers).status_code == 200
+    assert client.post(f"/events/{event_id}/holds", json={"items": [{"tier_id": tier_id, "quantity": 1}]},
+                       headers=buyers[1]).status_code == 200
+
+    # первая пачка, затем "остановка" — повторный запуск доделывает остальное
+    refunds.start(db, event_id)
+    assert refunds.process_chunk(db, event_id, chunk=2) == 2
+    assert refunds.progress(db, event_id)["refunded_tickets"] == 2
+    r = client.post(f"/admin/events/{event_id}/cancel", headers=admin)
+    assert r.status_code == 202
+    progress = client.get(f"/admin/events/{event_id}/cancel", headers=admin).json()
+    assert (progress["status"], progress["refunded_tickets"], progress["canceled_tickets"]) == ("done", 5, 3)
+    assert progress["remaining"] == {} and progress["refunded_amount"] == 500
+
+    db.expire_all()
+    balances = [u.wallet_balance for u in db.query(models.User).filter(models.User.email.in_(["b0@test.com", "b1@test.com"]))
+                .order_by(models.User.email)]
+    assert balances == [1000, 1000]
+    assert db.query(models.WalletTransaction).filter_by(reason="event_canceled").count() == 3
+    assert {o.status for o in db.query(models.Order)} == {"refunded"}
+    assert db.query(models.TicketHold).one().status == "released"
+    c = db.get(models.TierInventory, tier_id)
+    assert (c.available, c.held, c.sold) == (0, 0, 0)
+    assert inventory.reconcile(db, event_id) == []
+    assert client.post("/admin/events/999/cancel", headers=admin).status_code == 404
+
+def test_api_cancel_event_refunds_activated_and_fails_stuck_job(client, db, monkeypatch):
+    import inventory, models, refunds
+    from conftest import TestingSessionLocal
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 3),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = buyer(client, db)
+    admin = admin_headers(client, db)
+    r = client.post("/orders", json={"items": [{"tier_id": tier_id, "quantity": 2}]}, headers=headers)
+    assert r.status_code == 200, r.text
+    ticket_id = r.json()["items"][0]["ticket_id"]
+    assert client.post(f"/tickets/{ticket_id}/activate", headers=headers).json()["status"] == "activated"
+
+    # пачка падает каждый раз: после повторов задание не висит в 'running'
+    calls = []
+    def broken(*args, **kwargs):
+        calls.append(1)
+        raise RuntimeError("db is gone")
+    monkeypatch.setattr(refunds, "REFUND_RETRY_DELAY", 0)
+    monkeypatch.setattr(refunds, "process_chunk", broken)
+    refunds.start(db, event_id)
+    assert refunds.run(TestingSessionLocal, event_id, retries=2) == 0
+    assert len(calls) == 3
+    assert client.get(f"/admin/events/{event_id}/cancel", headers=admin).json()["status"] == "failed"
+
+    monkeypatch.undo()
+    assert client.post(f"/admin/events/{event_id}/cancel", headers=admin).status_code == 202
+    progress = client.get(f"/admin/events/{event_id}/cancel", headers=admin).json()
+    assert (progress["status"], progress["refunded_tickets"], progress["canceled_tickets"]) == ("done", 2, 1)
+    assert progress["refunded_amount"] == 200
+    db.expire_all()
+    assert db.query(models.User).filter_by(email="buyer@test.com").one().wallet_balance == 1000
+    assert db.query(models.Order).one().status == "refunded"
+    c = db.get(models.TierInventory, tier_id)
+    assert (c.available, c.held, c.sold) == (0, 0, 0)
+    assert inventory.reconcile(db, event_id) == []
+
+def test_api_cancel_event_with_open_hold(client, db, monkeypatch):
+    import holds, inventory, models, refunds, sqltrace
+    from conftest import TestingSessionLocal
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 4),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = buyer(client, db)
+    hold_id = client.post(f"/events/{event_id}/holds", json={"items": [{"tier_id": tier_id, "quantity": 2}]},
+                          headers=headers).json()["id"]
+
+    # отмена проходит, пока покупатель оплачивает бронь: пачка берёт бронь раньше её билетов
+    held_tickets = holds._held_tickets
+    captured = []
+
+    def cancel_meanwhile(session, hold_ids):
+        monkeypatch.setattr(holds, "_held_tickets", held_tickets)
+        refunds.start(db, event_id)
+        with sqltrace.capture() as q:
+            assert refunds.run(TestingSessionLocal, event_id) == 4
+        captured.extend(q.statements)
+        return held_tickets(session, hold_ids)
+
+    monkeypatch.setattr(holds, "_held_tickets", cancel_meanwhile)
+    assert client.post(f"/holds/{hold_id}/checkout", headers=headers).status_code == 410
+    first = lambda table: next(i for i, sql in enumerate(captured) if f"FROM {table} " in sql + " ")
+    assert first("ticket_holds") < first("tickets")
+
+    db.expire_all()
+    assert db.get(models.TicketHold, hold_id).status == "released"
+    assert {t.status for t in db.query(models.Ticket).filter_by(event_id=event_id)} == {"canceled"}
+    assert db.query(models.User).filter_by(email="buyer@test.com").one().wallet_balance == 1000
+    assert db.query(models.Order).count() == 0
+    assert client.post(f"/holds/{hold_id}/checkout", headers=headers).status_code == 409
+    assert inventory.reconcile(db, event_id) == []
+
+def test_api_metrics_prometheus(client, db):
+    import metrics
+    event_id, venue_id = seed_event(db)
+    admin = admin_headers(client, db)
+    metrics.registry.clear()
+    client.get(f"/events/{event_id}")
+    client.get(f"/venues/{venue_id}/seats")
+    client.get(f"/venues/{venue_id}/seats")  # второй — из кэша ответов, мимо роутера
+    client.get("/events/999")
+
+    assert client.get("/metrics").status_code == 401
+    r = client.get("/metrics", headers=admin)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    text = r.text
+    assert 'http_requests_total{method="GET",route="/events/{event_id}",status="200"} 1' in text
+    assert 'http_requests_total{method="GET",route="/events/{event_id}",status="404"} 1' in text
+    assert 'http_requests_total{method="GET",route="/venues/{venue_id}/seats",status="200"} 2' in text
+    assert 'http_request_duration_seconds_count{method="GET",route="/events/{event_id}"} 2' in text
+    # async-обработчик: SQL посчитаны в запросе, а не только в общем счётчике
+    queries = next(line for line in text.splitlines()
+                   if line.startswith('http_request_db_queries_sum{method="GET",route="/events/{event_id}"}'))
+    assert int(queries.split()[-1]) >= 2
+    seats = next(line for line in text.splitlines()
+                 if line.startswith('http_request_db_queries_sum{method="GET",route="/venues/{venue_id}/seats"}'))
+    assert int(seats.split()[-1]) >= 1
+
+    snap = metrics.registry.snapshot()
+    merged = metrics.merge([snap, snap])
+    assert merged["queries"] == 2 * snap["queries"]
+    assert merged["requests"][("GET", "/events/{event_id}", "200")] == 2
+
+def test_metrics_request_queries_flush_once(client, db, monkeypatch):
+    from sqlalchemy import text
+    import metrics
+    event_id, _ = seed_event(db)
+    metrics.registry.clear()
+    per_statement = []
+    observe_query = metrics.registry.observe_query
+    monkeypatch.setattr(metrics.registry, "observe_query", lambda seconds: (per_statement.append(1), observe_query(seconds)))
+
+    # SQL внутри запроса не берёт lock реестра, а попадает в итоги процесса при завершении запроса
+    assert client.get(f"/events/{event_id}").status_code == 200
+    assert client.get(f"/events/{event_id}/availability").status_code == 200
+    assert per_statement == []
+    snap = metrics.registry.snapshot()
+    assert snap["queries"] == sum(r[3] for _, _, r in snap["routes"]) >= 2
+
+    # фоновый SQL — вне запроса — учитывается сразу
+    db.execute(text("SELECT 1"))
+    assert len(per_statement) == 1 and metrics.registry.snapshot()["queries"] == snap["queries"] + 1
+
+def test_api_internal_pool_reports_waits_and_timeouts(client, db, monkeypatch):
+    import asyncio
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import TimeoutError as PoolTimeout
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import main, pool_metrics
+    from conftest import SQLALCHEMY_DATABASE_URL
+    from database import to_async_url
+    monkeypatch.setattr(pool_metrics, "REGISTRY", {})
+    options = dict(pool_size=1, max_overflow=0, pool_timeout=0.05)
+    sync_engine = create_engine(SQLALCHEMY_DATABASE_URL, poolclass=pool_metrics.TimedQueuePool,
+                                pool_logging_name="t_sync", **options)
+    async_engine = create_async_engine(to_async_url(SQLALCHEMY_DATABASE_URL), poolclass=pool_metrics.TimedAsyncQueuePool,
+                                       pool_logging_name="t_async", **options)
+    pool_metrics.instrument(sync_engine, "t_sync")
+    pool_metrics.instrument(async_engine.sync_engine, "t_async")
+
+    # пул на одно соединение: второй checkout ждёт pool_timeout и падает
+    held = sync_engine.connect()
+    with pytest.raises(PoolTimeout):
+        sync_engine.connect()
+
+    async def scenario():
+        async with async_engine.connect():
+            with pytest.raises(PoolTimeout):
+                await async_engine.connect()
+        await async_engine.dispose()
+    asyncio.run(scenario())
+
+    assert client.get("/internal/pool").status_code == 401
+    user = {"Authorization": f"Bearer {register(client)}"}
+    assert client.get("/internal/pool", headers=user).status_code == 403
+    pools = client.get("/internal/pool", headers=admin_headers(client, db)).json()
+    held.close()
+    sync_engine.dispose()
+    assert set(pools) == {"t_sync", "t_async"}
+    stats = pools["t_sync"]
+    assert (stats["pool_class"], stats["size"], stats["checked_out"], stats["overflow"]) == ("TimedQueuePool", 1, 1, 0)
+    assert (stats["checkouts"], stats["connects"], stats["timeouts"]) == (1, 1, 1)
+    assert stats["wait_seconds"]["count"] == 2 and stats["wait_seconds"]["sum"] >= 0.05
+    stats = pools["t_async"]
+    assert (stats["pool_class"], stats["checked_out"], stats["checkouts"], stats["checkins"]) == ("TimedAsyncQueuePool", 0, 1, 1)
+    assert stats["timeouts"] == 1
+
+    monkeypatch.setattr(main, "INTERNAL_TOKEN", "scraper-secret")
+    assert client.get("/internal/pool", headers={"Authorization": "Bearer scraper-secret"}).status_code == 200
+    assert client.get("/internal/pool", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+def test_api_query_budgets(client, db, query_budget, caplog, monkeypatch):
+    import logging
+    import inventory, metrics, sqltrace
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 6), ("VIP", 300, 2)), tickets=True)
+    tier_id = tier_of(db, event_id, "Standard")
+    headers = {"Authorization": f"Bearer {register(client)}"}
+
+    # жанр, площадка и тарифы грузятся вместе с событием, а не по одному
+    with query_budget(4) as q:
+        assert client.get("/events").status_code == 200
+    with query_budget(4) as q:
+        assert client.get(f"/events/{event_id}").status_code == 200
+    r = client.post("/orders", json={"items": [{"tier_id": tier_id, "quantity": 4}]}, headers=headers)
+    assert r.status_code == 200, r.text
+    # позиции и билеты — одним запросом, сколько бы билетов ни было в заказе
+    with query_budget(7) as q:
+        r = client.post(f"/orders/{r.json()['id']}/refund", headers=headers)
+    assert r.status_code == 200 and r.json()["refunded"] == 4 and r.json()["amount"] == 400
+    assert not q.repeated(), q.report()
+    assert inventory.reconcile(db, event_id) == []
+
+    with pytest.raises(AssertionError, match="budget 1"):
+        with query_budget(1):
+            client.get(f"/events/{event_id}")
+
+    # одна и та же форма запроса SQL_N_PLUS_ONE_THRESHOLD раз за HTTP-запрос -> предупреждение
+    monkeypatch.setattr(sqltrace, "SQL_SLOW_MS", 0)
+    stats = metrics.RequestStats()
+    with caplog.at_level(logging.WARNING, logger="sql"):
+        for i in range(sqltrace.SQL_N_PLUS_ONE_THRESHOLD + 1):
+            sqltrace.observe(f"SELECT * FROM tickets WHERE id = {i}", 0.001, stats)
+    n_plus_one = [r for r in caplog.records if r.name == "sql.n_plus_one"]
+    assert len(n_plus_one) == 1 and "SELECT * FROM tickets WHERE id = ?" in n_plus_one[0].getMessage()
+    slow = [r for r in caplog.records if r.name == "sql.slow"]
+    assert len(slow) == sqltrace.SQL_N_PLUS_ONE_THRESHOLD + 1
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="sql.slow"):
+        client.get(f"/events/{event_id}")
+    assert any("route=/events/{event_id}" in r.getMessage() for r in caplog.records)
+    assert sqltrace.normalize("SELECT a FROM t WHERE id IN (?, ?, ?) AND s = 'x' LIMIT 10") == \
+        "SELECT a FROM t WHERE id IN (?) AND s = ? LIMIT ?"
+
+def test_api_logs_request_id_and_order_trace(client, db, caplog, monkeypatch):
+    import json, logging
+    import logs
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 3),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    headers = {"Authorization": f"Bearer {register(client)}"}
+
+    r = client.get("/events", headers={"X-Request-ID": "req-1"})
+    assert r.headers["x-request-id"] == "req-1"
+    assert len(client.get("/events").headers["x-request-id"]) == 32
+
+    # трассировка заказа только у запросов из выборки
+    with caplog.at_level(logging.DEBUG, logger="trace.orders"):
+        client.post("/orders", json={"items": [{"tier_id": tier_id}]}, headers=headers)
+        assert not [rec for rec in caplog.records if rec.name == "trace.orders"]
+        monkeypatch.setattr(logs, "LOG_TRACE_SAMPLE", 1.0)
+        r = client.post("/orders", json={"items": [{"tier_id": tier_id}]}, headers=headers)
+    traced = [rec for rec in caplog.records if rec.name == "trace.orders"]
+    assert [rec.getMessage() for rec in traced] == ["order requested", "order paid"]
+    assert traced[1].order_id == r.json()["id"]
+
+    record = logging.LogRecord("orders", logging.INFO, __file__, 1, "paid %s", ("ok",), None)
+    record.request_id, record.order_id = "req-1", 7
+    line = json.loads(logs.JsonFormatter().format(record))
+    assert (line["msg"], line["request_id"], line["order_id"], line["level"]) == ("paid ok", "req-1", 7, "INFO")
+
+def test_api_waiting_room_admits_fifo(client, db, monkeypatch):
+    import waiting_room
+    monkeypatch.setattr(waiting_room, "WAITING_ROOM_CHECKOUTS", 1)
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 4),), tickets=True)
+    tier_id = tier_of(db, event_id)
+    buyers = [{"Authorization": f"Bearer {register(client, f'q{i}@test.com')}"} for i in range(3)]
+    order = {"items": [{"tier_id": tier_id}]}
+
+    assert client.post("/orders", json=order, headers=buyers[0]).status_code == 403
+    assert client.post("/events/999/queue", headers=buyers[0]).status_code == 404
+    first, second, third = (client.post(f"/events/{event_id}/queue", headers=h).json() for h in buyers)
+    assert first["position"] == 0 and first["admission_token"]
+    assert (second["position"], second["admission_token"]) == (1, None)
+    assert third["position"] == 2 and third["estimated_wait"] >= second["estimated_wait"] > 0
+    # повторный вход не двигает в конец очереди
+    assert client.post(f"/events/{event_id}/queue", headers=buyers[1]).json()["position"] == 1
+
+    # чужой пропуск не годится; свой — пока покупка не удалась, его можно повторить
+    token = {"X-Admission-Token": first["admission_token"]}
+    assert client.post("/orders", json=order, headers={**buyers[1], **token}).status_code == 403
+    r = client.post("/orders", json={"items": [{"tier_id": tier_id, "quantity": 9}]}, headers={**buyers[0], **token})
+    assert r.status_code == 400
+    assert client.post("/orders", json=order, headers={**buyers[0], **token}).status_code == 200
+    assert client.post("/orders", json=order, headers={**buyers[0], **token}).status_code == 403
+
+    # место освободилось — очередь сдвинулась
+    status = client.get(f"/events/{event_id}/queue", headers=buyers[1]).json()
+    assert status["position"] == 0 and status["admission_token"]
+    assert client.get(f"/events/{event_id}/queue", headers=buyers[2]).json()["position"] == 1
+    assert client.get(f"/events/{event_id}/queue", headers=buyers[0]).status_code == 404
+
+    # брошенный пропуск истекает сам
+    waiting_room._rooms[event_id].active[status["admission_token"]].expires_at = 0
+    assert client.get(f"/events/{event_id}/queue", headers=buyers[2]).json()["admission_token"]
+    r = client.post("/orders", json=order, headers={**buyers[1], "X-Admission-Token": status["admission_token"]})
+    assert r.status_code == 403 and "expired" in r.json()["detail"]
+
+def test_api_waiting_room_guards_holds(client, db, monkeypatch):
+    import waiting_room
+    monkeypatch.setattr(waiting_room, "WAITING_ROOM_CHECKOUTS", 1)
+    event_id, _ = seed_event(db, tiers=(("Standard", 100, 4),), tickets=True)
+    other_event, _ = seed_event(db, title="Other")
+    tier_id = tier_of(db, event_id)
+    buyers = [buyer(client, db, f"h{i}@test.com") for i in range(3)]
+    items = {"items": [{"tier_id": tier_id}]}
+
+    def hold(headers, event=event_id):
+        return client.post(f"/events/{event}/holds", json=items, headers=headers)
+
+    assert hold(buyers[0]).status_code == 403
+    tokens = [client.post(f"/events/{event_id}/queue", headers=h).json()["admission_token"] for h in buyers]
+    assert tokens[1:] == [None, None]
+    first = {**buyers[0], "X-Admission-Token": tokens[0]}
+    assert hold(first, other_event).status_code == 403
+    hold_id = hold(first).json()["id"]
+    assert client.post(f"/holds/{hold_id}/checkout", headers=buyers[0]).status_code == 403
+    assert client.post(f"/holds/{hold_id}/checkout", headers=first).status_code == 200
+
+    # оплата брони освободила место: следующий бронирует и передумывает — место снова свободно
+    token = client.get(f"/events/{event_id}/queue", headers=buyers[1]).json()["admission_token"]
+    second = {**buyers[1], "X-Admission-Token": token}
+    hold_id = hold(second).json()["id"]
+    assert client.get(f"/events/{event_id}/queue", headers=buyers[2]).json()["admission_token"] is None
+    assert client.delete(f"/holds/{hold_id}", headers=second).status_code == 200
+    assert client.get(f"/events/{event_id}/queue", headers=buyers[2]).json()["admission_token"]
+    assert hold(second).status_code == 403
+
+def test_api_auth_rate_limit(client, monkeypatch):
+    import passwords, ratelimit, sqltrace
+    register(client, "victim@test.com")
+    calls = []
+    verify = passwords.verify_password
+
+    async def counting_verify(*args):
+        calls.append(1)
+        return await verify(*args)
+
+    monkeypatch.setattr(passwords, "verify_password", counting_verify)
+    capacity = int(ratelimit.RULES[("login", "email")][0])
+    for _ in range(capacity):
+        assert client.post("/auth/login", json={"email": "victim@test.com", "password": "bad"}).status_code == 400
+
+    # отказ — без запросов к базе и без Argon2
+    with sqltrace.capture() as q:
+        r = client.post("/auth/login", json={"email": "Victim@test.com", "password": "pass"})
+    assert r.status_code == 429 and int(r.headers["Retry-After"]) >= 1
+    assert q.count == 0 and len(calls) == capacity
+    # лимит email не тратит лимит IP: другой аккаунт с того же адреса входит
+    assert client.post("/auth/login", json={"email": "buyer@test.com", "password": "pass"}).status_code == 400
+
+    register_cap = int(ratelimit.RULES[("register", "ip")][0])
+    codes = [client.post("/auth/register", json={"email": f"r{i}@test.com", "password": "pass"}).status_code
+             for i in range(register_cap)]
+    assert codes[-1] == 429 and codes.count(200) == register_cap - 1  # victim@ уже занял один токен
+
+def test_rate_limit_buckets_evict_least_recent():
+    import ratelimit
+    buckets = ratelimit.Buckets(max_keys=3)
+    rule = (1, 0.001)
+    take = lambda key, now=0.0: buckets.take([(key, *rule)], now)
+    assert take("a") == 0 and take("b") == 0 and take("c") == 0
+    assert take("a", 1.0) > 0  # отказ освежает корзину
+    # переполнение вытесняет самую старую корзину, а не все: исчерпанная "a" остаётся
+    assert take("d", 2.0) == 0
+    assert list(buckets._buckets) == ["c", "a", "d"]
+    assert take("a", 3.0) > 0 and take("c", 3.0) > 0
+    assert take("b", 3.0) == 0  # забытая корзина начинается заново
+    assert len(buckets._buckets) == 3
+
+def test_api_read_replicas_round_robin_health_and_stickiness(client, db, monkeypatch, tmp_path):
+    import asyncio
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    import main, models, replicas
+    event_id, _ = seed_event(db, title="primary")
+    urls = []
+    for name in ("r1", "r2"):
+        url = f"sqlite:///{tmp_path / name}.db"
+        replica_engine = create_engine(url)
+        models.Base.metadata.create_all(replica_engine)
+        with Session(replica_engine) as s:
+            s.add(models.Event(id=event_id, title=name, start_datetime=datetime.now() + timedelta(days=10)))
+            s.commit()
+        replica_engine.dispose()
+        urls.append(url)
+    replica_set = replicas.ReplicaSet(urls + [f"sqlite:///{tmp_path}/missing/r3.db"])
+    monkeypatch.setattr(replicas, "replica_set", replica_set)
+
+    def title(**kwargs):
+        r = client.get(f"/events/{event_id}", **kwargs)
+        assert r.status_code == 200
+        return r.json()["title"]
+
+    # недоступная реплика выходит из ротации, остальные — по кругу
+    # служебный токен, а не вход админа: регистрация включила бы чтение с primary
+    monkeypatch.setattr(main, "INTERNAL_TOKEN", "scraper-secret")
+    replica_set.check()
+    internal = {"Authorization": "Bearer scraper-secret"}
+    assert [r["healthy"] for r in client.get("/internal/replicas", headers=internal).json()] == [True, True, False]
+    assert sorted(title() for _ in range(4)) == ["r1", "r1", "r2", "r2"]
+
+    # после записи клиент читает с primary: по cookie и (без cookie) по пользователю из токена
+    headers = {"Authorization": f"Bearer {register(client)}"}
+    assert replicas.STICKY_COOKIE in client.cookies
+    assert title() == "primary"
+    client.cookies.clear()
+    assert title() in ("r1", "r2")
+    assert client.patch("/users/me", json={"full_name": "Buyer"}, headers=headers).status_code == 200
+    client.cookies.clear()
+    assert title(headers=headers) == "primary"
+    assert title() in ("r1", "r2")
+    monkeypatch.setattr(replicas, "REPLICA_STICKY_SECONDS", 0)
+    client.patch("/users/me", json={"full_name": "Buyer"}, headers=headers)
+    client.cookies.clear()
+    assert title(headers=headers) in ("r1", "r2")
+
+    for replica in replica_set.replicas:
+        replica.healthy = False
+    assert title() == "primary"
+    asyncio.run(replica_set.dispose())
@@ -0,0 +1,197 @@
+"""
+Виртуальная очередь перед покупкой: не больше WAITING_ROOM_CHECKOUTS одновременных
+оформлений заказа на событие.
+
+На старте продаж все клиенты разом бьют в POST /orders, встают в блокировки
+билетов и выбирают пул соединений — пропускная способность падает как раз
+тогда, когда нужна. С очередью лишние покупатели ждут не в базе, а здесь:
+
+  POST /events/{id}/queue  — встать в очередь (повторный вызов возвращает ту же запись);
+  GET  /events/{id}/queue  — позиция, оценка ожидания и, когда подошла очередь,
+                             admission_token;
+  POST /orders             — с заголовком X-Admission-Token; после успешной оплаты
+                             место освобождается и входит следующий.
+  POST /events/{id}/holds,
+  POST /holds/{id}/checkout — путь фронтенда: пропуск нужен и на бронь, и на оплату,
+                             место освобождается после оплаты или DELETE /holds/{id}
+                             с тем же заголовком.
+
+Пропуск живёт WAITING_ROOM_TOKEN_TTL секунд: неудачную покупку (место заняли)
+можно повторить тем же пропуском, брошенный пропуск сам освобождает место.
+Запись в очереди, которую не опрашивали WAITING_ROOM_POLL_TIMEOUT секунд,
+пропускается — ушедшие клиенты не держат очередь. Оценка ожидания — позиция,
+делённая на число мест, умноженная на среднее (EWMA) время оформления.
+
+Состояние — в памяти воркера, как кэш ответов: с несколькими воркерами лимит
+действует на каждый, и клиента нужно закреплять за воркером (sticky-сессии на
+балансировщике). WAITING_ROOM_CHECKOUTS=0 (по умолчанию) — очередь выключена,
+POST /orders работает без пропуска.
+"""
+import math
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+WAITING_ROOM_CHECKOUTS = int(os.getenv("WAITING_ROOM_CHECKOUTS", "0"))
+WAITING_ROOM_TOKEN_TTL = float(os.getenv("WAITING_ROOM_TOKEN_TTL", "120"))
+WAITING_ROOM_POLL_TIMEOUT = float(os.getenv("WAITING_ROOM_POLL_TIMEOUT", "30"))
+ADMISSION_HEADER = "X-Admission-Token"
+# начальная оценка времени оформления, пока нет замеров
+DEFAULT_CHECKOUT_SECONDS = 2.0
+EWMA_ALPHA = 0.2
+
+
+class AdmissionError(Exception):
+    """Пропуска нет, он истёк или выдан другому пользователю."""
+
+
+@dataclass
+class Admission:
+    event_id: int
+    user_id: int
+    token: str
+    admitted_at: float
+    expires_at: float
+
+
+@dataclass
+class _Entry:
+    user_id: int
+    seq: int
+    last_seen: float
+    admission: Admission = None
+
+
+class _Room:
+    def __init__(self, event_id: int):
+        self.event_id = event_id
+        self.waiting = deque()
+        self.entries = {}          # user_id -> _Entry (в очереди или с пропуском)
+        self.active = {}           # token -> Admission
+        self.next_seq = 0
+        self.served_seq = 0        # seq последней записи, вышедшей из очереди
+        self.checkout_seconds = DEFAULT_CHECKOUT_SECONDS
+
+    def _finish(self, admission: Admission, now: float):
+        self.active.pop(admission.token, None)
+        _tokens.pop(admission.token, None)
+        entry = self.entries.get(admission.user_id)
+        if entry is not None and entry.admission is admission:
+            del self.entries[admission.user_id]
+        held = min(now, admission.expires_at) - admission.admitted_at
+        self.checkout_seconds += EWMA_ALPHA * (held - self.checkout_seconds)
+
+    def advance(self, now: float):
+        """Снимает истёкшие пропуска и впускает следующих по очереди, пока есть места."""
+        for admission in [a for a in self.active.values() if a.expires_at <= now]:
+            self._finish(admission, now)
+        while self.waiting and len(self.active) < WAITING_ROOM_CHECKOUTS:
+            entry = self.waiting.popleft()
+            self.served_seq = entry.seq
+            if now - entry.last_seen > WAITING_ROOM_POLL_TIMEOUT:
+                self.entries.pop(entry.user_id, None)
+                continue
+            token = secrets.token_urlsafe(24)
+            entry.admission = Admission(self.event_id, entry.user_id, token, now, now + WAITING_ROOM_TOKEN_TTL)
+            self.active[token] = entry.admission
+            _tokens[token] = self
+
+    def status(self, entry: _Entry, now: float) -> dict:
+        if entry.admission is not None:
+            return {
+                "event_id": self.event_id,
+                "position": 0,
+                "estimated_wait": 0.0,
+                "admission_token": entry.admission.token,
+                "expires_in": round(entry.admission.expires_at - now, 1),
+            }
+        position = entry.seq - self.served_seq
+        return {
+            "event_id": self.event_id,
+            "position": position,
+            "estimated_wait": round(math.ceil(position / WAITING_ROOM_CHECKOUTS) * self.checkout_seconds, 1),
+            "admission_token": None,
+            "expires_in": None,
+        }
+
+
+_lock = threading.Lock()
+_rooms: dict[int, _Room] = {}
+_tokens: dict[str, _Room] = {}
+
+
+def enabled() -> bool:
+    return WAITING_ROOM_CHECKOUTS > 0
+
+
+def known(event_id: int) -> bool:
+    """Есть ли уже очередь события (тогда существование события в базе не проверяем)."""
+    return event_id in _rooms
+
+
+def join(event_id: int, user_id: int) -> dict:
+    now = time.monotonic()
+    with _lock:
+        room = _rooms.get(event_id)
+        if room is None:
+            room = _rooms[event_id] = _Room(event_id)
+        entry = room.entries.get(user_id)
+        if entry is None:
+            room.next_seq += 1
+            entry = room.entries[user_id] = _Entry(user_id, room.next_seq, now)
+            room.waiting.append(entry)
+        entry.last_seen = now
+        room.advance(now)
+        return room.status(entry, now)
+
+
+def position(event_id: int, user_id: int):
+    """Статус пользователя в очереди события; None — он не в очереди."""
+    now = time.monotonic()
+    with _lock:
+        room = _rooms.get(event_id)
+        entry = room.entries.get(user_id) if room is not None else None
+        if entry is None:
+            return None
+        entry.last_seen = now
+        room.advance(now)
+        if room.entries.get(user_id) is not entry:
+            return None  # пропуск истёк
+        return room.status(entry, now)
+
+
+def admit(token: str, user_id: int) -> Admission:
+    """Пропуск для оформления заказа; AdmissionError — если он недействителен."""
+    if not token:
+        raise AdmissionError("Admission token required: join the event queue first")
+    now = time.monotonic()
+    with _lock:
+        room = _tokens.get(token)
+        admission = room.active.get(token) if room is not None else None
+        if admission is None or admission.expires_at <= now:
+            if admission is not None:
+                room._finish(admission, now)
+                room.advance(now)
+            raise AdmissionError("Admission token expired or unknown")
+        if admission.user_id != user_id:
+            raise AdmissionError("Admission token belongs to another user")
+        return admission
+
+
+def release(admission: Admission):
+    """Оформление закончено: место отдаётся следующему в очереди."""
+    now = time.monotonic()
+    with _lock:
+        room = _rooms.get(admission.event_id)
+        if room is not None and admission.token in room.active:
+            room._finish(admission, now)
+            room.advance(now)
+
+
+def clear():
+    with _lock:
+        _rooms.clear()
+        _tokens.clear()
@@ -1,15 +1,38 @@
+"""
+Генератор тестовых данных: залы, события, билеты, покупатели и история продаж.
+
+    python generate-data.py                        # маленький набор (scale=1): 2 зала, 6 событий
+    python generate-data.py --scale 1000 --seed 7  # ~6k событий, ~2M билетов, 200k покупателей
+    GEN_SCALE=100 GEN_WORKERS=8 docker compose up data-generator
+
+Объёмы пропорциональны --scale: залов 2*scale, событий 6*scale, покупателей 200*scale.
+Одинаковые --seed и --anchor на пустой базе дают одинаковые данные: каждая сущность
+берёт свой random.Random(seed:вид:номер), id назначаются заранее (префиксные суммы
+по плану событий), поэтому результат не зависит от числа процессов. Исключение —
+Argon2-хеш пароля (соль случайная), он один на всех покупателей.
+
+Строки идут в COPY FROM STDIN прямо из генераторов (RowStream) — списков строк
+в памяти нет, кроме билетов одного события. Покупатели и пачки событий
+(--batch событий на транзакцию) раскладываются по --workers процессам.
+
+История продаж: у прошедших событий продано 60–100% билетов, большая часть
+активирована (activated), у будущих — 0–70%. Около 5% заказов возвращены: заказ
+'refunded', билеты 'canceled', в кошельке покупка и возврат. У каждого
+покупателя есть пополнение, итоговый баланс = сумма его wallet_transactions.
+"""
+import argparse
+import math
 import os
-import time
 import random
+import time
 import uuid
 from datetime import datetime, timedelta
+from multiprocessing import Pool
+
 from faker import Faker
 import psycopg2
-from psycopg2.extras import execute_values, Json
 from passlib.hash import argon2
 
-faker = Faker("ru_RU")
-
 PGHOST = os.environ.get("PGHOST", "db")
 PGPORT = int(os.environ.get("PGPORT", 5432))
 PGUSER = os.environ.get("PGUSER", "myuser")
@@ -18,6 +41,19 @@ PGDATABASE = os.environ.get("PGDATABASE", "mydatabase")
 
 DSN = f"host={PGHOST} port={PGPORT} dbname={PGDATABASE} user={PGUSER} password={PGPASSWORD}"
 
+USER_PASSWORD = "password123"
+TOPUP = 500000
+REFUND_RATE = 0.05
+USED_RATE = 0.85
+SALE_WINDOW_DAYS = 60
+ORDER_SIZES = (1, 1, 2, 2, 2, 3, 4)
+TIER_PRICES = {"VIP": 8000, "Standard": 3000, "Budget": 1500, "Dancefloor": 1000}
+DANCEFLOOR_SIZES = (0, 50, 100, 200, 500)
+
+SEQUENCE_TABLES = ("users", "venues", "seats", "events", "price_tiers", "tickets", "orders", "order_items",
+                   "wallet_transactions")
+
+
 def wait_for_db(max_attempts=30, delay=2.0):
     attempts = 0
     while attempts < max_attempts:
@@ -32,104 +68,252 @@ def wait_for_db(max_attempts=30, delay=2.0):
             time.sleep(delay)
     return False
 
+
+# ---------------- COPY из генераторов ----------------
+
+def _copy_value(v):
+    if v is None:
+        return "\\N"
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ") + "+00"
+    if isinstance(v, str):
+        return v.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return str(v)
+
+
+class RowStream:
+    """Файлоподобный объект для copy_expert: строки COPY (text) берутся из итератора по мере чтения."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = ""
+        self.count = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buf += "\t".join(map(_copy_value, row)) + "\n"
+            self.count += 1
+        if size < 0:
+            out, self._buf = self._buf, ""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+    readline = read
+
+
+def copy(cur, table, columns, rows) -> int:
+    stream = RowStream(rows)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+    return stream.count
+
+
+# ---------------- план ----------------
+
+def rng(seed, kind, n):
+    return random.Random(f"{seed}:{kind}:{n}")
+
+
+def venue_spec(seed, v):
+    r = rng(seed, "venue", v)
+    return r.randint(10, 30), r.randint(10, 30)  # рядов, мест в ряду
+
+
+def event_spec(ctx, i):
+    """Событие i: зал, жанр, дата и тарифы [(name, price, capacity, seated)] — только из seed."""
+    r = rng(ctx["seed"], "event", i)
+    v = r.randrange(len(ctx["venues"]))
+    venue_id, seat_base, rows, per_row = ctx["venues"][v]
+    seats = rows * per_row
+    start = ctx["anchor"] + timedelta(days=r.randint(-180, 180), hours=r.randint(10, 22))
+    vip, standard = seats // 10, seats // 2
+    tiers = [("VIP", vip, True), ("Standard", standard, True), ("Budget", seats - vip - standard, True),
+             ("Dancefloor", r.choice(DANCEFLOOR_SIZES), False)]
+    return {
+        "venue_id": venue_id,
+        "seat_base": seat_base,
+        "genre_id": r.choice(ctx["genres"]),
+        "start": start,
+        "tiers": [(name, TIER_PRICES[name], cap, seated) for name, cap, seated in tiers if cap > 0],
+    }
+
+
+def plan(ctx, events):
+    """[(i, tier_offset, ticket_offset)] — смещения id тарифов и билетов события."""
+    out, tier_offset, ticket_offset = [], 0, 0
+    for i in range(events):
+        spec = event_spec(ctx, i)
+        out.append((i, tier_offset, ticket_offset))
+        tier_offset += len(spec["tiers"])
+        ticket_offset += sum(cap for _, _, cap, _ in spec["tiers"])
+    return out, tier_offset, ticket_offset
+
+
+def event_tickets(spec, tier_id0):
+    """[(tier_id, price, seat_id)] билетов события: места раздаются сидячим тарифам подряд."""
+    tickets, seat = [], spec["seat_base"]
+    for k, (name, price, cap, seated) in enumerate(spec["tiers"]):
+        for _ in range(cap):
+            sid = None
+            if seated:
+                seat += 1
+                sid = seat
+            tickets.append((tier_id0 + k, price, sid))
+    return tickets
+
+
+def event_orders(ctx, i, spec, n_tickets):
+    """
+    Продажи события: [(order_no, user_id, created_at, status, ticket_indexes, refunded_at, used)].
+    Детерминированы по seed — одинаковы для всех таблиц, которые из них строятся.
+    """
+    r = rng(ctx["seed"], "sales", i)
+    sale_open = spec["start"] - timedelta(days=SALE_WINDOW_DAYS)
+    sale_end = min(spec["start"], ctx["anchor"])
+    if sale_end <= sale_open or not n_tickets:
+        return []
+    past = spec["start"] < ctx["anchor"]
+    fill = r.uniform(0.6, 1.0) if past else r.uniform(0.0, 0.7)
+    sold = r.sample(range(n_tickets), int(n_tickets * fill))
+    window = (sale_end - sale_open).total_seconds()
+
+    orders, pos = [], 0
+    while pos < len(sold):
+        size = r.choice(ORDER_SIZES)
+        created = sale_open + timedelta(seconds=int(window * r.random()))
+        refunded = r.random() < REFUND_RATE
+        refunded_at = created + timedelta(seconds=int((sale_end - created).total_seconds() * r.random())) if refunded else None
+        used = past and not refunded and r.random() < USED_RATE
+        user_id = ctx["user_base"] + r.randrange(ctx["users"]) + 1
+        orders.append((len(orders), user_id, created, "refunded" if refunded else "paid",
+                       sold[pos:pos + size], refunded_at, used))
+        pos += size
+    return orders
+
+
+# ---------------- строки таблиц ----------------
+
+def _events(ctx, batch):
+    for i, _, _ in batch:
+        spec = event_spec(ctx, i)
+        fake = Faker("ru_RU")
+        fake.seed_instance(f"{ctx['seed']}:event-text:{i}")
+        yield (ctx["base"]["events"] + i + 1, fake.catch_phrase()[:200], fake.text(max_nb_chars=300), spec["genre_id"],
+               spec["venue_id"], spec["start"], spec["start"] + timedelta(hours=3), "", ctx["anchor"])
+
+
+def _tiers(ctx, batch):
+    for i, tier_offset, _ in batch:
+        spec = event_spec(ctx, i)
+        for k, (name, price, cap, _) in enumerate(spec["tiers"]):
+            yield (ctx["base"]["price_tiers"] + tier_offset + k + 1, ctx["base"]["events"] + i + 1, name, price, cap)
+
+
+def _sales(ctx, batch):
+    """(event_id, ticket_offset, tickets, orders) по событиям пачки — одно событие в памяти за раз."""
+    for i, tier_offset, ticket_offset in batch:
+        spec = event_spec(ctx, i)
+        tickets = event_tickets(spec, ctx["base"]["price_tiers"] + tier_offset + 1)
+        yield ctx["base"]["events"] + i + 1, ticket_offset, tickets, event_orders(ctx, i, spec, len(tickets))
+
+
+def _tickets(ctx, batch):
+    for event_id, ticket_offset, tickets, orders in _sales(ctx, batch):
+        owner = {}
+        for _, user_id, _, status, indexes, _, used in orders:
+            state = "canceled" if status == "refunded" else ("activated" if used else "sold")
+            for k in indexes:
+                owner[k] = (user_id, state)
+        qr = rng(ctx["seed"], "qr", event_id)
+        for k, (tier_id, price, seat_id) in enumerate(tickets):
+            user_id, state = owner.get(k, (None, "available"))
+            yield (ctx["base"]["tickets"] + ticket_offset + k + 1, event_id, seat_id, tier_id, user_id, state, price,
+                   str(uuid.UUID(int=qr.getrandbits(128), version=4)), ctx["anchor"])
+
+
+def _orders(ctx, batch):
+    for _, ticket_offset, tickets, orders in _sales(ctx, batch):
+        for n, user_id, created, status, indexes, _, _ in orders:
+            total = sum(tickets[k][1] for k in indexes)
+            yield ctx["base"]["orders"] + ticket_offset + n + 1, user_id, total, status, "wallet", created
+
+
+def _order_items(ctx, batch):
+    for _, ticket_offset, tickets, orders in _sales(ctx, batch):
+        item = ctx["base"]["order_items"] + ticket_offset
+        for n, _, _, _, indexes, _, _ in orders:
+            for k in indexes:
+                item += 1
+                yield item, ctx["base"]["orders"] + ticket_offset + n + 1, ctx["base"]["tickets"] + ticket_offset + k + 1, tickets[k][1]
+
+
+def _event_transactions(ctx, batch):
+    # id после пополнений; на билет не больше двух записей (покупка и возврат)
+    for _, ticket_offset, tickets, orders in _sales(ctx, batch):
+        txn = ctx["base"]["wallet_transactions"] + ctx["users"] + 2 * ticket_offset
+        for _, user_id, created, _, indexes, refunded_at, _ in orders:
+            total = sum(tickets[k][1] for k in indexes)
+            txn += 1
+            yield txn, user_id, -total, "purchase", created
+            if refunded_at is not None:
+                txn += 1
+                yield txn, user_id, total, "refund", refunded_at
+
+
+def _users(ctx, start, count, password_hash):
+    fake = Faker("ru_RU")
+    fake.seed_instance(f"{ctx['seed']}:users:{start}")
+    for n in range(start, start + count):
+        user_id = ctx["user_base"] + n + 1
+        yield (user_id, f"user{user_id}@example.com", password_hash, fake.name(), "user", 0,
+               ctx["anchor"] - timedelta(days=400))
+
+
+def _topups(ctx, start, count):
+    for n in range(start, start + count):
+        yield (ctx["base"]["wallet_transactions"] + n + 1, ctx["user_base"] + n + 1, TOPUP, "topup",
+               ctx["anchor"] - timedelta(days=365))
+
+
+# ---------------- задачи процессов ----------------
+
+def generate_users(task):
+    ctx, start, count, password_hash = task
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        n = copy(cur, "users", ("id", "email", "password_hash", "full_name", "role", "wallet_balance", "created_at"),
+                 _users(ctx, start, count, password_hash))
+        copy(cur, "wallet_transactions", ("id", "user_id", "amount", "reason", "created_at"), _topups(ctx, start, count))
+    conn.close()
+    return "users", n
+
+
+def generate_events(task):
+    ctx, batch = task
+    with psycopg2.connect(DSN) as conn, conn.cursor() as cur:
+        copy(cur, "events", ("id", "title", "description", "genre_id", "venue_id", "start_datetime", "end_datetime",
+                             "poster_url", "created_at"), _events(ctx, batch))
+        copy(cur, "price_tiers", ("id", "event_id", "name", "price", "capacity"), _tiers(ctx, batch))
+        n = copy(cur, "tickets", ("id", "event_id", "seat_id", "tier_id", "user_id", "status", "price", "qr_code",
+                                  "created_at"), _tickets(ctx, batch))
+        copy(cur, "orders", ("id", "user_id", "total_amount", "status", "payment_method", "created_at"), _orders(ctx, batch))
+        copy(cur, "order_items", ("id", "order_id", "ticket_id", "price"), _order_items(ctx, batch))
+        copy(cur, "wallet_transactions", ("id", "user_id", "amount", "reason", "created_at"),
+             _event_transactions(ctx, batch))
+    conn.close()
+    return "tickets", n
+
+
+# ---------------- последовательная часть ----------------
+
 def insert_genres(cur):
     names = ["Концерт", "Выставка", "Фестиваль", "Театр", "Лекция", "Джаз", "EDM"]
     for n in names:
         cur.execute("INSERT INTO genres (name) VALUES (%s) ON CONFLICT (name) DO NOTHING", (n,))
     print("Genres inserted/checked")
 
-def insert_venues_and_seats(cur):
-    venues = []
-    for i in range(2):
-        name = faker.company()[:120]
-        address = faker.address().replace("\n", ", ")
-        seats_map = {}
-        cur.execute(
-            "INSERT INTO venues (name, address, seats_map_json) VALUES (%s, %s, %s) RETURNING id",
-            (name, address, Json(seats_map))
-        )
-        vid = cur.fetchone()[0]
-        venues.append(vid)
-
-        seat_rows = [chr(ord("A") + r) for r in range(20)]
-        seats_to_insert = []
-        for row in seat_rows:
-            for sn in range(1, 11):
-                seat_type = random.choice(["standard", "vip"])
-                base_price = 2000.00 if seat_type == "vip" else 1000.00
-                seats_to_insert.append((vid, row, sn, seat_type, base_price))
-        execute_values(
-            cur,
-            "INSERT INTO seats (venue_id, row_label, seat_number, seat_type, base_price) VALUES %s",
-            seats_to_insert
-        )
-        print(f"Venue {vid} and its seats inserted ({len(seats_to_insert)})")
-    return venues
-
-def insert_events_and_tiers_and_tickets(cur, venues):
-    cur.execute("SELECT id FROM genres")
-    genre_ids = [r[0] for r in cur.fetchall()]
-    assert genre_ids, "No genres found"
-
-    tier_price_map = { "VIP": 8000.0, "Standard": 3000.0, "Budget": 1500.0, "Dancefloor": 1000.0 }
-
-    for i in range(6):
-        venue_id = random.choice(venues)
-        genre_id = random.choice(genre_ids)
-        start_dt = datetime.utcnow() + timedelta(days=random.randint(1, 60), hours=random.randint(0,23))
-        end_dt = start_dt + timedelta(hours=3)
-        title = faker.catch_phrase()[:200]
-        description = faker.text(max_nb_chars=300)
-        poster = ""
-
-        cur.execute(
-            """INSERT INTO events (title, description, genre_id, venue_id, start_datetime, end_datetime, poster_url)
-               VALUES (%s,%s,%s,%s,%s,%s,%s) RETURNING id""",
-            (title, description, genre_id, venue_id, start_dt, end_dt, poster)
-        )
-        event_id = cur.fetchone()[0]
-
-        tiers = [
-            ("VIP", 8000.00, 20),
-            ("Standard", 3000.00, 100),
-            ("Budget", 1500.00, 80),
-            ("Dancefloor", 1000.00, 50)
-        ]
-        tier_ids = []
-        for name, price, capacity in tiers:
-            cur.execute(
-                "INSERT INTO price_tiers (event_id, name, price, capacity) VALUES (%s,%s,%s,%s) RETURNING id",
-                (event_id, name, price, capacity)
-            )
-            tier_ids.append(cur.fetchone()[0])
-
-        cur.execute("SELECT id FROM seats WHERE venue_id = %s", (venue_id,))
-        seat_ids = [r[0] for r in cur.fetchall()]
-        random.shuffle(seat_ids)
-
-        tickets_to_insert = []
-        seat_index = 0
-        for tid, (name, _, capacity) in zip(tier_ids, tiers):
-            cap = capacity if capacity else 0
-            for _ in range(cap):
-                sid = None
-                if name != "Dancefloor":
-                    if seat_index >= len(seat_ids):
-                        break
-                    sid = seat_ids[seat_index]
-                    seat_index += 1
-                price = tier_price_map.get(name, 1500.0)
-                qr = str(uuid.uuid4())
-                tickets_to_insert.append((event_id, sid, tid, None, "available", None, price, qr))
-
-        if tickets_to_insert:
-            execute_values(
-                cur,
-                """INSERT INTO tickets (event_id, seat_id, tier_id, user_id, status, hold_expires_at, price, qr_code)
-                   VALUES %s""",
-                tickets_to_insert
-            )
-        print(f"Event {event_id}: tiers and {len(tickets_to_insert)} tickets created")
 
 def insert_admin(cur):
     admin_email = "admin@admin.com"
@@ -150,22 +334,141 @@ def insert_admin(cur):
     print("Admin user ensured: admin@admin.com / admin123")
 
 
+def max_ids(cur):
+    base = {}
+    for table in SEQUENCE_TABLES:
+        cur.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        base[table] = cur.fetchone()[0]
+    return base
+
+
+def insert_venues_and_seats(cur, ctx, venues):
+    """Залы и места; возвращает [(venue_id, seat_base, rows, per_row)]."""
+    out, seat_base = [], ctx["base"]["seats"]
+    for v in range(venues):
+        rows, per_row = venue_spec(ctx["seed"], v)
+        out.append((ctx["base"]["venues"] + v + 1, seat_base, rows, per_row))
+        seat_base += rows * per_row
+
+    def venue_rows():
+        for v, (venue_id, _, _, _) in enumerate(out):
+            fake = Faker("ru_RU")
+            fake.seed_instance(f"{ctx['seed']}:venue-text:{v}")
+            yield venue_id, fake.company()[:120], fake.address().replace("\n", ", "), "{}"
+
+    def seat_rows():
+        for venue_id, base, rows, per_row in out:
+            seat_id = base
+            for r in range(rows):
+                vip = r < max(1, rows // 5)
+                for sn in range(1, per_row + 1):
+                    seat_id += 1
+                    yield seat_id, venue_id, f"R{r + 1:02d}", sn, "vip" if vip else "standard", 2000 if vip else 1000
+
+    copy(cur, "venues", ("id", "name", "address", "seats_map_json"), venue_rows())
+    n = copy(cur, "seats", ("id", "venue_id", "row_label", "seat_number", "seat_type", "base_price"), seat_rows())
+    print(f"{venues} venues and {n} seats inserted")
+    return out
+
+
+def finish(cur, ctx, first_event, last_event):
+    """Балансы, счётчики tier_inventory и последовательности id — set-based, после всех процессов."""
+    cur.execute(
+        """UPDATE users u SET wallet_balance = s.total
+           FROM (SELECT user_id, SUM(amount) AS total FROM wallet_transactions
+                 WHERE user_id > %s AND user_id <= %s GROUP BY user_id) s
+           WHERE u.id = s.user_id""",
+        (ctx["user_base"], ctx["user_base"] + ctx["users"])
+    )
+    # held/sold/has_seats появляются миграцией backend (0000) — если она уже прошла, считаем и их
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'tier_inventory'")
+    columns = {r[0] for r in cur.fetchall()}
+    extra = {
+        "held": "COUNT(*) FILTER (WHERE status = 'held')",
+        "sold": "COUNT(*) FILTER (WHERE status IN ('sold', 'activated'))",
+        "has_seats": "BOOL_OR(seat_id IS NOT NULL)",
+    }
+    extra = {name: expr for name, expr in extra.items() if name in columns}
+    names = ", ".join(["available"] + list(extra))
+    cur.execute(
+        f"""INSERT INTO tier_inventory (tier_id, event_id, {names})
+            SELECT tier_id, event_id, COUNT(*) FILTER (WHERE status = 'available')
+                   {''.join(', ' + expr for expr in extra.values())}
+            FROM tickets WHERE event_id > %s AND event_id <= %s
+            GROUP BY tier_id, event_id
+            ON CONFLICT (tier_id) DO UPDATE SET {', '.join(f'{n} = EXCLUDED.{n}' for n in ['available'] + list(extra))}""",
+        (first_event, last_event)
+    )
+    for table in SEQUENCE_TABLES:
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT MAX(id) FROM {table}), 1))")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Генератор тестовых данных")
+    parser.add_argument("--scale", type=float, default=float(os.environ.get("GEN_SCALE", 1)))
+    parser.add_argument("--seed", type=int, default=int(os.environ.get("GEN_SEED", 42)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("GEN_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--batch", type=int, default=int(os.environ.get("GEN_BATCH", 50)), help="событий на транзакцию")
+    parser.add_argument("--anchor", default=os.environ.get("GEN_ANCHOR"),
+                        help="\"сегодня\" для дат (YYYY-MM-DD), по умолчанию текущая дата")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     if not wait_for_db():
         print("DB not available, exiting")
         return
 
+    anchor = datetime.strptime(args.anchor, "%Y-%m-%d") if args.anchor else datetime.utcnow().replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    venues = max(1, math.ceil(2 * args.scale))
+    events = max(1, math.ceil(6 * args.scale))
+    users = max(1, math.ceil(200 * args.scale))
+    started = time.time()
+
     conn = psycopg2.connect(DSN)
     conn.autocommit = False
     cur = conn.cursor()
-
     try:
         insert_genres(cur)
         insert_admin(cur)
-        venues = insert_venues_and_seats(cur)
-        insert_events_and_tiers_and_tickets(cur, venues)
+        cur.execute("SELECT id FROM genres ORDER BY id")
+        genres = [r[0] for r in cur.fetchall()]
+        base = max_ids(cur)
+        ctx = {"seed": args.seed, "anchor": anchor, "genres": genres, "base": base,
+               "user_base": base["users"], "users": users}
+        ctx["venues"] = insert_venues_and_seats(cur, ctx, venues)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("Error during data generation:", e)
+        cur.close()
+        conn.close()
+        return
+
+    # id пополнений занимают первые users номеров wallet_transactions, затем по 2 на билет
+    batches, _, tickets = plan(ctx, events)
+    print(f"scale={args.scale} seed={args.seed}: {venues} venues, {events} events, {tickets} tickets, {users} users, "
+          f"{args.workers} workers")
+    password_hash = argon2.hash(USER_PASSWORD)
+    user_chunk = 10000
+    user_tasks = [(ctx, s, min(user_chunk, users - s), password_hash) for s in range(0, users, user_chunk)]
+    event_tasks = [(ctx, batches[s:s + args.batch]) for s in range(0, len(batches), args.batch)]
+
+    try:
+        with Pool(args.workers) as pool:
+            # билеты и заказы ссылаются на покупателей — сначала они
+            for _ in pool.imap_unordered(generate_users, user_tasks):
+                pass
+            done = 0
+            for _, n in pool.imap_unordered(generate_events, event_tasks):
+                done += n
+                print(f"  tickets: {done}/{tickets}")
+        finish(cur, ctx, base["events"], base["events"] + events)
         conn.commit()
-        print("Data generation finished successfully")
+        print(f"Data generation finished successfully in {time.time() - started:.1f}s "
+              f"(users password: {USER_PASSWORD})")
     except Exception as e:
         conn.rollback()
         print("Error during data generation:", e)
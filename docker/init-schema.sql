@@ -67,6 +67,28 @@ CREATE TABLE IF NOT EXISTS price_tiers (
     capacity INT
 );
 
+-- tier_inventory: счётчик свободных билетов по тарифу
+CREATE TABLE IF NOT EXISTS tier_inventory (
+    tier_id INT PRIMARY KEY REFERENCES price_tiers (id) ON DELETE CASCADE,
+    event_id INT REFERENCES events (id) ON DELETE CASCADE,
+    available INT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS ix_tier_inventory_event_id ON tier_inventory (event_id);
+
+-- ticket_holds: временные брони билетов
+CREATE TABLE IF NOT EXISTS ticket_holds (
+    id SERIAL PRIMARY KEY,
+    event_id INT REFERENCES events (id) ON DELETE CASCADE,
+    user_id INT REFERENCES users (id),
+    status VARCHAR(50) NOT NULL DEFAULT 'active',
+    quantity INT NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP
+    WITH
+        TIME ZONE DEFAULT now()
+);
+
 -- tickets
 CREATE TABLE IF NOT EXISTS tickets (
     id SERIAL PRIMARY KEY,
@@ -78,6 +100,7 @@ CREATE TABLE IF NOT EXISTS tickets (
     hold_expires_at TIMESTAMP
     WITH
         TIME ZONE,
+        hold_id INT REFERENCES ticket_holds (id) ON DELETE SET NULL,
         price NUMERIC(10, 2),
         qr_code VARCHAR(255),
         created_at TIMESTAMP
@@ -117,6 +140,7 @@ CREATE TABLE IF NOT EXISTS wallet_transactions (
 );
 
 -- Indexes for perf
-CREATE INDEX IF NOT EXISTS idx_events_start ON events (start_datetime);
+-- индексы горячих запросов создаёт backend при старте: backend/migrations (migrate.py)
 
-CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets (status);
\ No newline at end of file
+-- выборка просроченных броней для sweeper'а
+CREATE INDEX IF NOT EXISTS idx_tickets_held_expiry ON tickets (hold_expires_at) WHERE status = 'held';
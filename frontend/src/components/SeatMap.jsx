@@ -1,14 +1,70 @@
 "use client"
-import { useEffect, useState } from "react"
+import { useEffect, useRef, useState } from "react"
+
+const API = "http://127.0.0.1:8000"
+// изменения приходят push'ем (SSE), опрос — только страховка
+const POLL_MS = 30000
+
+// 2 бита на место: 0 свободно, 1 забронировано, 2 продано
+const decodeBitmap = (b64, count) => {
+  const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0))
+  const codes = new Array(count)
+  for (let i = 0; i < count; i++) codes[i] = (bytes[i >> 2] >> ((i & 3) * 2)) & 3
+  return codes
+}
 
 export default function SeatMap({ eventId, tierId, selected, onChange }) {
-  const [tickets, setTickets] = useState([])
+  const [seats, setSeats] = useState([])   // [[ticket_id, row_label, seat_number], ...]
+  const [codes, setCodes] = useState([])
+  const state = useRef({ version: null, layoutVersion: null, ordinal: {} })
 
   useEffect(() => {
     if (!tierId) return
-    fetch(`http://127.0.0.1:8000/events/${eventId}/tickets?tier_id=${tierId}`)
-      .then(r => r.json())
-      .then(setTickets)
+    let cancelled = false
+    state.current = { version: null, layoutVersion: null, ordinal: {} }
+
+    const loadLayout = async () => {
+      const layout = await fetch(`${API}/events/${eventId}/tiers/${tierId}/layout`).then(r => r.json())
+      if (cancelled) return
+      state.current.layoutVersion = layout.layout_version
+      state.current.ordinal = Object.fromEntries(layout.seats.map(([id], i) => [id, i]))
+      setSeats(layout.seats)
+    }
+
+    const poll = async () => {
+      const since = state.current.version ? `?since=${state.current.version}` : ""
+      const data = await fetch(`${API}/events/${eventId}/tiers/${tierId}/availability${since}`).then(r => r.json())
+      if (cancelled) return
+      if (data.layout_version !== state.current.layoutVersion) await loadLayout()
+      state.current.version = data.version
+      if (data.bitmap !== undefined) {
+        setCodes(decodeBitmap(data.bitmap, data.count))
+      } else if (data.changes.length) {
+        setCodes(prev => {
+          const next = prev.slice()
+          data.changes.forEach(([i, code]) => { next[i] = code })
+          return next
+        })
+      }
+    }
+
+    const applyChanges = changes => setCodes(prev => {
+      const next = prev.slice()
+      changes.forEach(([id, code]) => {
+        const i = state.current.ordinal[id]
+        if (i !== undefined) next[i] = code
+      })
+      return next
+    })
+
+    const stream = new EventSource(`${API}/events/${eventId}/seats/stream`)
+    stream.onmessage = e => applyChanges(JSON.parse(e.data))
+    // сервер сбросил нашу очередь (не успевали читать) — берём полный снимок
+    stream.addEventListener("resync", () => { state.current.version = null; poll() })
+
+    loadLayout().then(poll)
+    const timer = setInterval(poll, POLL_MS)
+    return () => { cancelled = true; clearInterval(timer); stream.close() }
   }, [eventId, tierId])
 
   const toggle = id => {
@@ -21,19 +77,22 @@ export default function SeatMap({ eventId, tierId, selected, onChange }) {
 
   return (
     <div className="grid grid-cols-6 gap-2 mb-3">
-      {tickets.map(t => (
-        <button
-          key={t.id}
-          disabled={t.status !== "available"}
-          onClick={() => toggle(t.id)}
-          className={`p-2 text-xs rounded border
-            ${selected.includes(t.id) ? "bg-orange-400" : "bg-gray-100"}
-            ${t.status !== "available" && "opacity-40 cursor-not-allowed"}
-          `}
-        >
-          {t.row_label}{t.seat_number}
-        </button>
-      ))}
+      {seats.map(([id, row, number], i) => {
+        const taken = codes[i] !== 0
+        return (
+          <button
+            key={id}
+            disabled={taken}
+            onClick={() => toggle(id)}
+            className={`p-2 text-xs rounded border
+              ${selected.includes(id) ? "bg-orange-400" : "bg-gray-100"}
+              ${taken && "opacity-40 cursor-not-allowed"}
+            `}
+          >
+            {row}{number}
+          </button>
+        )
+      })}
     </div>
   )
 }
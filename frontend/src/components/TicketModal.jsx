@@ -17,6 +17,7 @@ export default function TicketModal({ open, onClose, event }) {
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState("")
   const [success, setSuccess] = useState("")
+  const [queueInfo, setQueueInfo] = useState(null)
 
   // загрузка avail/has_seats
   useEffect(() => {
@@ -27,30 +28,20 @@ export default function TicketModal({ open, onClose, event }) {
     setSelectedSeats([])
     setError("")
     setSuccess("")
+    setQueueInfo(null)
     setAvailableMap({})
 
-    const token = localStorage.getItem("access_token")
-
-    // получаем для каждого тарифа available + has_seats
-    Promise.all(
-      (event.price_tiers || []).map(async (t) => {
-        try {
-          const res = await fetch(
-            `http://127.0.0.1:8000/events/${event.id}/tier/${t.id}/available`,
-            { headers: token ? { Authorization: `Bearer ${token}` } : {} }
-          )
-          const data = await res.json().catch(() => ({}))
-          // fallback на sensible defaults
-          return [t.id, { available: Number(data.available ?? 0), has_seats: Boolean(data.has_seats) }]
-        } catch (e) {
-          return [t.id, { available: 0, has_seats: false }]
-        }
+    // available + has_seats всех тарифов одним запросом
+    fetch(`http://127.0.0.1:8000/events/${event.id}/availability`)
+      .then(r => r.ok ? r.json() : { tiers: [] })
+      .then((data) => {
+        setAvailableMap(Object.fromEntries(
+          data.tiers.map(t => [t.tier_id, { available: Number(t.available ?? 0), has_seats: Boolean(t.has_seats) }])
+        ))
+      })
+      .catch((e) => {
+        console.error("Failed to fetch tier availability", e)
       })
-    ).then((arr) => {
-      setAvailableMap(Object.fromEntries(arr))
-    }).catch((e) => {
-      console.error("Failed to fetch tier availability", e)
-    })
   }, [open, event])
 
   if (!open || !event) return null
@@ -63,6 +54,23 @@ export default function TicketModal({ open, onClose, event }) {
   // total: если сидячие — считаем по выбранным местам, иначе по qty
   const total = (tierHasSeats ? selectedSeats.length : qty) * Number(selectedTier?.price ?? 0)
 
+  // очередь на покупку (если включена на backend): ждём admission_token, иначе null
+  const waitForAdmission = async (headers) => {
+    const joinRes = await fetch(`http://127.0.0.1:8000/events/${event.id}/queue`, { method: "POST", headers })
+    if (joinRes.status === 404) return null
+    if (!joinRes.ok) throw new Error(`Ошибка очереди ${joinRes.status}`)
+    let status = await joinRes.json()
+    while (!status.admission_token) {
+      setQueueInfo(status)
+      await new Promise(resolve => setTimeout(resolve, 2000))
+      const res = await fetch(`http://127.0.0.1:8000/events/${event.id}/queue`, { headers })
+      if (!res.ok) throw new Error("Место в очереди потеряно, попробуйте ещё раз")
+      status = await res.json()
+    }
+    setQueueInfo(null)
+    return status.admission_token
+  }
+
   const handlePurchase = async () => {
     setError("")
     if (!user) return setError("Нужно войти в аккаунт")
@@ -80,18 +88,36 @@ export default function TicketModal({ open, onClose, event }) {
     }
 
     setLoading(true)
+    const headers = {
+      "Content-Type": "application/json",
+      Authorization: `Bearer ${localStorage.getItem("access_token")}`
+    }
+    let holdId = null
     try {
-      const res = await fetch("http://127.0.0.1:8000/orders", {
+      const admissionToken = await waitForAdmission(headers)
+      if (admissionToken) headers["X-Admission-Token"] = admissionToken
+
+      // сначала короткая бронь мест, затем оплата брони
+      const holdRes = await fetch(`http://127.0.0.1:8000/events/${event.id}/holds`, {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          Authorization: `Bearer ${localStorage.getItem("access_token")}`
-        },
+        headers,
         body: JSON.stringify(payload)
       })
+      if (!holdRes.ok) {
+        const d = await holdRes.json().catch(() => ({}))
+        throw new Error(d.detail || `Ошибка ${holdRes.status}`)
+      }
+      holdId = (await holdRes.json()).id
+
+      const res = await fetch(`http://127.0.0.1:8000/holds/${holdId}/checkout`, {
+        method: "POST",
+        headers
+      })
 
       if (!res.ok) {
         const d = await res.json().catch(() => ({}))
+        // не удалось оплатить — отпускаем места сразу, не дожидаясь истечения брони
+        fetch(`http://127.0.0.1:8000/holds/${holdId}`, { method: "DELETE", headers }).catch(() => {})
         throw new Error(d.detail || `Ошибка ${res.status}`)
       }
 
@@ -114,6 +140,7 @@ export default function TicketModal({ open, onClose, event }) {
     } catch (err) {
       setError(err.message || "Ошибка покупки")
     } finally {
+      setQueueInfo(null)
       setLoading(false)
     }
   }
@@ -195,6 +222,11 @@ export default function TicketModal({ open, onClose, event }) {
               <div className="text-lg font-semibold">{total}₽</div>
             </div>
 
+            {queueInfo && (
+              <div className="text-sm text-gray-600">
+                Вы в очереди: позиция {queueInfo.position}, ожидание ~{Math.ceil(queueInfo.estimated_wait)} с
+              </div>
+            )}
             {error && <div className="text-red-500 text-sm">{error}</div>}
             {success && <div className="text-green-600 text-sm">{success}</div>}
           </div>
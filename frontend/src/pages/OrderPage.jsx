@@ -8,21 +8,25 @@ export default function OrdersPage() {
   const [orders, setOrders] = useState([])
   const [loading, setLoading] = useState(true)
   const [openOrder, setOpenOrder] = useState(null)
+  const [nextCursor, setNextCursor] = useState(null)
 
-  const fetchOrders = async () => {
+  // cursor — следующая страница (заголовок X-Next-Cursor), без него — первая
+  const fetchOrders = async (cursor = null) => {
     if (!user) return
     setLoading(true)
     try {
       const token = localStorage.getItem("access_token")
-      const res = await fetch("http://127.0.0.1:8000/orders/me", {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : ""
+      const res = await fetch(`http://127.0.0.1:8000/orders/me${query}`, {
         headers: { Authorization: `Bearer ${token}` }
       })
       if (!res.ok) throw res
       const data = await res.json()
-      setOrders(data)
+      setOrders(prev => cursor ? [...prev, ...data] : data)
+      setNextCursor(res.headers.get("X-Next-Cursor"))
     } catch (err) {
       console.error(err)
-      setOrders([])
+      if (!cursor) setOrders([])
     } finally {
       setLoading(false)
     }
@@ -77,6 +81,16 @@ export default function OrdersPage() {
         ))}
       </div>
 
+      {nextCursor && (
+        <button
+          className="mt-4 w-full border rounded p-2 hover:bg-gray-50 disabled:opacity-50"
+          disabled={loading}
+          onClick={() => fetchOrders(nextCursor)}
+        >
+          Показать ещё
+        </button>
+      )}
+
       {openOrder && (
         <OrderModal
           order={openOrder}